@@ -68,6 +68,8 @@ setup(name=PACKAGE,
       entry_points={
           'console_scripts': [
               'socos = socos.runner:main',
+              'socosd = socos.daemon:main',
+              'socosc = socos.client:main',
           ]
       },
 	  classifiers=CLASSIFIERS,
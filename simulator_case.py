@@ -0,0 +1,142 @@
+"""The base class of the tests running socos against simulated speakers
+
+The tests run socos commands against socos.simulator, the way they would
+run against real speakers, and check their output and the state the
+simulated speakers end up in. The tests of all test modules share the
+simulated speakers, test.py runs them after the doctests.
+"""
+
+import atexit
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from collections import namedtuple
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+import soco
+
+from socos.cache import QUERY_CACHE
+from socos.core import SoCos
+from socos.simulator import SimulatedSystem
+from socos.utils import COORDINATOR_CACHE
+
+# The simulated speakers, started once for all tests
+SYSTEM = SimulatedSystem(speakers=3, queue_size=30, library_size=100)
+
+# An event as delivered by soco to the event queue of a subscription
+Event = namedtuple('Event', 'variables')
+
+
+def start_simulator():
+    """Start the simulated speakers and discover them instead of real ones"""
+    SYSTEM.start()
+    SimulatorTestCase.discover = soco.discover
+    soco.discover = SYSTEM.discover
+
+
+def stop_simulator():
+    """Stop the simulated speakers"""
+    soco.discover = SimulatorTestCase.discover
+    SYSTEM.stop()
+
+
+class SimulatorTestCase(unittest.TestCase):
+    """Base class running every test with a new socos like a new process
+
+    The simulated speakers are reset, every speaker a group of its own, and
+    socos gets an empty cache directory.
+    """
+
+    discover = None
+
+    @classmethod
+    def setUpClass(cls):
+        # The simulated speakers are started for the first test needing them
+        # and run until all tests are done
+        if SimulatorTestCase.discover is None:
+            start_simulator()
+            atexit.register(stop_simulator)
+
+    def setUp(self):
+        # pylint: disable=protected-access,no-member
+        SYSTEM.reset()
+        soco.SoCo._instances.clear()
+        soco.services.zone_group_state_shared_cache.clear()
+        COORDINATOR_CACHE.clear()
+        QUERY_CACHE.clear()
+        QUERY_CACHE.enabled = True
+
+        self.cache_dir = tempfile.mkdtemp(prefix='socos-test-')
+        os.environ['SOCOS_CACHE_DIR'] = self.cache_dir
+        self.socos = SoCos()
+        self.ips = [speaker.ip_address for speaker in SYSTEM.speakers]
+
+    def tearDown(self):
+        self.socos.http_pool.uninstall()
+        self.socos.http_pool.close()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    @staticmethod
+    def group():
+        """Put all simulated speakers in the group of the first one"""
+        for speaker in SYSTEM.speakers:
+            speaker.coordinator = SYSTEM.speakers[0]
+
+    def run_cmd(self, *args):
+        """Run a command and return whether it succeeded and its output
+
+        Returns:
+            tuple: The success, the lines printed to stdout and the lines
+            printed to stderr
+        """
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = StringIO(), StringIO()
+        try:
+            success = self.socos.process_cmd(list(args))
+            out, err = sys.stdout.getvalue(), sys.stderr.getvalue()
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+        return success, out.splitlines(), err.splitlines()
+
+
+class StubSubscription(object):
+    # pylint: disable=too-few-public-methods,useless-object-inheritance
+    """Stands in for a soco subscription, delivering events right away"""
+
+    subscriptions = []
+
+    def __init__(self, service, event_queue, events):
+        self.service = service
+        self.is_subscribed = True
+        self.time_left = 100
+        for variables in events.get(service.service_type, []):
+            event_queue.put(Event(variables))
+        self.subscriptions.append(self)
+
+    def unsubscribe(self):
+        """End the subscription"""
+        self.is_subscribed = False
+
+
+def stub_subscribe(events):
+    """Let subscriptions deliver events right away instead of subscribing
+
+    Args:
+        events (dict): The evented variables of every event, per service
+            type
+
+    Returns:
+        function: The original Service.subscribe, for the caller to restore
+    """
+    subscribe = soco.services.Service.subscribe
+    StubSubscription.subscriptions = []
+    soco.services.Service.subscribe = \
+        lambda service, **kwargs: StubSubscription(
+            service, kwargs['event_queue'], events)
+    return subscribe
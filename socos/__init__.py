@@ -1,6 +1,7 @@
 """socos is a commandline tool for controlling Sonos speakers"""
 
-from .core import SoCos
+import sys
+import types
 
 # Will be parsed by setup.py to determine package metadata
 __author__ = 'SoCo team <python-soco@googlegroups.com>'
@@ -9,4 +10,29 @@ __website__ = 'https://github.com/SoCo/socos'
 __license__ = 'MIT License'
 
 
-__all__ = ['SoCos']
+__all__ = ['SoCos']  # pylint: disable=undefined-all-variable
+
+
+def __getattr__(name):
+    """Import SoCos on first use, so that e.g. socos.client stays light"""
+    if name == 'SoCos':
+        # pylint: disable=bad-option-value,import-outside-toplevel
+        from .core import SoCos
+        return SoCos
+    raise AttributeError(
+        "module 'socos' has no attribute '{}'".format(name))
+
+
+if sys.version_info < (3, 7):
+    # Module level __getattr__ is only called from Python 3.7 on. Before,
+    # the package is replaced by a module object calling it.
+    # pylint: disable=useless-object-inheritance,too-few-public-methods
+    class _Package(types.ModuleType):
+        """The socos package, importing SoCos on first use"""
+
+        def __getattr__(self, name):
+            return __getattr__(name)
+
+    _PACKAGE = _Package(__name__, __doc__)
+    _PACKAGE.__dict__.update(globals())
+    sys.modules[__name__] = _PACKAGE
@@ -0,0 +1,296 @@
+"""Benchmarks of socos commands against simulated speakers
+
+Run with "python -m socos.benchmark". Every scenario runs a socos command
+against the speakers of socos.simulator, the way a new socos process would,
+and reports the number of requests it sent and its wall time. The request
+counts do not depend on the machine, so every scenario has a budget and the
+benchmark fails when a command needs more requests than that.
+
+The startup scenarios run socos in a new Python process and report the
+modules it imports and the time that takes. Their budget is the number of
+modules imported on top of the ones the interpreter imports itself, and
+some modules must not be imported at all.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+import soco
+
+from socos.cache import QUERY_CACHE
+from socos.core import SoCos
+from socos.profiler import Profiler, parse_import_times, percentile
+from socos.simulator import SimulatedSystem
+from socos.utils import COORDINATOR_CACHE
+
+# The scenarios as (name, command, request budget), {ip} is replaced with
+# the address of the first simulated speaker and {ip2} with the second
+SCENARIOS = [
+    ('queue', 'queue {ip}', 13),
+    ('queue range', 'queue {ip} 500..600', 5),
+    ('current', 'current {ip}', 3),
+    ('volume +5', 'volume {ip} +5', 1),
+    ('remove 1..100', 'remove {ip} 1..100', 14),
+    ('queue copy', 'queue {ip} copy {ip2} replace', 77),
+    ('tracks foo', 'tracks {ip} foo', 3),
+    ('tracks foo add 1', 'tracks {ip} foo add 1', 6),
+    ('tracks foo add 1..50', 'tracks {ip} foo add 1..50', 9),
+    ('list', 'list', 0),
+    ('list --refresh', 'list --refresh', 6),
+]
+
+# The startup scenarios as (name, command, module budget, modules that must
+# not be imported). The budgets are the most modules a clean CPython 3.7 to
+# 3.13 imported, argparse alone costs about 30 of them and soco with
+# requests about 270. Interpreters whose site-packages import modules on
+# startup already count fewer.
+STARTUP_SCENARIOS = [
+    ('startup help', 'help', 61,
+     ['soco', 'requests', 'readline', 'colorama', 'sqlite3']),
+    ('startup volume', 'volume {ip}', 300,
+     ['readline', 'colorama', 'sqlite3']),
+]
+
+# Runs socos with the arguments following -c in a new interpreter
+STARTUP_SCRIPT = ('import sys; from socos.runner import main; '
+                  'sys.argv[0] = "socos"; main()')
+
+
+def parse_args(args):
+    """Parse the benchmark options"""
+    parser = argparse.ArgumentParser(
+        prog='python -m socos.benchmark',
+        description='Run socos commands against simulated speakers and '
+        'report their requests and wall time.')
+    parser.add_argument(
+        'scenarios', nargs='*', metavar='SCENARIO',
+        help='the scenarios to run, by default all of them')
+    parser.add_argument(
+        '--latency', type=float, default=2.0, metavar='MS',
+        help='the simulated latency of every request (default: 2)')
+    parser.add_argument(
+        '--iterations', type=int, default=5, metavar='N',
+        help='the number of runs of every scenario (default: 5)')
+    parser.add_argument(
+        '--speakers', type=int, default=3, metavar='N',
+        help='the number of simulated speakers (default: 3)')
+    parser.add_argument(
+        '--queue-size', type=int, default=1000, metavar='N',
+        help='the number of tracks in the queues (default: 1000)')
+    parser.add_argument(
+        '--library-size', type=int, default=2000, metavar='N',
+        help='the number of tracks in the music library (default: 2000)')
+    parser.add_argument(
+        '-v', '--verbose', action='store_true',
+        help='show the requests of every scenario per UPnP action')
+    return parser.parse_args(args)
+
+
+def run_command(system, command):
+    """Run a command like a new socos process would
+
+    Returns:
+        tuple: Whether the command succeeded, the number of requests the
+        speakers received, the number of connections opened, the profiler
+        holding the requests and the wall time in seconds
+    """
+    # Forget the SoCo instances and everything they cached
+    # pylint: disable=protected-access,no-member
+    soco.SoCo._instances.clear()
+    soco.services.zone_group_state_shared_cache.clear()
+    COORDINATOR_CACHE.clear()
+    QUERY_CACHE.clear()
+    # socos runs a single command with the query cache off, see runner
+    QUERY_CACHE.enabled = False
+    system.reset()
+
+    socos = SoCos()
+    profiler = Profiler()
+    socos.http_pool.listeners.append(profiler.record)
+    requests_before = system.requests
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        start = time.time()
+        success = socos.process_cmd(command.split())
+        seconds = time.time() - start
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    connections = sum(
+        opened for _, opened in socos.http_pool.stats().values())
+    socos.http_pool.uninstall()
+    socos.http_pool.close()
+    return (success, system.requests - requests_before, connections,
+            profiler, seconds)
+
+
+def run_scenario(system, command, iterations):
+    """Run a scenario once to warm up and then iterations times
+
+    Returns:
+        tuple: Whether all runs succeeded, the highest number of requests
+        and connections of a run, the profiler of the last run and the wall
+        times of all runs
+    """
+    run_command(system, command)
+    success, requests, connections, times = True, 0, 0, []
+    profiler = None
+    for _ in range(iterations):
+        result = run_command(system, command)
+        success = success and result[0]
+        requests = max(requests, result[1])
+        connections = max(connections, result[2])
+        profiler = result[3]
+        times.append(result[4])
+    return success, requests, connections, profiler, times
+
+
+def import_times(args):
+    """Return the imports of a new Python process run with args
+
+    Returns:
+        list: The imports as returned by parse_import_times
+    """
+    with open(os.devnull, 'w') as devnull:
+        process = subprocess.Popen(
+            [sys.executable, '-X', 'importtime'] + args,
+            stdout=devnull, stderr=subprocess.PIPE, universal_newlines=True)
+        _, errors = process.communicate()
+    return parse_import_times(errors.splitlines())
+
+
+def imported_of(packages, modules):
+    """Return the packages of which modules holds the package or a submodule
+
+    Submodules count as well, -X importtime does not always list the
+    package itself.
+
+    >>> imported_of(['soco', 'readline'], set(['soco.core', 'json']))
+    ['soco']
+    """
+    return [package for package in packages
+            if any(module == package or module.startswith(package + '.')
+                   for module in modules)]
+
+
+def run_startup_scenario(command, iterations):
+    """Start socos with command in new processes
+
+    Returns:
+        tuple: The modules imported on top of those of the interpreter, the
+        names of all imported modules and the import times in milliseconds
+        of all runs
+    """
+    baseline = import_times(['-c', 'pass'])
+    baseline_time = sum(entry[2] for entry in baseline if entry[3] == 0)
+    modules, times = set(), []
+    for _ in range(iterations):
+        imports = import_times(['-c', STARTUP_SCRIPT] + command.split())
+        modules = set(entry[0] for entry in imports)
+        import_time = sum(entry[2] for entry in imports if entry[3] == 0)
+        times.append(import_time - baseline_time)
+    return len(modules) - len(baseline), modules, times
+
+
+def run_startup_scenarios(options, speakers, row):
+    """Run the selected startup scenarios, returns the number of failures"""
+    failures = 0
+    for name, command, budget, forbidden in STARTUP_SCENARIOS:
+        if options.scenarios and name not in options.scenarios:
+            continue
+        count, modules, times = run_startup_scenario(
+            command.format(ip=speakers[0].ip_address), options.iterations)
+        line = row.format(name, count, budget, '',
+                          '{:.1f}'.format(percentile(times, 0.5)),
+                          '{:.1f}'.format(percentile(times, 0.95)))
+        imported = imported_of(forbidden, modules)
+        if imported:
+            line += '  IMPORTS ' + ', '.join(imported)
+            failures += 1
+        elif count > budget:
+            line += '  OVER BUDGET'
+            failures += 1
+        print(line)
+    return failures
+
+
+def main(args=None):  # pylint: disable=too-many-locals
+    """Run the benchmark and return the exit code"""
+    options = parse_args(sys.argv[1:] if args is None else args)
+    names = [name for name, _, _ in SCENARIOS] + \
+        [name for name, _, _, _ in STARTUP_SCENARIOS]
+    for name in options.scenarios:
+        if name not in names:
+            print('Unknown scenario "{}", choose from: {}'.format(
+                name, ', '.join(names)), file=sys.stderr)
+            return 2
+
+    # Keep the speaker cache and the music library index of the user alone
+    cache_dir = tempfile.mkdtemp(prefix='socos-benchmark-')
+    os.environ['SOCOS_CACHE_DIR'] = cache_dir
+    system = SimulatedSystem(
+        speakers=options.speakers, queue_size=options.queue_size,
+        library_size=options.library_size, latency=options.latency / 1000.0)
+    discover = soco.discover
+    soco.discover = system.discover
+    system.start()
+
+    row = '{:<20} {:>8} {:>6} {:>11} {:>9} {:>9}'
+    print(row.format('Scenario', 'Requests', 'Budget', 'Connections',
+                     'p50 ms', 'p95 ms'))
+    failures = 0
+    try:
+        for name, command, budget in SCENARIOS:
+            if options.scenarios and name not in options.scenarios:
+                continue
+            speakers = system.speakers
+            success, requests, connections, profiler, times = run_scenario(
+                system, command.format(
+                    ip=speakers[0].ip_address,
+                    ip2=speakers[min(1, len(speakers) - 1)].ip_address),
+                options.iterations)
+            times = [seconds * 1000 for seconds in times]
+            line = row.format(
+                name, requests, budget, connections,
+                '{:.1f}'.format(percentile(times, 0.5)),
+                '{:.1f}'.format(percentile(times, 0.95)))
+            if not success:
+                line += '  FAILED'
+                failures += 1
+            elif requests > budget:
+                line += '  OVER BUDGET'
+                failures += 1
+            print(line)
+            if options.verbose:
+                for summary_line in profiler.summary():
+                    print('    ' + summary_line)
+
+        # -X importtime is only available from Python 3.7 on
+        if sys.version_info >= (3, 7):
+            print()
+            print(row.format('Startup', 'Modules', 'Budget', '',
+                             'p50 ms', 'p95 ms'))
+            failures += run_startup_scenarios(options, system.speakers, row)
+    finally:
+        system.stop()
+        soco.discover = discover
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    if failures:
+        print('{} of the scenarios failed or went over budget'.format(
+            failures))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
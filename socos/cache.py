@@ -0,0 +1,410 @@
+"""Caches used by socos to avoid repeating expensive network operations"""
+
+import os
+import time
+import errno
+import tempfile
+import threading
+
+from socos.utils import (
+    LazyModule, TTLCache, expand_network, iter_concurrently,
+    run_concurrently)
+
+# pylint: disable=invalid-name
+ElementTree = LazyModule('xml.etree.ElementTree')
+json = LazyModule('json')
+requests = LazyModule('requests')
+soco = LazyModule('soco')
+
+# Seconds after which the speaker cache is considered expired, can be
+# overridden with the SOCOS_CACHE_TTL environment variable
+SPEAKER_CACHE_TTL = 24 * 60 * 60
+
+# The seconds socos waits at exit for a background refresh of the speaker
+# cache. The discovery returns with the first speaker that answers, so the
+# refresh usually takes well below a second.
+REVALIDATION_WAIT = 3
+
+# The device description every speaker serves on port 1400
+DEVICE_DESCRIPTION_URL = 'http://{}:1400/xml/device_description.xml'
+
+# The number of addresses probed at a time and the seconds a probed address
+# may take to answer. A whole /24 is probed at once, so a scan takes about
+# as long as the timeout.
+SCAN_WORKERS = 256
+SCAN_TIMEOUT = 0.5
+
+# The seconds the multicast discovery runs during a scan
+SCAN_DISCOVERY_TIMEOUT = 1
+
+# The seconds the results of the speaker queries are cached for. The
+# transport state and the current track change on their own, so they are
+# only kept for a few seconds.
+QUERY_TTLS = {
+    'info': 60 * 60,
+    'player_name': 10 * 60,
+    'mode': 60,
+    'bass': 60,
+    'treble': 60,
+    'state': 2,
+    'current': 2,
+    # Tells whether the cached music library search results are still
+    # valid, see MusicLibrary._search
+    'library_update_id': 60,
+}
+
+
+def cache_dir():
+    """Return the directory socos stores its cache files in
+
+    The directory is $SOCOS_CACHE_DIR if set, otherwise the socos directory
+    below $XDG_CACHE_HOME (defaulting to ~/.cache).
+    """
+    if os.environ.get('SOCOS_CACHE_DIR'):
+        return os.environ['SOCOS_CACHE_DIR']
+    base = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'socos')
+
+
+def cache_path(filename):
+    """Return the full path of a file in the socos cache directory"""
+    return os.path.join(cache_dir(), filename)
+
+
+def write_atomic(path, data):
+    """Write data to path atomically, creating the directory if needed
+
+    Writing to a temporary file first guarantees that a concurrently running
+    socos never reads a half written cache file.
+    """
+    try:
+        os.makedirs(os.path.dirname(path))
+    except OSError as ex:
+        if ex.errno != errno.EEXIST:
+            raise
+
+    # A temporary file of its own for every writer, also for threads of the
+    # same process, e.g. the background refresh and the daemon
+    handle, tmp_path = tempfile.mkstemp(
+        prefix=os.path.basename(path) + '.', suffix='.tmp',
+        dir=os.path.dirname(path))
+    try:
+        with os.fdopen(handle, 'w') as tmp_file:
+            tmp_file.write(data)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def parse_device_description(content):
+    """Return (uid, name) from a device description, None if not a speaker
+
+    >>> parse_device_description(
+    ...     '<root xmlns="urn:schemas-upnp-org:device-1-0"><device>'
+    ...     '<UDN>uuid:RINCON_000E58A0123401400</UDN>'
+    ...     '<roomName>Kitchen</roomName></device></root>')
+    ('RINCON_000E58A0123401400', 'Kitchen')
+    """
+    namespace = '{urn:schemas-upnp-org:device-1-0}'
+    try:
+        device = ElementTree.fromstring(content).find(namespace + 'device')
+    except ElementTree.ParseError:
+        return None
+    if device is None:
+        return None
+    uid = (device.findtext(namespace + 'UDN') or '').replace('uuid:', '')
+    name = device.findtext(namespace + 'roomName')
+    if not uid.startswith('RINCON_') or name is None:
+        return None
+    return uid, name
+
+
+def probe_speaker(ip_address, timeout=SCAN_TIMEOUT):
+    """Return (uid, name) of the speaker at ip_address, None if there is none
+
+    A single request for the device description is made, the unicast
+    counterpart of answering a multicast discovery.
+    """
+    try:
+        response = requests.get(DEVICE_DESCRIPTION_URL.format(ip_address),
+                                timeout=timeout)
+    except requests.exceptions.RequestException:
+        return None
+    if response.status_code != 200:
+        return None
+    return parse_device_description(response.content)
+
+
+# pylint: disable=useless-object-inheritance
+class QueryCache(object):
+    """Read-through cache of speaker queries, keyed by speaker uid and query
+
+    Every query in ttls has a cache of its own, so each has its own expiry
+    and hit rate. Commands changing what a query returns invalidate it. If
+    enabled is False, every query goes to the speaker.
+
+    >>> from collections import namedtuple
+    >>> speaker = namedtuple('Speaker', 'uid')('RINCON_000E58A0123401400')
+    >>> cache = QueryCache()
+    >>> cache.get(speaker, 'bass', lambda: 3)
+    3
+    >>> cache.get(speaker, 'bass', lambda: 5)
+    3
+    >>> cache.invalidate(speaker, 'bass', 'treble')
+    >>> cache.get(speaker, 'bass', lambda: 5)
+    5
+    >>> cache.stats()[0]
+    'bass: 1 entries, 1 hits, 2 misses (33% hit rate)'
+    """
+
+    def __init__(self, ttls=None):
+        self.enabled = True
+        self.caches = dict((query, TTLCache(ttl)) for query, ttl
+                           in (ttls or QUERY_TTLS).items())
+
+    def get(self, sonos, query, fetch):
+        """Return the cached result of query, calling fetch() on a miss"""
+        if not self.enabled:
+            return fetch()
+        cache = self.caches[query]
+        missing = object()
+        value = cache.get(sonos.uid, missing)
+        if value is missing:
+            value = fetch()
+            cache.put(sonos.uid, value)
+        return value
+
+    def invalidate(self, sonos, *queries):
+        """Forget the cached results of queries for sonos"""
+        if not self.enabled:
+            return
+        for query in queries:
+            self.caches[query].invalidate(sonos.uid)
+
+    def clear(self):
+        """Forget all cached results and the hit rates"""
+        for cache in self.caches.values():
+            cache.clear()
+            cache.hits = cache.misses = 0
+
+    def stats(self):
+        """Return a summary line per query"""
+        return ['{}: {}'.format(query, self.caches[query].stats())
+                for query in sorted(self.caches)]
+
+
+# The results of the speaker queries. Shared by all SoCos instances in the
+# process, so that they last for a shell session or the life of the daemon.
+QUERY_CACHE = QueryCache()
+
+
+class SpeakerCache(object):
+    """Persistent on-disk cache of the speakers found by discovery
+
+    Each speaker is stored as a dict with the keys ip, uid, name and zone,
+    where zone is the number shown by list and accepted by set. The networks
+    scanned with scan are remembered and scanned again on every refresh.
+
+    Args:
+        path (str): The file to store the cache in, defaults to
+            speakers.json in the socos cache directory
+        ttl (int): Seconds after which the cache expires, defaults to
+            $SOCOS_CACHE_TTL or SPEAKER_CACHE_TTL
+    """
+
+    def __init__(self, path=None, ttl=None):
+        self.path = path or cache_path('speakers.json')
+        if ttl is None:
+            ttl = int(os.environ.get('SOCOS_CACHE_TTL', SPEAKER_CACHE_TTL))
+        self.ttl = ttl
+        self._revalidation = None
+
+    def _read(self):
+        """Return the content of the cache file or None"""
+        try:
+            with open(self.path) as cache_file:
+                content = json.load(cache_file)
+            return content['timestamp'], content['speakers'], \
+                content.get('networks', [])
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def load(self):
+        """Return (timestamp, speakers) or (None, []) if there is no cache"""
+        content = self._read()
+        if content is None:
+            return None, []
+        return content[:2]
+
+    def networks(self):
+        """Return the remembered networks of previous scans"""
+        content = self._read()
+        return [] if content is None else content[2]
+
+    def save(self, speakers, networks=None):
+        """Store the list of speaker dicts along with the current time
+
+        networks defaults to the networks remembered so far."""
+        if networks is None:
+            networks = self.networks()
+        content = {'timestamp': time.time(), 'speakers': speakers,
+                   'networks': networks}
+        try:
+            write_atomic(self.path, json.dumps(content, indent=1))
+        except (IOError, OSError):
+            # Failing to cache must never break the command itself
+            pass
+
+    def get(self):
+        """Return the cached speakers, or None if missing or expired
+
+        If more than half of the TTL has passed, the cache is still returned,
+        but a refresh is started in the background, so that the next call
+        finds a fresh cache.
+        """
+        timestamp, speakers = self.load()
+        if timestamp is None or not speakers:
+            return None
+
+        age = time.time() - timestamp
+        if age < 0 or age > self.ttl:
+            return None
+        if age > self.ttl / 2.0:
+            self.revalidate()
+        return speakers
+
+    def revalidate(self):
+        """Refresh the cache from a new discovery in a background thread"""
+        if self._revalidation is not None and self._revalidation.is_alive():
+            return
+        self._revalidation = threading.Thread(target=self.refresh)
+        self._revalidation.daemon = True
+        self._revalidation.start()
+
+    def wait(self, timeout=REVALIDATION_WAIT):
+        """Wait for a background refresh to finish, at most timeout seconds
+
+        Called before socos exits, a single command would otherwise exit
+        before its refresh is done."""
+        if self._revalidation is not None:
+            self._revalidation.join(timeout)
+
+    def refresh(self, timeout=None):
+        """Run a discovery, store and return the found speakers
+
+        The names and uids of the devices are looked up concurrently.
+        Devices that do not answer within timeout seconds keep their cached
+        entries, or are left out if they have none. If networks were
+        scanned before, they are scanned again.
+        """
+        networks = self.networks()
+        if networks:
+            return list(self.scan(networks, refresh=True, timeout=timeout))
+
+        devices = soco.discover() or []
+        ip_to_device = {device.ip_address: device for device in devices}
+        ip_addresses = sorted(ip_to_device)
+        lookups = run_concurrently(
+            lambda ip_address: (ip_to_device[ip_address].uid,
+                                ip_to_device[ip_address].player_name),
+            ip_addresses,
+            timeout=timeout,
+        )
+        found = dict((ip_address, result) for ip_address, result, error
+                     in lookups if error is None)
+        # Slow devices must not vanish from the cache
+        cached = dict((speaker['ip'], (speaker['uid'], speaker['name']))
+                      for speaker in self.load()[1])
+
+        # Zone numbers follow the sorted ip addresses, also when some of the
+        # devices are left out, so that numbers stay stable
+        speakers = []
+        for ip_address in ip_addresses:
+            result = found.get(ip_address) or cached.get(ip_address)
+            if result is None:
+                continue
+            uid, name = result
+            speakers.append({
+                'ip': ip_address,
+                'uid': uid,
+                'name': name,
+                'zone': ip_addresses.index(ip_address) + 1,
+            })
+        if speakers:
+            self.save(speakers)
+        return speakers
+
+    # pylint: disable=too-many-locals
+    def scan(self, networks, refresh=False, timeout=None):
+        """Find the speakers in networks by probing every address
+
+        The multicast discovery runs alongside and its speakers are merged
+        in. The speakers are yielded as they are found, the known ones
+        first, and stored in the cache together with the networks. Unless
+        refresh is given, the cached speakers are kept. Speakers keep their
+        zone numbers and new speakers get the next free ones.
+
+        Args:
+            networks (list): Networks like '10.0.20.0/24'
+            refresh (bool): Whether to forget the cached speakers
+            timeout (float): Seconds a probed address may take to answer
+        """
+        addresses = []
+        for network in networks:
+            addresses.extend(expand_network(network))
+        timeout = SCAN_TIMEOUT if timeout is None else timeout
+
+        discovered = []
+        discovery = threading.Thread(target=lambda: discovered.extend(
+            soco.discover(timeout=SCAN_DISCOVERY_TIMEOUT) or []))
+        discovery.daemon = True
+        discovery.start()
+
+        timestamp, cached = self.load()
+        # Speakers keep their zone numbers, also when they are found again
+        zones = dict((speaker['ip'], speaker['zone']) for speaker in cached)
+        if refresh or timestamp is None or \
+                not 0 <= time.time() - timestamp <= self.ttl:
+            cached = []
+        speakers = list(cached)
+        by_ip = dict((speaker['ip'], speaker) for speaker in speakers)
+        for speaker in speakers:
+            yield speaker
+
+        def probe(ip_address):
+            """Probe an address, by default with the timeout of the scan"""
+            return probe_speaker(ip_address, timeout)
+
+        def found(probes):
+            """Add the speakers found by probes and yield the new ones"""
+            for ip_address, result, _ in probes:
+                if result is None or ip_address in by_ip:
+                    continue
+                if ip_address not in zones:
+                    zones[ip_address] = max([0] + list(zones.values())) + 1
+                speaker = {
+                    'ip': ip_address,
+                    'uid': result[0],
+                    'name': result[1],
+                    'zone': zones[ip_address],
+                }
+                speakers.append(speaker)
+                by_ip[ip_address] = speaker
+                yield speaker
+
+        for speaker in found(iter_concurrently(
+                probe, [address for address in addresses
+                        if address not in by_ip],
+                max_workers=SCAN_WORKERS)):
+            yield speaker
+        discovery.join(SCAN_DISCOVERY_TIMEOUT)
+        for speaker in found(iter_concurrently(
+                probe, [device.ip_address for device in discovered
+                        if device.ip_address not in by_ip])):
+            yield speaker
+
+        remembered = self.networks()
+        self.save(speakers, remembered + [network for network in networks
+                                          if network not in remembered])
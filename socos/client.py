@@ -0,0 +1,106 @@
+"""Thin client that forwards socos commands to a running socos daemon
+
+The client only uses the standard library, so that a command does not pay
+for importing soco and building the command table. The daemon is started
+with socosd, see socos.daemon. If no daemon is running, the command is
+processed locally instead, and so are command lines with socos options
+other than --format, like --fresh or -f.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import socket
+import tempfile
+
+
+def socket_path():
+    """Return the path of the Unix socket the daemon listens on
+
+    The path is $SOCOS_SOCKET if set, otherwise socos-<uid>.sock in
+    $XDG_RUNTIME_DIR or the temporary directory.
+    """
+    if os.environ.get('SOCOS_SOCKET'):
+        return os.environ['SOCOS_SOCKET']
+    directory = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    return os.path.join(directory, 'socos-{}.sock'.format(os.getuid()))
+
+
+def connect(path=None):
+    """Return a socket connected to the daemon or None if it is not running"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path or socket_path())
+    except socket.error:
+        sock.close()
+        return None
+    return sock
+
+
+def send_command(sock, args, out=None, err=None, output_format='text'):
+    """Send a command to the daemon and stream its output
+
+    The protocol is line based JSON. The request is a single object with the
+    command arguments, the daemon answers with any number of {"out": text}
+    and {"err": text} objects, followed by a final {"exit": code}.
+
+    Args:
+        sock (socket): A socket connected to the daemon
+        args (list): The command arguments, as they would be given to socos
+        out (file): Where to write the standard output, defaults to stdout
+        err (file): Where to write the error output, defaults to stderr
+        output_format (str): The format of the output, see socos.output
+
+    Returns:
+        int: The exit code of the command
+    """
+    out = out or sys.stdout
+    err = err or sys.stderr
+
+    request = {'args': args, 'tty': out.isatty(), 'format': output_format}
+    sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+
+    for line in sock.makefile('rb'):
+        message = json.loads(line.decode('utf-8'))
+        if 'out' in message:
+            out.write(message['out'])
+            out.flush()
+        elif 'err' in message:
+            err.write(message['err'])
+            err.flush()
+        elif 'exit' in message:
+            return message['exit']
+
+    err.write('Connection to the socos daemon was lost\n')
+    return 1
+
+
+def main():
+    """Forward the command line to the daemon and exit with its exit code"""
+    args = sys.argv[1:]
+    output_format = 'text'
+    if args[:1] == ['--format'] and len(args) > 1:
+        output_format, args = args[1], args[2:]
+    if not args:
+        print('Usage: socosc [--format text|json|ndjson] COMMAND [ARGS...]',
+              file=sys.stderr)
+        sys.exit(2)
+
+    # The options of the runner apply to the local process
+    sock = None if args[0].startswith('-') else connect()
+    if sock is None:
+        # pylint: disable=bad-option-value,import-outside-toplevel
+        from socos.runner import main as run_locally
+        run_locally()
+        return
+
+    try:
+        sys.exit(send_command(sock, args, output_format=output_format))
+    finally:
+        sock.close()
+
+
+if __name__ == '__main__':
+    main()
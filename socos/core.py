@@ -6,32 +6,38 @@ It also contains all private functions used by the two."""
 from __future__ import print_function
 
 import sys
-import shlex
+import time
 from functools import partial
 from collections import OrderedDict, namedtuple
 
-try:
-    import readline
-except ImportError:
-    # pylint: disable=invalid-name
-    readline = None
-
-try:
-    # pylint: disable=import-error
-    import colorama
-except ImportError:
-    # pylint: disable=invalid-name
-    colorama = None
-
-import soco
-from soco.exceptions import SoCoUPnPException
 
+from socos.cache import QUERY_CACHE, SpeakerCache
+from socos.events import (
+    WATCH_FIELDS, StateCache, Watcher, stop_event_listener)
 from socos.exceptions import SoCoIllegalSeekException, SocosException
-from socos.utils import parse_range, requires_coordinator
+from socos.http_pool import HTTPPool
+from socos.output import (
+    PrefixedStream, Printer, Record, load_colorama, text_type, track_data)
+from socos.profiler import Profiler
+from socos.queues import (
+    is_index_in_queue, queue_records, remove_tracks,
+    transfer_queue)
+from socos.replay import Recorder
+from socos.targets import fan_out
+from socos.utils import (
+    COORDINATOR_CACHE, LazyModule, acts_on_group, extract_options,
+    get_coordinator, map_concurrently, parse_range,
+    requires_coordinator, run_concurrently, streams)
 from socos.music_lib import MusicLibrary
 
 from . import mixer
 
+# Imported when first used, soco once a command talks to a speaker
+# pylint: disable=invalid-name
+copy = LazyModule('copy')
+shlex = LazyModule('shlex')
+soco = LazyModule('soco')
+
 try:
     # pylint: disable=redefined-builtin,invalid-name,undefined-variable
     input = raw_input
@@ -45,13 +51,6 @@ def err(message):
     print(message, file=sys.stderr)
 
 
-def is_index_in_queue(index, queue_length):
-    """Helper function to verify if index exists"""
-    if 0 < index <= queue_length:
-        return True
-    return False
-
-
 # The CommandSpec named tuple is used to specify a command.
 # Args:
 #     requires_ip (bool): Whether the command requires an IP-address
@@ -112,6 +111,7 @@ def add_command(cmd_list, requires_ip=True, command_name=None, obj_name=None,
 
 
 # pylint: disable=too-many-public-methods,useless-object-inheritance
+# pylint: disable=too-many-instance-attributes
 class SoCos(object):
     """The main SoCos class"""
 
@@ -123,22 +123,90 @@ class SoCos(object):
     def __init__(self):
         self.known_speakers = {}
         self.current_speaker = None
+        self.state_cache = None
+        # Whether subscribing to the events failed, the state is then polled
+        # for the rest of the session
+        self.events_failed = False
+        self.speaker_cache = SpeakerCache()
         self.music_lib = MusicLibrary()
 
-        # Form the ordered dict of commands
-        self.commands = OrderedDict()
+        # Reuse the connections to the speakers
+        self.http_pool = HTTPPool()
+        self.http_pool.install()
+        self.profiler = None
+        self.recorder = None
+        # One of socos.output.FORMATS
+        self.output_format = 'text'
+        self.commands = self._bind_commands()
+
+    def _bind_commands(self):
+        """Form the ordered dict of commands bound to this instance"""
+        commands = OrderedDict()
         for command_spec in self.command_list:
             if command_spec.obj_name is None:
                 obj = self
             else:
                 obj = getattr(self, command_spec.obj_name)
-            self.commands[command_spec.command_name] = (
+            commands[command_spec.command_name] = (
                 command_spec.requires_ip,
                 getattr(obj, command_spec.method_name)
             )
+        return commands
+
+    def session(self):
+        """Return a SoCos for running commands in another thread
+
+        The session shares the caches and the connections with this
+        instance, but starts without a current speaker and has its own
+        output format. It starts with a copy of the known speakers, so that
+        "list" in one session does not change them under another."""
+        session = copy.copy(self)
+        session.known_speakers = dict(self.known_speakers)
+        session.current_speaker = None
+        session.state_cache = None
+        # pylint: disable=protected-access
+        session.commands = session._bind_commands()
+        return session
 
     def process_cmd(self, args):
-        """Process a single command"""
+        """Process a single command
+
+        If profiling is on, a summary of the network requests made for the
+        command is printed to stderr afterwards. If recording is on, the
+        command and its requests are written to the recording.
+
+        Returns:
+            bool: Whether the command succeeded
+        """
+        if self.profiler is None and self.recorder is None:
+            return self._process_cmd(args)
+
+        if self.profiler is not None:
+            self.profiler.reset()
+        if self.recorder is not None:
+            self.recorder.start_command(args)
+        success = False
+        start = time.time()
+        try:
+            success = self._process_cmd(args)
+            return success
+        finally:
+            seconds = time.time() - start
+            if self.recorder is not None:
+                self.recorder.finish_command(success, seconds)
+            if self.profiler is not None:
+                for line in self.profiler.summary(seconds):
+                    err(line)
+
+    def record(self, path):
+        """Record all following commands and their requests to path
+
+        See socos.replay for replaying the recording."""
+        self.recorder = Recorder(path)
+        self.http_pool.listeners.append(self.recorder.record)
+
+    def _process_cmd(self, args):
+        """Process a single command, see process_cmd"""
 
         cmd = args.pop(0).lower()
 
@@ -147,42 +215,65 @@ class SoCos(object):
             err(self.get_help())
             return False
 
+        if self.commands[cmd][0] and args and args[0].startswith('@'):
+            return fan_out(self, self.commands[cmd][1], args)
+
         func, args = self._check_args(cmd, args)
         # None, None is returned with missing IP, in this case return
         if (func, args) == (None, None):
-            return None
+            return False
 
         try:
             result = func(*args)
         except (KeyError, ValueError, TypeError, SocosException,
                 SoCoIllegalSeekException) as ex:
             err(ex)
-            return None
+            return False
 
         # colorama.init() takes over stdout/stderr to give cross-platform
-        # colors
+        # colors, which structured output has no use for
+        printer = Printer(self.output_format)
+        colorama = None
+        if self.output_format == 'text':
+            colorama = load_colorama()
         if colorama:
             colorama.init()
 
         # process output
+        success = True
         if result is None:
             pass
-        elif not isinstance(result, str):
+        elif not isinstance(result, (str, text_type)):
             try:
                 for line in result:
-                    print(line)
+                    printer.print_line(line)
             except (KeyError, ValueError, TypeError, SocosException,
                     SoCoIllegalSeekException) as ex:
                 err(ex)
-                return None
+                success = False
         else:
-            print(result)
+            printer.print_line(result)
+        printer.finish()
 
         # Release stdout/stderr from colorama
         if colorama:
             colorama.deinit()
 
-        return None
+        return success
+
+    def _speakers(self, refresh=False, timeout=None):
+        """Return the known speakers, from the cache if possible"""
+        speakers = None
+        if not refresh:
+            speakers = self.speaker_cache.get()
+        if speakers is None:
+            speakers = self.speaker_cache.refresh(timeout=timeout)
+        return speakers
+
+    def _speaker_names(self):
+        """Return a dict of the cached speaker names by ip"""
+        _, speakers = self.speaker_cache.load()
+        return dict((speaker['ip'], speaker['name']) for speaker in speakers)
 
     def _check_args(self, cmd, args):
         """Checks if func is called for a speaker and updates 'args'"""
@@ -198,6 +289,8 @@ class SoCos(object):
                 return None, None
 
             speaker_spec = args.pop(0)
+            # SoCo returns the same instance for the same ip, so the speaker
+            # state is reused across commands
             sonos = soco.SoCo(speaker_spec)
             args.insert(0, sonos)
 
@@ -209,23 +302,31 @@ class SoCos(object):
     def shell(self):
         """Start an interactive shell"""
 
+        try:
+            # pylint: disable=bad-option-value,import-outside-toplevel
+            import readline
+        except ImportError:
+            readline = None
         if readline is not None:
             readline.parse_and_bind('tab: complete')
             readline.set_completer(self.complete_command)
             readline.set_completer_delims(' ')
 
+        try:
+            self._shell_loop()
+        finally:
+            self._follow_speaker(None)
+            stop_event_listener()
+
+    def _shell_loop(self):
+        """Read and process commands until EOF"""
         while True:
+            self._follow_speaker(self.current_speaker)
             try:
-                # Not sure why this is necessary, as there is a player_name
-                # attr
                 if self.current_speaker:
-                    # pylint: disable=maybe-no-member
-                    speaker = self.current_speaker.player_name
-                    if hasattr(speaker, 'decode'):
-                        speaker = speaker.encode('utf-8')
                     line = input('socos({speaker}|{state})> '.format(
-                        speaker=speaker,
-                        state=self.state(self.current_speaker).title()
+                        speaker=self._prompt_name(),
+                        state=self._prompt_state().title()
                     ))
                 else:
                     line = input('socos> ')
@@ -253,6 +354,116 @@ class SoCos(object):
             except EOFError:
                 err('EOF.')
 
+    def _follow_speaker(self, sonos):
+        """Keep the state cache subscribed to the events of sonos
+
+        If subscribing fails, the state cache is not used and the state is
+        polled from the speaker instead, for the rest of the session.
+        """
+        if self.state_cache is not None:
+            if self.state_cache.sonos is sonos:
+                return
+            self.state_cache.stop()
+            self.state_cache = None
+
+        if sonos is not None and not self.events_failed:
+            state_cache = StateCache(sonos, get_coordinator(sonos))
+            if state_cache.start():
+                self.state_cache = state_cache
+            else:
+                self.events_failed = True
+
+    def _transport_changed(self, sonos):
+        """Forget the cached state and current track of sonos"""
+        QUERY_CACHE.invalidate(sonos, 'state', 'current')
+        if self.state_cache is not None:
+            self.state_cache.invalidate(
+                'transport_state', 'current_track_meta_data')
+
+    def _prompt_name(self):
+        """Return the name of the current speaker for the prompt"""
+        speaker = None
+        if self.state_cache is not None:
+            speaker = self.state_cache.get('zone_name')
+        if speaker is None:
+            # pylint: disable=maybe-no-member
+            speaker = self.current_speaker.player_name
+        if hasattr(speaker, 'decode'):
+            speaker = speaker.encode('utf-8')
+        return speaker
+
+    def _prompt_state(self):
+        """Return the state of the current speaker for the prompt"""
+        if self.state_cache is not None:
+            state = self.state_cache.get('transport_state')
+            if state is not None:
+                return state
+        return self.state(self.current_speaker)
+
+    def run_batch(self, lines, stop_on_error=False):
+        """Run the command lines of a script
+
+        The commands run on this instance one after the other, so speakers
+        set with "set" or resolved by earlier lines are reused. Empty lines
+        and lines starting with # are skipped. Everything a line writes to
+        stderr is prefixed with its line number and failed lines are
+        reported there, followed by a summary if any line failed. "exit"
+        ends the script early.
+
+        Args:
+            lines (iterable): The command lines to run
+            stop_on_error (bool): Whether to stop at the first failed line
+
+        Returns:
+            int: The exit code, 0 if all lines succeeded and 1 otherwise
+        """
+        failed = []
+        total = 0
+        for line_number, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+
+            total += 1
+            stderr = sys.stderr
+            sys.stderr = PrefixedStream(
+                stderr, 'Line {}: '.format(line_number))
+            try:
+                success = self._run_line(line)
+                if not success:
+                    failed.append(line_number)
+                    err('FAILED: {}'.format(line))
+            except SystemExit:
+                # "exit" ends the script, with the failures so far
+                break
+            finally:
+                sys.stderr = stderr
+
+            if not success and stop_on_error:
+                break
+
+        if failed:
+            err('{} of {} commands failed (line{} {})'.format(
+                len(failed), total, 's' if len(failed) > 1 else '',
+                ', '.join(str(number) for number in failed)))
+            return 1
+        return 0
+
+    def _run_line(self, line):
+        """Run a command line of a script and return whether it succeeded"""
+        try:
+            args = shlex.split(line)
+        except ValueError as value_error:
+            err('Syntax error: %(error)s' % {'error': value_error})
+            return False
+
+        try:
+            return self.process_cmd(args)
+        except (soco.exceptions.SoCoException, IOError) as ex:
+            # Errors of the speakers or the network fail the line only
+            err(ex)
+            return False
+
     def complete_command(self, text, context):
         """auto-complete commands
 
@@ -269,7 +480,15 @@ class SoCos(object):
     @requires_coordinator
     def get_queue_length(sonos):
         """Return the queue length"""
-        return len(sonos.get_queue())
+        return SoCos.get_queue_status(sonos)[0]
+
+    @staticmethod
+    @requires_coordinator
+    def get_queue_status(sonos):
+        """Return the queue length and update id with a single request"""
+        # Fetching a single item is enough, total_matches holds the length
+        queue = sonos.get_queue(max_items=1)
+        return queue.total_matches, queue.update_id
 
     @requires_coordinator
     def play_index(self, sonos, index):
@@ -289,54 +508,98 @@ class SoCos(object):
                 (index, queue_length)
         raise ValueError(error)
 
+    @requires_coordinator
     def remove_range_from_queue(self, sonos, rem_range):
         """Remove a range of tracks from queue
 
-        rem_range should be a sequence, such as a range object"""
-        for index in sorted(rem_range, reverse=True):
-            self.remove_index_from_queue(sonos, index)
+        rem_range should be a sequence, such as a range object, see
+        queues.remove_tracks."""
+        queue_length, update_id = self.get_queue_status(sonos)
+        remove_tracks(sonos, rem_range, queue_length, update_id)
+        # The position of the current track may have moved
+        QUERY_CACHE.invalidate(sonos, 'current')
 
-    @requires_coordinator
     def remove_index_from_queue(self, sonos, index):
         """Remove one track from the queue by its index"""
-        queue_length = self.get_queue_length(sonos)
-        if is_index_in_queue(index, queue_length):
-            index -= 1
-            sonos.remove_from_queue(index)
-        else:
-            error = "Index %d is not within range 1 - %d" % \
-                    (index, queue_length)
-            raise ValueError(error)
+        self.remove_range_from_queue(sonos, [index])
+
+    @staticmethod
+    def _speaker_details(speaker):
+        """Return the model and group label of a speaker from the cache"""
+        sonos = soco.SoCo(speaker['ip'])
+        model = sonos.get_speaker_info()['model_name']
+        group = sonos.group
+        return model, group.label if group is not None else ''
 
     # ### Here starts the commands
     @add_command(requires_ip=False, command_name='list')
-    def list_ips(self):
-        """List available devices"""
-        ip_to_device = {device.ip_address: device
-                        for device in soco.discover()}
-        ip_addresses = list(ip_to_device.keys())
-        ip_addresses.sort()
+    def list_ips(self, *args):
+        """List available devices
+
+        The result of the discovery is cached on disk, use "list --refresh"
+        to force a new discovery. "list --details" also shows the model and
+        group of every device. The devices are queried concurrently and
+        "list --timeout SECONDS" leaves out devices that answer too slowly.
+
+        Where multicast discovery does not reach all speakers, "list --scan
+        10.0.20.0/24" probes every address of the network (several networks
+        are separated by commas) and shows the speakers as they are found.
+        Scanned networks are remembered and scanned again when the cache is
+        refreshed.
+        """
+        _, options = extract_options(
+            args, flags=['--refresh', '--details'],
+            options=['--timeout', '--scan'])
+        timeout = options.get('timeout')
+        if timeout is not None:
+            timeout = float(timeout)
+
+        if options.get('scan'):
+            speakers = self.speaker_cache.scan(
+                options['scan'].split(','), options.get('refresh'), timeout)
+        else:
+            speakers = self._speakers(options.get('refresh'), timeout)
+
+        details = {}
+        if options.get('details'):
+            speakers = list(speakers)
+            details = dict(
+                (speaker['ip'], result) for speaker, result, error in
+                run_concurrently(self._speaker_details, speakers,
+                                 timeout=timeout)
+                if error is None
+            )
 
         self.known_speakers.clear()
-        for zone_number, ip_address in enumerate(ip_addresses, 1):
-            # pylint: disable=no-member
-            name = ip_to_device[ip_address].player_name
+        for speaker in speakers:
+            name = speaker['name']
             if hasattr(name, 'decode'):
                 name = name.encode('utf-8')
-            self.known_speakers[str(zone_number)] = ip_to_device[ip_address]
-            yield '({}) {: <15} {}'.format(zone_number, ip_address, name)
+            line = '({}) {: <15} {}'.format(
+                speaker['zone'], speaker['ip'], name)
+            data = dict((key, speaker[key]) for key in ['zone', 'ip', 'name'])
+            if options.get('details'):
+                if speaker['ip'] not in details:
+                    continue
+                line += ' [{}] {}'.format(*details[speaker['ip']])
+                data['model'], data['group'] = details[speaker['ip']]
+            self.known_speakers[str(speaker['zone'])] = soco.SoCo(
+                speaker['ip'])
+            yield Record(line, **data)
 
     @add_command(requires_ip=False)
     def partymode(self):
         """Put all the speakers in the same group, a.k.a Party Mode."""
         self.current_speaker.partymode()
+        COORDINATOR_CACHE.clear()
 
     @staticmethod
     @add_command(command_name='info')
     def speaker_info(sonos):
         """Information about a speaker"""
-        infos = sonos.get_speaker_info()
-        return ('%s: %s' % (i, infos[i]) for i in infos)
+        infos = QUERY_CACHE.get(sonos, 'info', sonos.get_speaker_info)
+        return (Record('%s: %s' % (i, infos[i]), name=i, value=infos[i])
+                for i in infos)
 
     @add_command(only_on_coordinator=True)
     def play(self, sonos, *args):
@@ -346,6 +609,7 @@ class SoCos(object):
             self.play_index(sonos, idx)
         else:
             sonos.play()
+        self._transport_changed(sonos)
         return self.get_current_track_info(sonos)
 
     @add_command(only_on_coordinator=True)
@@ -353,6 +617,7 @@ class SoCos(object):
         """Pause"""
         if self.state(sonos) == 'PLAYING':
             sonos.pause()
+            self._transport_changed(sonos)
         return self.get_current_track_info(sonos)
 
     @add_command(only_on_coordinator=True)
@@ -362,6 +627,7 @@ class SoCos(object):
 
         if self.state(sonos) in states:
             sonos.stop()
+            self._transport_changed(sonos)
         return self.get_current_track_info(sonos)
 
     @add_command(only_on_coordinator=True)
@@ -369,8 +635,9 @@ class SoCos(object):
         """Play the next track"""
         try:
             sonos.next()
-        except SoCoUPnPException:
+        except soco.exceptions.SoCoUPnPException:
             raise SoCoIllegalSeekException('No such track')
+        self._transport_changed(sonos)
         return self.get_current_track_info(sonos)
 
     @add_command(only_on_coordinator=True)
@@ -378,8 +645,9 @@ class SoCos(object):
         """Play the previous track"""
         try:
             sonos.previous()
-        except SoCoUPnPException:
+        except soco.exceptions.SoCoUPnPException:
             raise SoCoIllegalSeekException('No such track')
+        self._transport_changed(sonos)
         return self.get_current_track_info(sonos)
 
     @staticmethod
@@ -387,20 +655,22 @@ class SoCos(object):
     def mode(sonos, *args):
         """Change or show the play mode of a device
         Accepted modes: NORMAL, SHUFFLE_NOREPEAT, SHUFFLE, REPEAT_ALL"""
-        if not args:
-            return sonos.play_mode
-
-        mode = args[0]
-        sonos.play_mode = mode
+        if args:
+            sonos.play_mode = args[0]
+            QUERY_CACHE.invalidate(sonos, 'mode')
 
-        return sonos.play_mode
+        return QUERY_CACHE.get(sonos, 'mode', lambda: sonos.play_mode)
 
-    @staticmethod
     @add_command(only_on_coordinator=True, command_name='current')
-    def get_current_track_info(sonos):
+    def get_current_track_info(self, sonos):
         """Show the current track"""
-        track = sonos.get_current_track_info()
-        return (
+        track = None
+        if self.state_cache is not None:
+            track = self.state_cache.current_track_info(sonos)
+        if track is None:
+            track = QUERY_CACHE.get(
+                sonos, 'current', sonos.get_current_track_info)
+        return Record(
             "Current track: %s - %s. From album %s. This is track number"
             " %s in the playlist. It is %s minutes long." % (
                 track['artist'],
@@ -408,47 +678,41 @@ class SoCos(object):
                 track['album'],
                 track['playlist_position'],
                 track['duration'],
-            )
+            ),
+            **track_data(track)
         )
 
     @staticmethod
     @add_command(only_on_coordinator=True, command_name='queue')
-    def get_queue(sonos):
-        """Show the current queue"""
-        queue = sonos.get_queue()
-
-        # pylint: disable=invalid-name
-        ANSI_BOLD = '\033[1m'
-        ANSI_RESET = '\033[0m'
-
-        current = int(sonos.get_current_track_info()['playlist_position'])
-
-        queue_length = len(queue)
-        padding = len(str(queue_length))
-
-        for idx, track in enumerate(queue, 1):
-            if idx == current:
-                color = ANSI_BOLD
-            else:
-                color = ANSI_RESET
-
-            idx = str(idx).rjust(padding)
-            yield (
-                "%s%s: %s - %s. From album %s.%s" % (
-                    color,
-                    idx,
-                    track.creator,
-                    track.title,
-                    track.album,
-                    ANSI_RESET,
-                )
-            )
-
-    @add_command(command_name='remove')
+    def get_queue(sonos, *args):
+        """Show, save or restore the current queue
+
+        "queue 500..600" only shows the given range and "queue
+        --around-current" the tracks around the current one. The queue is
+        fetched in pages of 100 tracks, "--page-size N" changes that.
+
+        "queue save FILE" writes the queue to FILE (gzip compressed if it
+        ends with .gz), "queue load FILE [replace]" adds the tracks from
+        FILE to the queue, or replaces the queue with them, and "queue copy
+        IP [replace]" does the same to the queue of the speaker at IP."""
+        positional, options = extract_options(
+            args, flags=['--around-current'], options=['--page-size'])
+        if positional and positional[0] in ['save', 'load', 'copy']:
+            yield transfer_queue(sonos, positional[0], *positional[1:])
+            return
+
+        for record in queue_records(sonos, positional, options):
+            yield record
+
+    @add_command(only_on_coordinator=True, command_name='remove')
     def remove_from_queue(self, sonos, *args):
         """Remove track from queue by index"""
         if args:
             rem_range = parse_range(args[0])
+            if not rem_range:
+                raise ValueError(
+                    'Invalid range "{}", use a range of queue positions '
+                    'like "remove IP 5..8"'.format(args[0]))
             self.remove_range_from_queue(sonos, rem_range)
 
         return self.get_queue(sonos)
@@ -456,57 +720,169 @@ class SoCos(object):
     @staticmethod
     @add_command()
     def volume(sonos, *args):
-        """Change or show the volume of a device"""
+        """Change or show the volume of a device
+
+        "volume +5" adjusts the volume with a single request and "volume
+        30" sets it, add --confirm to read the new volume back from the
+        device."""
         if not args:
-            return str(sonos.volume)
+            volume = sonos.volume
+            return Record(str(volume), volume=volume)
 
-        operator = args[0]
-        newvolume = mixer.adjust_volume(sonos, operator)
-        return str(newvolume)
+        positional, options = extract_options(args, flags=['--confirm'])
+        newvolume = mixer.adjust_volume(
+            sonos, mixer.single_operator('volume', positional),
+            options.get('confirm'))
+        return Record(str(newvolume), volume=newvolume)
 
     @staticmethod
     @add_command()
     def bass(sonos, *args):
         """Change or show the bass value of a device"""
         if not args:
-            return str(sonos.bass)
+            bass = QUERY_CACHE.get(sonos, 'bass', lambda: sonos.bass)
+            return Record(str(bass), bass=bass)
 
-        operator = args[0]
-        newbass = mixer.adjust_bass(sonos, operator)
-        return str(newbass)
+        positional, options = extract_options(args, flags=['--confirm'])
+        newbass = mixer.adjust_bass(
+            sonos, mixer.single_operator('bass', positional),
+            options.get('confirm'))
+        QUERY_CACHE.invalidate(sonos, 'bass')
+        return Record(str(newbass), bass=newbass)
 
     @staticmethod
     @add_command()
     def treble(sonos, *args):
         """Change or show the treble value of a device"""
         if not args:
-            return str(sonos.treble)
+            treble = QUERY_CACHE.get(sonos, 'treble', lambda: sonos.treble)
+            return Record(str(treble), treble=treble)
 
-        operator = args[0]
-        newtreble = mixer.adjust_treble(sonos, operator)
-        return str(newtreble)
+        positional, options = extract_options(args, flags=['--confirm'])
+        newtreble = mixer.adjust_treble(
+            sonos, mixer.single_operator('treble', positional),
+            options.get('confirm'))
+        QUERY_CACHE.invalidate(sonos, 'treble')
+        return Record(str(newtreble), treble=newtreble)
+
+    @add_command()
+    @acts_on_group
+    def groupvolume(self, sonos, *args):
+        """Change or show the volume of the group of a device
+
+        "groupvolume +5" or "groupvolume 30" changes the average volume of
+        the group, keeping the volumes of the members relative to each
+        other. The members are read and changed concurrently. With a
+        target selector like @all, it runs once per group."""
+        members = sorted(sonos.group.members, key=lambda m: m.ip_address)
+        volumes = map_concurrently(lambda member: member.volume, members)
+
+        if args:
+            newvolumes = mixer.scale_volumes(volumes, args[0])
+
+            def set_volume(item):
+                """Set the volume of a member"""
+                member, volume = item
+                member.volume = volume
+            map_concurrently(set_volume, zip(members, newvolumes))
+            volumes = newvolumes
+
+        names = self._speaker_names()
+        lines = ['{}: {}'.format(names.get(member.ip_address,
+                                           member.ip_address), volume)
+                 for member, volume in zip(members, volumes)]
+        lines.append('Group volume: {}'.format(mixer.group_level(volumes)))
+        return lines
 
     @staticmethod
+    @add_command()
+    def eq(sonos, *args):  # pylint: disable=invalid-name
+        """Change several of volume, bass and treble at once
+
+        E.g. "eq volume=+5 bass=-2 treble=0". Values with + or - are
+        adjusted relatively, others are set. The settings are applied
+        concurrently."""
+        if not args:
+            raise ValueError('Specify settings like volume=+5 bass=-2')
+
+        settings = mixer.parse_settings(args)
+        try:
+            applied = mixer.apply_settings(sonos, settings)
+        finally:
+            # Invalidated after writing, so that no concurrent read caches
+            # the old values again, also if only some settings were applied
+            QUERY_CACHE.invalidate(sonos, 'bass', 'treble')
+        return ', '.join('{}: {}'.format(name, value)
+                         for name, value in applied)
+
     @add_command(only_on_coordinator=True)
-    def state(sonos):
+    def state(self, sonos):
         """Get the current state of a device / group"""
-        return sonos.get_current_transport_info()['current_transport_state']
+        state = None
+        if self.state_cache is not None:
+            state = self.state_cache.get('transport_state', sonos)
+        if state is None:
+            state = QUERY_CACHE.get(
+                sonos, 'state', lambda: sonos.get_current_transport_info()[
+                    'current_transport_state'])
+        return Record(state, state=state)
+
+    @add_command()
+    @streams
+    def watch(self, sonos, *args):
+        """Show the current track, state, volume or queue as they change
+
+        "watch state volume" prints a line whenever one of the fields
+        changes, starting with their current values. The speaker sends the
+        changes as UPnP events, nothing is polled. Start socos with
+        "--format ndjson" for a JSON record per change. Without fields the
+        current track is watched. Runs until interrupted.
+        """
+        fields = list(args) or ['current']
+        for field in fields:
+            if field not in WATCH_FIELDS:
+                raise ValueError('Can only watch {}'.format(
+                    ', '.join(WATCH_FIELDS)))
+
+        watcher = Watcher(sonos, get_coordinator(sonos), fields)
+        try:
+            watcher.start()
+        except (soco.exceptions.SoCoException, IOError) as ex:
+            raise SocosException(
+                'Could not subscribe to the events of {}: {}'.format(
+                    sonos.ip_address, ex))
+        try:
+            for field, value in watcher.changes():
+                if field == 'queue':
+                    value = self.get_queue_length(sonos)
+                if field == 'current':
+                    text = 'current: {artist} - {title}. From album ' \
+                        '{album}.'.format(**value)
+                    value = track_data(value)
+                else:
+                    text = '{}: {}'.format(field, value)
+                yield Record(text, time=round(time.time(), 3), field=field,
+                             value=value)
+        except KeyboardInterrupt:
+            return
+        finally:
+            watcher.stop()
 
     @staticmethod
     @add_command()
     def player_name(sonos, *args):
         """Set or get the player name of a device"""
-        if not args:
-            return sonos.player_name
-
-        name = args[0]
-        sonos.player_name = name
+        if args:
+            sonos.player_name = args[0]
+            # The name is part of the speaker info as well
+            QUERY_CACHE.invalidate(sonos, 'player_name', 'info')
 
-        return sonos.player_name
+        return QUERY_CACHE.get(
+            sonos, 'player_name', lambda: sonos.player_name)
 
     # Add music library commands
     for method_name in ['tracks', 'albums', 'artists', 'playlists',
-                        'sonos_playlists']:
+                        'sonos_playlists', 'library']:
         command_list.append(
             CommandSpec(requires_ip=True, command_name=method_name,
                         obj_name='music_lib', method_name=method_name)
@@ -543,6 +919,54 @@ class SoCos(object):
         """Resets the current speaker for the shell session"""
         self.current_speaker = None
 
+    @add_command(requires_ip=False)
+    def stats(self):
+        """Show the connection statistics of the speakers
+
+        Requests to a speaker reuse open connections, this shows how many
+        requests were sent and how many connections had to be opened."""
+        return self.http_pool.summary(self._speaker_names())
+
+    @staticmethod
+    @add_command(requires_ip=False)
+    def cache(*args):
+        """Show the hit rates of the speaker query cache or clear it
+
+        The results of info, player_name, mode, bass, treble, state and
+        current are cached per speaker for a while, "cache stats" shows how
+        often they were answered from the cache and "cache clear" forgets
+        them. Start socos with --fresh to always ask the speakers."""
+        if args not in [('stats',), ('clear',)]:
+            raise ValueError("Argument must be one of 'stats' or 'clear'")
+        if args[0] == 'clear':
+            QUERY_CACHE.clear()
+            return 'Cache cleared'
+        lines = QUERY_CACHE.stats()
+        if not QUERY_CACHE.enabled:
+            lines.append('The cache is off (--fresh)')
+        return lines
+
+    @add_command(requires_ip=False)
+    def profile(self, *args):
+        """Turn profiling of the network requests on or off
+
+        With "profile on", every command is followed by a table of the UPnP
+        actions it triggered, with their count, latency (total, p50 and
+        p95) and the bytes sent and received."""
+        if not args:
+            return 'Profiling is {}'.format(
+                'off' if self.profiler is None else 'on')
+        if args[0] not in ['on', 'off']:
+            raise ValueError("Argument must be one of 'on' or 'off'")
+
+        if self.profiler is not None:
+            self.http_pool.listeners.remove(self.profiler.record)
+            self.profiler = None
+        if args[0] == 'on':
+            self.profiler = Profiler()
+            self.http_pool.listeners.append(self.profiler.record)
+        return 'Profiling is {}'.format(args[0])
+
     @add_command(requires_ip=False, command_name='help')
     def get_help(self, command=None):
         """Print a list of commands with short description"""
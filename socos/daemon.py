@@ -0,0 +1,239 @@
+"""Long-lived socos daemon serving commands over a local Unix socket
+
+The daemon keeps a single SoCos instance, and with it the known speakers,
+SoCo instances and their connections, alive between commands. Commands are
+sent to it with the socosc client, see socos.client for the protocol. Every
+client is served in a thread of its own, so a long running command like
+watch does not hold up the others.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import signal
+import socket
+import threading
+import traceback
+
+try:
+    import socketserver
+except ImportError:
+    # The socketserver module is called SocketServer in Python 2
+    import SocketServer as socketserver  # pylint: disable=import-error
+
+from socos.core import SoCos
+from socos.client import connect, socket_path
+from socos.output import FORMATS
+from socos.utils import LazyModule
+
+soco = LazyModule('soco')  # pylint: disable=invalid-name
+
+# Commands changing the state of a shell session, with what to do instead.
+# Every command sent to the daemon stands on its own, so they would have no
+# effect, or in the case of profile leave the profiler of a finished command
+# recording the requests of all following ones.
+SESSION_COMMANDS = {
+    'set': 'give the speaker with every socosc command instead',
+    'unset': 'give the speaker with every socosc command instead',
+    'profile': 'run "socosc --profile COMMAND" to profile a command',
+}
+
+
+# pylint: disable=useless-object-inheritance
+class _ThreadStream(object):
+    """Stands in for sys.stdout or sys.stderr while the daemon runs
+
+    What a request thread writes goes to the writer it has set, which sends
+    it to its client, everything else goes to the original stream.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._local = threading.local()
+
+    def set_writer(self, writer):
+        """Send the output of the calling thread to writer, None to stop"""
+        self._local.writer = writer
+
+    @property
+    def target(self):
+        """The stream the calling thread writes to"""
+        return getattr(self._local, 'writer', None) or self.stream
+
+    def write(self, text):
+        """Write text to the stream of the calling thread"""
+        self.target.write(text)
+
+    def flush(self):
+        """Flush the stream of the calling thread"""
+        self.target.flush()
+
+    def isatty(self):
+        """Report whether the stream of the calling thread is a terminal"""
+        return self.target.isatty()
+
+    def __getattr__(self, name):
+        return getattr(self.target, name)
+
+
+class _StreamWriter(object):
+    """File-like object sending everything written to it to the client"""
+
+    def __init__(self, wfile, stream, tty):
+        self.wfile = wfile
+        self.stream = stream
+        self.tty = tty
+        self.closed = False
+
+    def write(self, text):
+        """Send text to the client right away"""
+        if text:
+            message = json.dumps({self.stream: text}) + '\n'
+            self.wfile.write(message.encode('utf-8'))
+
+    def flush(self):
+        """Flush the underlying socket file"""
+        self.wfile.flush()
+
+    def isatty(self):
+        """Report whether the client writes to a terminal"""
+        return self.tty
+
+
+class _CommandHandler(socketserver.StreamRequestHandler):
+    """Process a single command sent by the client"""
+
+    def handle(self):
+        """Read the request, run it and send the output back"""
+        line = self.rfile.readline()
+        if not line:
+            return
+        try:
+            request = json.loads(line.decode('utf-8'))
+            args = list(request['args'])
+            output_format = request.get('format', 'text')
+            if output_format not in FORMATS:
+                raise ValueError(output_format)
+        except (ValueError, KeyError, TypeError):
+            self._send({'err': 'Invalid request\n'})
+            self._send({'exit': 2})
+            return
+
+        tty = bool(request.get('tty'))
+        self.server.stdout.set_writer(_StreamWriter(self.wfile, 'out', tty))
+        self.server.stderr.set_writer(_StreamWriter(self.wfile, 'err', tty))
+        try:
+            code = self.server.run_command(args, output_format)
+        except socket.error:
+            # The client went away, there is nobody to report to
+            return
+        finally:
+            self.server.stdout.set_writer(None)
+            self.server.stderr.set_writer(None)
+
+        self._send({'exit': code})
+
+    def _send(self, message):
+        """Send a message to the client"""
+        self.wfile.write((json.dumps(message) + '\n').encode('utf-8'))
+
+
+class SocosDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unix socket server processing socos commands with a shared SoCos
+
+    Every command runs in its own thread with a session of the SoCos
+    instance, see SoCos.session. The output of the threads is sent to their
+    clients by replacing sys.stdout and sys.stderr with a _ThreadStream
+    while the daemon runs.
+    """
+
+    # Commands still running, like watch, do not keep the daemon alive
+    daemon_threads = True
+
+    def __init__(self, path=None):
+        self.path = path or socket_path()
+        self.socos = SoCos()
+        self.stdout = _ThreadStream(sys.stdout)
+        self.stderr = _ThreadStream(sys.stderr)
+
+        if os.path.exists(self.path):
+            sock = connect(self.path)
+            if sock is not None:
+                sock.close()
+                raise RuntimeError(
+                    'A socos daemon is already listening on ' + self.path)
+            # Left behind by a daemon that was killed
+            os.unlink(self.path)
+
+        # Only the current user may talk to the daemon
+        umask = os.umask(0o077)
+        try:
+            socketserver.UnixStreamServer.__init__(
+                self, self.path, _CommandHandler)
+        finally:
+            os.umask(umask)
+        sys.stdout, sys.stderr = self.stdout, self.stderr
+
+    def run_command(self, args, output_format='text'):
+        """Run a single command and return its exit code
+
+        Errors are reported to the client with their message, like socos
+        does for the lines of a script. Unexpected errors are also logged
+        with their traceback on the stderr of the daemon.
+        """
+        if args and args[0].lower() in SESSION_COMMANDS:
+            print('"{}" only applies to the socos shell, {}'.format(
+                args[0], SESSION_COMMANDS[args[0].lower()]), file=sys.stderr)
+            return 1
+
+        # Every command starts like a new socos process would, only the
+        # speakers and connections are kept
+        socos = self.socos.session()
+        socos.output_format = output_format
+        try:
+            result = socos.process_cmd(args)
+        except SystemExit as ex:
+            return ex.code or 0
+        except (soco.exceptions.SoCoException, IOError) as ex:
+            # Errors of the speakers or the network
+            print(ex, file=sys.stderr)
+            return 1
+        except Exception as ex:  # pylint: disable=broad-except
+            traceback.print_exc(file=self.stderr.stream)
+            print('{}: {}'.format(type(ex).__name__, ex), file=sys.stderr)
+            return 1
+        return 0 if result else 1
+
+    def server_close(self):
+        """Close the server and remove its socket"""
+        sys.stdout, sys.stderr = self.stdout.stream, self.stderr.stream
+        socketserver.UnixStreamServer.server_close(self)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def main():
+    """Run the socos daemon until it is interrupted"""
+    path = sys.argv[1] if len(sys.argv) > 1 else None
+    try:
+        daemon = SocosDaemon(path)
+    except (RuntimeError, socket.error) as ex:
+        print(ex, file=sys.stderr)
+        sys.exit(1)
+
+    # Clean up the socket when being terminated
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+
+    print('socos daemon listening on ' + daemon.path, file=sys.stderr)
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.server_close()
+
+
+if __name__ == '__main__':
+    main()
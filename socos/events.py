@@ -0,0 +1,315 @@
+"""UPnP event subscriptions keeping a local copy of the speaker state
+
+Instead of asking the speaker for its state, socos can subscribe to the
+events the speaker sends whenever its state changes. Everything that is
+read from the cache is then available without a network round-trip.
+"""
+
+import sys
+import time
+import threading
+from collections import OrderedDict
+
+try:
+    import queue
+except ImportError:
+    # The queue module is called Queue in Python 2
+    import Queue as queue  # pylint: disable=import-error
+
+from socos.utils import LazyModule
+
+soco = LazyModule('soco')  # pylint: disable=invalid-name
+
+# The subscription period requested from the speaker (seconds), subscriptions
+# are renewed automatically before they expire
+SUBSCRIPTION_TIMEOUT = 600
+
+# The fields "watch" can follow, as the name of the service whose events
+# carry them and whether that service is the one of the group coordinator
+WATCH_FIELDS = OrderedDict([
+    ('current', ('avTransport', True)),
+    ('state', ('avTransport', True)),
+    ('volume', ('renderingControl', False)),
+    ('queue', ('contentDirectory', True)),
+])
+
+# The seconds between checks of the subscriptions while watching
+WATCH_CHECK_INTERVAL = 5
+
+
+def track_info(values):
+    """Return the current track from the evented variables or None
+
+    The track is returned in the format of get_current_track_info.
+    """
+    track = values.get('current_track_meta_data')
+    position = values.get('current_track')
+    if track is None or position is None or not hasattr(track, 'title'):
+        return None
+    return {
+        'artist': getattr(track, 'creator', ''),
+        'title': track.title,
+        'album': getattr(track, 'album', ''),
+        'playlist_position': position,
+        'duration': values.get('current_track_duration', ''),
+    }
+
+
+def queue_update_id(container_update_ids):
+    """Return the update id of the queue from ContainerUpdateIDs or None
+
+    The ContainerUpdateIDs variable lists the containers that changed and
+    their update ids, alternately and separated by commas.
+
+    >>> queue_update_id('S:,3,Q:0,17')
+    '17'
+
+    >>> queue_update_id('SQ:,4') is None
+    True
+    """
+    parts = (container_update_ids or '').split(',')
+    for container, update_id in zip(parts[::2], parts[1::2]):
+        if container == 'Q:0':
+            return update_id
+    return None
+
+
+def field_value(field, values):
+    """Return the value of a watched field from the evented variables
+
+    Returns None if the events did not tell the value (yet).
+
+    >>> field_value('volume', {'volume': {'Master': '25', 'LF': '100'}})
+    25
+
+    >>> field_value('state', {'transport_state': 'PLAYING'})
+    'PLAYING'
+    """
+    if field == 'current':
+        return track_info(values)
+    if field == 'state':
+        return values.get('transport_state')
+    if field == 'volume':
+        volume = values.get('volume', {}).get('Master')
+        return None if volume is None else int(volume)
+    return queue_update_id(values.get('container_update_i_ds'))
+
+
+# pylint: disable=useless-object-inheritance
+class StateCache(object):
+    """Cache of the speaker state, kept up to date by UPnP events
+
+    The transport state and the current track come from the AVTransport
+    events of the group coordinator, the speaker name from the
+    DeviceProperties events of the speaker itself.
+
+    Values are only returned by get while all subscriptions are live. If
+    the subscriptions fail or expire, get returns None and callers should
+    fall back to asking the speaker.
+
+    Args:
+        sonos (SoCo): The speaker
+        coordinator (SoCo): The coordinator of the group of the speaker
+    """
+
+    def __init__(self, sonos, coordinator):
+        self.sonos = sonos
+        self.coordinator = coordinator
+        self.values = {}
+        self.subscriptions = []
+        self._events = queue.Queue()
+        self._thread = None
+
+    def start(self):
+        """Subscribe to the events, returns whether that succeeded"""
+        try:
+            for service in [self.coordinator.avTransport,
+                            self.sonos.deviceProperties]:
+                self.subscriptions.append(service.subscribe(
+                    requested_timeout=SUBSCRIPTION_TIMEOUT, auto_renew=True,
+                    event_queue=self._events))
+        except (soco.exceptions.SoCoException, IOError):
+            self.stop()
+            return False
+
+        self._thread = threading.Thread(target=self._process_events)
+        self._thread.daemon = True
+        self._thread.start()
+        return True
+
+    def stop(self):
+        """Unsubscribe from the events"""
+        for subscription in self.subscriptions:
+            try:
+                subscription.unsubscribe()
+            except (soco.exceptions.SoCoException, IOError):
+                # The subscription simply expires on the speaker then
+                pass
+        self.subscriptions = []
+        self.values.clear()
+        if self._thread is not None:
+            self._events.put(None)
+            self._thread = None
+
+    @property
+    def is_live(self):
+        """Whether the events are currently being received"""
+        return bool(self.subscriptions) and all(
+            subscription.is_subscribed and subscription.time_left > 0
+            for subscription in self.subscriptions)
+
+    def get(self, name, sonos=None):
+        """Return a cached value or None if it is not known
+
+        Args:
+            name (str): The name of the value, such as 'transport_state',
+                'zone_name' or 'current_track_meta_data'
+            sonos (SoCo): If given, only return the value if the cache covers
+                this speaker (either the speaker or its coordinator)
+        """
+        if sonos is not None and sonos not in (self.sonos, self.coordinator):
+            return None
+        if not self.is_live:
+            return None
+        return self.values.get(name)
+
+    def current_track_info(self, sonos=None):
+        """Return the current track in the format of get_current_track_info
+
+        Returns None if the track is not known from the events.
+        """
+        if self.get('current_track_meta_data', sonos) is None:
+            return None
+        return track_info(self.values)
+
+    def invalidate(self, *names):
+        """Forget values until the next event brings them again
+
+        Called after commands changing them, whose events may not have
+        arrived yet."""
+        for name in names:
+            self.values.pop(name, None)
+
+    def _process_events(self):
+        """Update the values from the received events"""
+        while True:
+            event = self._events.get()
+            if event is None:
+                return
+            self.values.update(event.variables)
+
+
+class Watcher(object):
+    """Reports the changes of some fields of a speaker as they are evented
+
+    Every service is subscribed to once, however many of the fields come
+    from it. The subscriptions are renewed automatically, and subscribed to
+    again when they were lost, e.g. because the speaker restarted.
+
+    Args:
+        sonos (SoCo): The speaker
+        coordinator (SoCo): The coordinator of the group of the speaker
+        fields (list): The names of the fields, see WATCH_FIELDS
+    """
+
+    def __init__(self, sonos, coordinator, fields):
+        self.sonos = sonos
+        self.coordinator = coordinator
+        self.fields = list(fields)
+        self.values = {}
+        self.subscriptions = OrderedDict()
+        self._events = queue.Queue()
+
+    def services(self):
+        """Return the services the fields come from, each once"""
+        services = []
+        for field in self.fields:
+            name, on_coordinator = WATCH_FIELDS[field]
+            sonos = self.coordinator if on_coordinator else self.sonos
+            service = getattr(sonos, name)
+            if service not in services:
+                services.append(service)
+        return services
+
+    def _subscribe(self, service):
+        """Subscribe to the events of a service, replacing a lost one
+
+        The lost subscription is only replaced once subscribing succeeded,
+        so a failure leaves it in place to be retried by the next check.
+        """
+        subscription = service.subscribe(
+            requested_timeout=SUBSCRIPTION_TIMEOUT, auto_renew=True,
+            event_queue=self._events)
+        lost = self.subscriptions.get(service)
+        self.subscriptions[service] = subscription
+        if lost is not None:
+            try:
+                lost.unsubscribe()
+            except (soco.exceptions.SoCoException, IOError):
+                pass
+
+    def start(self):
+        """Subscribe to the events, raises the error if that fails"""
+        try:
+            for service in self.services():
+                self._subscribe(service)
+        except (soco.exceptions.SoCoException, IOError):
+            self.stop()
+            raise
+
+    def stop(self):
+        """Unsubscribe from the events"""
+        for subscription in self.subscriptions.values():
+            try:
+                subscription.unsubscribe()
+            except (soco.exceptions.SoCoException, IOError):
+                # The subscription simply expires on the speaker then
+                pass
+        self.subscriptions.clear()
+
+    def check(self):
+        """Subscribe again to the services whose subscription was lost
+
+        A failing renewal ends the subscription, so the events of the
+        service would silently stop. Failures are retried on the next check.
+        """
+        for service, subscription in list(self.subscriptions.items()):
+            if subscription.is_subscribed and subscription.time_left > 0:
+                continue
+            try:
+                self._subscribe(service)
+            except (soco.exceptions.SoCoException, IOError):
+                pass
+
+    def changes(self):
+        """Yield (field, value) whenever the value of a field changes
+
+        The current values are yielded first, as soon as the initial events
+        arrive. Runs until the generator is closed.
+        """
+        last = {}
+        next_check = time.time() + WATCH_CHECK_INTERVAL
+        while True:
+            try:
+                event = self._events.get(timeout=WATCH_CHECK_INTERVAL)
+            except queue.Empty:
+                event = None
+            if time.time() >= next_check:
+                self.check()
+                next_check = time.time() + WATCH_CHECK_INTERVAL
+            if event is None:
+                continue
+
+            self.values.update(event.variables)
+            for field in self.fields:
+                value = field_value(field, self.values)
+                if value is not None and value != last.get(field):
+                    last[field] = value
+                    yield field, value
+
+
+def stop_event_listener():
+    """Stop the listener soco starts for receiving events"""
+    # Only stop it if soco has been imported at all
+    if 'soco' in sys.modules and soco.events.event_listener.is_running:
+        soco.events.event_listener.stop()
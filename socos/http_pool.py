@@ -0,0 +1,156 @@
+"""Keep-alive HTTP connection pooling for the requests soco makes
+
+soco sends every SOAP request with a plain requests.post, which opens a new
+TCP connection each time. HTTPPool routes these requests through one
+requests session per speaker instead, so the connections are reused for as
+long as the speaker keeps them open.
+"""
+
+import sys
+import time
+import threading
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit  # pylint: disable=import-error
+
+from socos.utils import LazyModule, cancel_when_imported, when_imported
+
+requests = LazyModule('requests')  # pylint: disable=invalid-name
+
+# The modules whose requests are routed through the pool. soco.events is left
+# alone, event subscriptions are rare and have their own life cycle.
+PATCHED_MODULES = ['soco.services', 'soco.core']
+
+# The maximum number of connections kept open per speaker
+POOL_SIZE = 4
+
+
+# pylint: disable=useless-object-inheritance
+class _RequestsProxy(object):
+    """Stands in for the requests module in the patched modules"""
+
+    def __init__(self, pool):
+        self._pool = pool
+
+    def __getattr__(self, name):
+        # Everything but the request functions, e.g. exceptions
+        return getattr(requests, name)
+
+    def request(self, method, url, **kwargs):
+        """Send a request through the pool"""
+        return self._pool.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        """Send a GET request through the pool"""
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        """Send a POST request through the pool"""
+        return self.request('POST', url, **kwargs)
+
+
+class HTTPPool(object):
+    """A pool of keep-alive sessions, one per speaker (host and port)"""
+
+    def __init__(self):
+        self.sessions = {}
+        # Callables called as listener(method, url, kwargs, response,
+        # seconds) after every request, see socos.profiler
+        self.listeners = []
+        # If set, requests are sent with transport(method, url, **kwargs)
+        # instead of over the network, see socos.replay
+        self.transport = None
+        self._lock = threading.Lock()
+        self._originals = {}
+
+    def session(self, url):
+        """Return the session for the host of url"""
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self.sessions:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=1, pool_maxsize=POOL_SIZE)
+                session.mount('http://', adapter)
+                self.sessions[host] = session
+            return self.sessions[host]
+
+    def request(self, method, url, **kwargs):
+        """Send a request with the session of the host"""
+        start = time.time()
+        if self.transport is not None:
+            response = self.transport(method, url, **kwargs)
+        else:
+            response = self.session(url).request(method, url, **kwargs)
+        seconds = time.time() - start
+        for listener in self.listeners:
+            listener(method, url, kwargs, response, seconds)
+        return response
+
+    def install(self):
+        """Route the requests of soco through this pool
+
+        If soco is not imported yet, it is patched once it is imported."""
+        when_imported('soco', self._patch)
+
+    def _patch(self, _soco):
+        """Patch the imported soco modules"""
+        for name in PATCHED_MODULES:
+            module = sys.modules[name]
+            self._originals.setdefault(module, module.requests)
+            module.requests = _RequestsProxy(self)
+
+    def uninstall(self):
+        """Let soco use plain requests again"""
+        cancel_when_imported('soco', self._patch)
+        for module, original in self._originals.items():
+            module.requests = original
+        self._originals.clear()
+
+    def close(self):
+        """Close all open connections"""
+        with self._lock:
+            sessions = list(self.sessions.values())
+            self.sessions.clear()
+        for session in sessions:
+            session.close()
+
+    def stats(self):
+        """Return the number of requests and opened connections per host
+
+        Returns:
+            dict: (requests, connections) tuples by host
+        """
+        stats = {}
+        with self._lock:
+            sessions = list(self.sessions.items())
+        for host, session in sessions:
+            pools = session.get_adapter('http://').poolmanager.pools
+            requests_sent = connections = 0
+            for key in pools.keys():
+                pool = pools[key]
+                requests_sent += pool.num_requests
+                connections += pool.num_connections
+            stats[host] = (requests_sent, connections)
+        return stats
+
+    def summary(self, names):
+        """Yield a line of statistics per host and one with the totals
+
+        Args:
+            names (dict): The speaker names by ip, shown instead of the host
+        """
+        total_requests = total_connections = 0
+        for host, (requests_sent, connections) in sorted(
+                self.stats().items()):
+            name = names.get(host.split(':')[0], host)
+            total_requests += requests_sent
+            total_connections += connections
+            yield '{}: {} requests, {} connections opened, {} reused'.format(
+                name, requests_sent, connections,
+                max(requests_sent - connections, 0))
+        yield 'Total: {} requests, {} connections opened, {} reused'.format(
+            total_requests, total_connections,
+            max(total_requests - total_connections, 0))
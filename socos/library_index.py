@@ -0,0 +1,239 @@
+"""Local SQLite full-text index of the music library
+
+Searching the music library on the speaker is slow for large libraries and
+limited to prefix matching. The index is crawled once with "library index"
+and then answers the music library searches locally.
+"""
+
+import os
+import re
+import time
+import threading
+
+from socos.cache import cache_path
+from socos.utils import LazyModule
+
+# pylint: disable=invalid-name
+soco = LazyModule('soco')
+sqlite3 = LazyModule('sqlite3')
+
+# The data types that are indexed. Sonos playlists are edited from the
+# controllers all the time, so they are always searched on the speaker.
+INDEXED_TYPES = ['tracks', 'albums', 'artists', 'playlists']
+
+# The number of items requested from the speaker at a time while crawling
+CRAWL_PAGE_SIZE = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY,
+    data_type TEXT NOT NULL,
+    title TEXT NOT NULL,
+    album TEXT NOT NULL,
+    creator TEXT NOT NULL,
+    didl TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS items_data_type ON items (data_type);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(
+    title, album, creator, content='items', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 1'
+);
+"""
+
+# Matches the words of a search term
+WORD_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+
+def _text(value):
+    """Return value as text, with None as the empty string"""
+    if value is None:
+        return u''
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
+def fts_query(term):
+    """Turn a search term into an FTS query matching all words as prefixes
+
+    >>> print(fts_query('metal  "Black'))
+    "metal"* "Black"*
+    """
+    return ' '.join('"{}"*'.format(word)
+                    for word in WORD_PATTERN.findall(term))
+
+
+# pylint: disable=useless-object-inheritance
+class LibraryIndex(object):
+    """A full-text index of the music library stored in SQLite
+
+    The index is shared by the threads of commands run on several speakers
+    at once, the single connection is only used by one thread at a time.
+
+    Args:
+        path (str): The database file, defaults to library.sqlite in the
+            socos cache directory
+    """
+
+    def __init__(self, path=None):
+        self.path = path or cache_path('library.sqlite')
+        self._connection = None
+        self._has_fts = None
+        self._lock = threading.RLock()
+
+    @property
+    def connection(self):
+        """The database connection, the database is created if needed"""
+        with self._lock:
+            if self._connection is None:
+                directory = os.path.dirname(self.path)
+                if directory and not os.path.isdir(directory):
+                    os.makedirs(directory)
+                self._connection = sqlite3.connect(
+                    self.path, check_same_thread=False)
+                self._connection.executescript(SCHEMA)
+                try:
+                    self._connection.executescript(FTS_SCHEMA)
+                    self._has_fts = True
+                except sqlite3.OperationalError:
+                    # SQLite was built without FTS5, fall back to LIKE queries
+                    self._has_fts = False
+            return self._connection
+
+    def exists(self):
+        """Return whether an index has been built"""
+        return os.path.exists(self.path) and self.get_meta('built') is not None
+
+    def get_meta(self, key):
+        """Return the meta data value stored for key, or None"""
+        with self._lock:
+            row = self.connection.execute(
+                'SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        """Store a meta data value"""
+        with self._lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                (key, value))
+
+    def is_current(self, update_id):
+        """Return whether the index was built at the library update id
+
+        If the speaker does not report update ids, the index is assumed to
+        be current."""
+        return update_id is None or self.get_meta('update_id') == update_id
+
+    def count(self, data_type=None):
+        """Return the number of indexed items, optionally of one data type"""
+        if data_type is None:
+            query, params = 'SELECT COUNT(*) FROM items', ()
+        else:
+            query = 'SELECT COUNT(*) FROM items WHERE data_type = ?'
+            params = (data_type,)
+        with self._lock:
+            return self.connection.execute(query, params).fetchone()[0]
+
+    def build(self, sonos, update_id=None):
+        """Crawl the music library of sonos into the index
+
+        The previous content of the index is replaced in a single transaction,
+        so searches never see a half built index.
+
+        Args:
+            sonos (SoCo): The speaker to crawl the music library from
+            update_id (str): The library update id to store with the index
+
+        Returns:
+            int: The number of indexed items
+        """
+        with self._lock:
+            connection = self.connection
+            with connection:
+                connection.execute('DELETE FROM items')
+                for data_type in INDEXED_TYPES:
+                    connection.executemany(
+                        'INSERT INTO items (data_type, title, album, '
+                        'creator, didl) VALUES (?, ?, ?, ?, ?)',
+                        self._crawl(sonos, data_type))
+                if self._has_fts:
+                    connection.execute(
+                        "INSERT INTO items_fts (items_fts) VALUES "
+                        "('rebuild')")
+                self.set_meta('built', str(time.time()))
+                self.set_meta('update_id', update_id)
+            return self.count()
+
+    @staticmethod
+    def _crawl(sonos, data_type):
+        """Yield the rows for all items of data_type, page by page"""
+        start = 0
+        while True:
+            result = sonos.music_library.get_music_library_information(
+                data_type, start=start, max_items=CRAWL_PAGE_SIZE)
+            for item in result:
+                yield (
+                    data_type,
+                    _text(item.title),
+                    _text(getattr(item, 'album', None)),
+                    _text(getattr(item, 'creator', None)),
+                    soco.data_structures.to_didl_string(item),
+                )
+            start += len(result)
+            if not result or start >= result.total_matches:
+                break
+
+    def search(self, data_type, search_term):
+        """Search the index
+
+        All words of search_term have to match the beginning of a word in the
+        title, album or creator. Results are ranked by relevance. If that
+        does not find anything, items containing search_term anywhere are
+        returned.
+
+        Returns:
+            list: The matching items as DIDL objects
+        """
+        if not search_term:
+            raise ValueError('Searching the index needs a search term')
+        with self._lock:
+            rows = self._search_rows(data_type, search_term)
+        from_didl_string = soco.data_structures_entry.from_didl_string
+        return [from_didl_string(row[0])[0] for row in rows]
+
+    def _search_rows(self, data_type, search_term):
+        """Return the rows of the items found by search"""
+        rows = []
+        if self._has_fts and fts_query(search_term):
+            rows = self.connection.execute(
+                'SELECT items.didl FROM items_fts '
+                'JOIN items ON items.id = items_fts.rowid '
+                'WHERE items_fts MATCH ? AND items.data_type = ? '
+                'ORDER BY bm25(items_fts, 10.0, 2.0, 5.0), items.id',
+                (fts_query(search_term), data_type)).fetchall()
+
+        if not rows:
+            pattern = u'%{}%'.format(_text(search_term))
+            rows = self.connection.execute(
+                'SELECT didl FROM items WHERE data_type = ? AND '
+                '(title LIKE ? OR album LIKE ? OR creator LIKE ?) '
+                'ORDER BY id',
+                (data_type, pattern, pattern, pattern)).fetchall()
+        return rows
+
+    def drop(self):
+        """Delete the index"""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+            if os.path.exists(self.path):
+                os.remove(self.path)
@@ -0,0 +1,185 @@
+"""Incremental change detection for the music library
+
+A compact snapshot of the library tree (the ids of the child containers and
+items of every container, with the container's update id and child count)
+is stored locally. "library sync" compares the speaker against it and only
+re-walks containers whose update id or child count changed.
+"""
+
+import time
+from collections import namedtuple
+
+from socos.cache import cache_path, write_atomic
+from socos.exceptions import SocosException
+from socos.utils import LazyModule, library_update_id
+
+# pylint: disable=invalid-name
+ElementTree = LazyModule('xml.etree.ElementTree')
+json = LazyModule('json')
+soco = LazyModule('soco')
+
+# The containers the walk starts from, S: holds the music shares as folders
+DEFAULT_ROOTS = ['S:']
+
+# The number of children requested at a time
+BROWSE_PAGE_SIZE = 500
+
+DIDL_NAMESPACE = '{urn:schemas-upnp-org:metadata-1-0/DIDL-Lite/}'
+
+# The outcome of a sync:
+#     added (list): Ids of the items that were added
+#     removed (list): Ids of the items that were removed
+#     walked (int): Number of containers that were browsed
+#     skipped (int): Number of containers reused from the snapshot
+#     items (int): The total number of items in the library
+#     seconds (float): The time the sync took
+SyncResult = namedtuple(
+    'SyncResult', 'added removed walked skipped items seconds')
+
+
+def parse_children(didl):
+    """Return the ids of the containers and items in a DIDL-Lite string
+
+    >>> parse_children(
+    ...     '<DIDL-Lite xmlns="urn:schemas-upnp-org:metadata-1-0/DIDL-Lite/">'
+    ...     '<container id="S:a/b"/><item id="S:a/c.mp3"/></DIDL-Lite>')
+    (['S:a/b'], ['S:a/c.mp3'])
+    """
+    if not didl:
+        return [], []
+    tree = ElementTree.fromstring(didl.encode('utf-8'))
+    containers = [element.get('id')
+                  for element in tree.iter(DIDL_NAMESPACE + 'container')]
+    items = [element.get('id')
+             for element in tree.iter(DIDL_NAMESPACE + 'item')]
+    return containers, items
+
+
+# pylint: disable=useless-object-inheritance
+class LibrarySnapshot(object):
+    """Snapshot of the music library tree stored as JSON
+
+    Args:
+        path (str): The snapshot file, defaults to library-snapshot.json in
+            the socos cache directory
+    """
+
+    def __init__(self, path=None):
+        self.path = path or cache_path('library-snapshot.json')
+
+    def load(self):
+        """Return the stored snapshot, or an empty one"""
+        try:
+            with open(self.path) as snapshot_file:
+                return json.load(snapshot_file)
+        except (IOError, OSError, ValueError):
+            return {'update_id': None, 'roots': [], 'containers': {}}
+
+    def save(self, snapshot):
+        """Store the snapshot"""
+        write_atomic(self.path, json.dumps(snapshot, separators=(',', ':')))
+
+    def sync(self, sonos, roots=None):  # pylint: disable=too-many-locals
+        """Bring the snapshot up to date with the library of sonos
+
+        If the library update id is unchanged, nothing is browsed at all.
+        Otherwise the tree is walked from the roots, reusing the stored
+        subtree of every container whose update id and child count are
+        unchanged. This relies on the speaker changing the update id of a
+        container when anything below it changes.
+
+        Returns:
+            SyncResult: What changed and how much work it took
+        """
+        start = time.time()
+        roots = roots or DEFAULT_ROOTS
+        old = self.load()
+        update_id = library_update_id(sonos)
+
+        old_items = set(self._items(old['containers'], old['roots']))
+        if update_id is not None and update_id == old['update_id'] and \
+                roots == old['roots']:
+            return SyncResult([], [], 0, len(old['containers']),
+                              len(old_items), time.time() - start)
+
+        containers = {}
+        walked = skipped = 0
+        pending = list(roots)
+        while pending:
+            container_id = pending.pop()
+            entry, complete = self._browse(
+                sonos, container_id, old['containers'].get(container_id))
+            if complete:
+                walked += 1
+            else:
+                # Unchanged, take over the whole subtree from the snapshot
+                for reused_id in self._subtree(old['containers'],
+                                               container_id):
+                    containers[reused_id] = old['containers'][reused_id]
+                    skipped += 1
+                continue
+            containers[container_id] = entry
+            pending.extend(entry['containers'])
+
+        new_items = set(self._items(containers, roots))
+        self.save({'update_id': update_id, 'roots': roots,
+                   'containers': containers})
+        return SyncResult(
+            sorted(new_items - old_items), sorted(old_items - new_items),
+            walked, skipped, len(new_items), time.time() - start)
+
+    @staticmethod
+    def _browse(sonos, container_id, old_entry):
+        """Browse a container, unless it is unchanged since old_entry
+
+        Returns:
+            tuple: The new entry for the container, and whether it was browsed
+            completely (False means it was unchanged)
+        """
+        entry = {'containers': [], 'items': []}
+        start = 0
+        while True:
+            try:
+                response = sonos.contentDirectory.Browse([
+                    ('ObjectID', container_id),
+                    ('BrowseFlag', 'BrowseDirectChildren'),
+                    ('Filter', '*'),
+                    ('StartingIndex', start),
+                    ('RequestedCount', BROWSE_PAGE_SIZE),
+                    ('SortCriteria', ''),
+                ])
+            except soco.exceptions.SoCoUPnPException as ex:
+                raise SocosException(
+                    'Could not browse "{}", is it a container of the music '
+                    'library? {}'.format(container_id, ex))
+            entry['update_id'] = response['UpdateID']
+            entry['count'] = int(response['TotalMatches'])
+            if start == 0 and old_entry is not None and \
+                    old_entry['update_id'] == entry['update_id'] and \
+                    old_entry['count'] == entry['count']:
+                return old_entry, False
+
+            containers, items = parse_children(response['Result'])
+            entry['containers'].extend(containers)
+            entry['items'].extend(items)
+            start += int(response['NumberReturned'])
+            if not int(response['NumberReturned']) or start >= entry['count']:
+                return entry, True
+
+    @staticmethod
+    def _subtree(containers, root):
+        """Yield the ids of root and all containers below it"""
+        pending = [root]
+        while pending:
+            container_id = pending.pop()
+            if container_id not in containers:
+                continue
+            yield container_id
+            pending.extend(containers[container_id]['containers'])
+
+    def _items(self, containers, roots):
+        """Yield the ids of all items below roots"""
+        for root in roots:
+            for container_id in self._subtree(containers, root):
+                for item_id in containers[container_id]['items']:
+                    yield item_id
@@ -1,30 +1,174 @@
 """The mixer modules functionality for adjusting volume, bass, treble."""
 
+from socos.utils import map_concurrently
 
-def _adjust_setting(soco, attr, operator, min_val, max_val):
-    """Adjust setting "attr" by "operator"""
+# The valid range of every setting
+LIMITS = {
+    'volume': (0, 100),
+    'bass': (-10, 10),
+    'treble': (-10, 10),
+}
+
+
+def _adjust_setting(soco, attr, operator, confirm=False):
+    """Adjust setting "attr" by "operator"
+
+    Operators without + or - are numbers the setting is set to. The new
+    value is returned without reading it back from the device, unless
+    confirm is set."""
+
+    if not operator.startswith(('+', '-')):
+        newval = apply_setting(soco, attr, operator)
+        return getattr(soco, attr) if confirm else newval
 
     factor = get_factor(operator)
     val = getattr(soco, attr)
-    newval = in_range(val + factor, min_val, max_val)
+    newval = in_range(val + factor, *LIMITS[attr])
     setattr(soco, attr, newval)
 
-    return getattr(soco, attr)
+    if confirm:
+        return getattr(soco, attr)
+    return newval
 
 
-def adjust_volume(soco, operator):
-    """Adjust the volume up or down with a factor from 1 to 100"""
-    return _adjust_setting(soco, 'volume', operator, 0, 100)
+def adjust_volume(soco, operator, confirm=False):
+    """Adjust the volume up or down with a factor from 1 to 100
+
+    This uses the relative volume action of the device, which adjusts the
+    volume and returns the new one in a single request. Operators without
+    + or - are numbers the volume is set to."""
+    if not operator.startswith(('+', '-')):
+        newval = apply_setting(soco, 'volume', operator)
+        return soco.volume if confirm else newval
+
+    factor = get_factor(operator)
+    response = soco.renderingControl.SetRelativeVolume([
+        ('InstanceID', 0),
+        ('Channel', 'Master'),
+        ('Adjustment', factor),
+    ])
+
+    if confirm:
+        return soco.volume
+    return int(response['NewVolume'])
 
 
-def adjust_bass(soco, operator):
+def adjust_bass(soco, operator, confirm=False):
     """Adjust the bass up or down with a factor from -10 to 10"""
-    return _adjust_setting(soco, 'bass', operator, -10, 10)
+    return _adjust_setting(soco, 'bass', operator, confirm)
 
 
-def adjust_treble(soco, operator):
+def adjust_treble(soco, operator, confirm=False):
     """Adjust the treble up or down with a factor from -10 to 10"""
-    return _adjust_setting(soco, 'treble', operator, -10, 10)
+    return _adjust_setting(soco, 'treble', operator, confirm)
+
+
+def single_operator(command, positional):
+    """Return the operator of volume, bass or treble, like "+5" or "30"
+
+    >>> single_operator('bass', ['-2'])
+    '-2'
+    >>> single_operator('volume', [])
+    Traceback (most recent call last):
+    ...
+    ValueError: Usage: volume IP [+N|-N|N] [--confirm]
+    """
+    if len(positional) != 1:
+        raise ValueError(
+            'Usage: {} IP [+N|-N|N] [--confirm]'.format(command))
+    return positional[0]
+
+
+def parse_settings(assignments):
+    """Parse setting assignments like "volume=+5" into (name, value) tuples
+
+    >>> parse_settings(['volume=+5', 'bass=-2', 'treble=0'])
+    [('volume', '+5'), ('bass', '-2'), ('treble', '0')]
+    """
+    settings = []
+    for assignment in assignments:
+        name, _, value = assignment.partition('=')
+        if name not in LIMITS or not value:
+            raise ValueError(
+                'Invalid setting "{}", use e.g. volume=+5, bass=-2 or '
+                'treble=0'.format(assignment))
+        settings.append((name, value))
+    return settings
+
+
+def apply_setting(soco, name, value):
+    """Apply a single setting and return the new value
+
+    Values starting with + or - are relative adjustments, other values are
+    set as they are."""
+    min_val, max_val = LIMITS[name]
+    if value.startswith(('+', '-')):
+        if name == 'volume':
+            return adjust_volume(soco, value)
+        return _adjust_setting(soco, name, value)
+
+    try:
+        newval = in_range(int(value), min_val, max_val)
+    except ValueError:
+        raise ValueError('"{}" is not a number or +/-'.format(value))
+    setattr(soco, name, newval)
+    return newval
+
+
+def apply_settings(soco, settings):
+    """Apply several settings at once
+
+    The settings are applied concurrently, so together they take about as
+    long as a single one.
+
+    Returns:
+        list: (name, new value) tuples in the order of settings
+    """
+    newvals = map_concurrently(
+        lambda setting: apply_setting(soco, *setting), settings)
+    return [(setting[0], newval)
+            for setting, newval in zip(settings, newvals)]
+
+
+def group_level(volumes):
+    """Return the volume level of a group, the average of its members
+
+    >>> group_level([10, 20, 40])
+    23
+    """
+    return int(round(float(sum(volumes)) / len(volumes)))
+
+
+def scale_volumes(volumes, operator):
+    """Scale the volumes of a group's members to a new group level
+
+    operator is either an absolute group level or a relative change like
+    "+5". Every member keeps its level relative to the others.
+
+    >>> scale_volumes([10, 20, 30], '+10')
+    [15, 30, 45]
+
+    >>> scale_volumes([10, 20, 30], '10')
+    [5, 10, 15]
+
+    >>> scale_volumes([0, 0], '+')
+    [1, 1]
+    """
+    current = float(sum(volumes)) / len(volumes)
+    if operator.startswith(('+', '-')):
+        target = current + get_factor(operator)
+    else:
+        try:
+            target = int(operator)
+        except ValueError:
+            raise ValueError('"{}" is not a number or +/-'.format(operator))
+    target = in_range(target, 0, 100)
+
+    if not current:
+        # Nothing to scale, all members get the new level
+        return [int(round(target)) for _ in volumes]
+    return [in_range(int(round(volume * target / current)), 0, 100)
+            for volume in volumes]
 
 
 def get_factor(operator):
@@ -6,11 +6,39 @@
 
 from __future__ import print_function
 
+import sys
+import time
+
+from socos.cache import QUERY_CACHE
+from socos.library_index import INDEXED_TYPES, LibraryIndex
+from socos.output import Record
+from socos.library_sync import LibrarySnapshot
+from socos.utils import (
+    TTLCache, acts_on_group, extract_options, get_coordinator,
+    library_update_id, parse_selection)
+
+# Seconds for which search results are kept for follow-up add/replace
+SEARCH_CACHE_TTL = 10 * 60
+
+# The maximum number of search results kept
+SEARCH_CACHE_SIZE = 32
+
+# The data types whose search results are not cached. Sonos playlists are
+# edited without re-indexing the music library, so the library update id
+# does not tell when they changed.
+UNCACHED_TYPES = ['sonos_playlists']
+
 
 class MusicLibrary(object):  # pylint: disable=useless-object-inheritance
 
     """Class that implements music library support for socos"""
 
+    def __init__(self):
+        self.search_cache = TTLCache(SEARCH_CACHE_TTL, SEARCH_CACHE_SIZE)
+        self.index = LibraryIndex()
+        self.snapshot = LibrarySnapshot()
+
+    @acts_on_group
     def tracks(self, sonos, *args):
         """Public convenience method for `_search_and_play`
         with ``data_type='tracks'``. For details of other arguments
@@ -20,6 +48,7 @@ class MusicLibrary(object):  # pylint: disable=useless-object-inheritance
         """
         return self._search_and_play(sonos, 'tracks', *args)
 
+    @acts_on_group
     def playlists(self, sonos, *args):
         """Public convenience method for `_search_and_play`
         with ``data_type='playlists'``. For details of other arguments
@@ -29,6 +58,7 @@ class MusicLibrary(object):  # pylint: disable=useless-object-inheritance
         """
         return self._search_and_play(sonos, 'playlists', *args)
 
+    @acts_on_group
     def sonos_playlists(self, sonos, *args):
         """Public convenience method for `_search_and_play`
         with ``data_type='sonos_playlists'``. For details of other arguments
@@ -37,6 +67,7 @@ class MusicLibrary(object):  # pylint: disable=useless-object-inheritance
         """
         return self._search_and_play(sonos, 'sonos_playlists', *args)
 
+    @acts_on_group
     def albums(self, sonos, *args):
         """Public convenience method for `_search_and_play`
         with ``data_type='albums'``. For details of other arguments
@@ -46,6 +77,7 @@ class MusicLibrary(object):  # pylint: disable=useless-object-inheritance
         """
         return self._search_and_play(sonos, 'albums', *args)
 
+    @acts_on_group
     def artists(self, sonos, *args):
         """Public convenience method for `_search_and_play`
         with ``data_type='artists'``. For details of other arguments
@@ -55,6 +87,65 @@ class MusicLibrary(object):  # pylint: disable=useless-object-inheritance
         """
         return self._search_and_play(sonos, 'artists', *args)
 
+    def library(self, sonos, *args):
+        """Manage locally stored music library information
+
+        "library index" crawls the music library into a local full-text
+        index, which is then used to answer searches for tracks, albums,
+        artists and playlists. "library unindex" deletes the index again.
+        "library sync [--verbose] [ROOT...]" updates a local snapshot of the
+        library tree (by default the music shares) and reports the items
+        that were added and removed since the last sync. "library stats"
+        shows the state of the index and the search result cache, "library
+        clear" empties the cache."""
+        actions = ['stats', 'clear', 'index', 'unindex', 'sync']
+        if not args or args[0] not in actions:
+            raise ValueError('Action must be one of {}'.format(
+                ', '.join("'{}'".format(action) for action in actions)))
+
+        action = args[0]
+        if action == 'index':
+            start = time.time()
+            count = self.index.build(sonos, library_update_id(sonos))
+            self.search_cache.clear()
+            QUERY_CACHE.invalidate(sonos, 'library_update_id')
+            return 'Indexed {} items in {:.1f} seconds'.format(
+                count, time.time() - start)
+        if action == 'sync':
+            return self._sync(sonos, *args[1:])
+        if action == 'unindex':
+            self.index.drop()
+            return 'Index deleted'
+        if action == 'clear':
+            self.search_cache.clear()
+        return self._stats()
+
+    def _sync(self, sonos, *args):
+        """Sync the library snapshot and describe the changes"""
+        roots, options = extract_options(args, flags=['--verbose'])
+        result = self.snapshot.sync(sonos, roots)
+        lines = []
+        if options.get('verbose'):
+            lines += ['+ ' + item_id for item_id in result.added]
+            lines += ['- ' + item_id for item_id in result.removed]
+        lines.append(
+            'Synced in {:.1f} seconds: {} items added, {} removed, {} '
+            'containers browsed, {} unchanged, {} items in total'.format(
+                result.seconds, len(result.added), len(result.removed),
+                result.walked, result.skipped, result.items))
+        return lines
+
+    def _stats(self):
+        """Return the state of the index and the search cache"""
+        if self.index.exists():
+            built = time.strftime('%Y-%m-%d %H:%M', time.localtime(
+                float(self.index.get_meta('built'))))
+            index = 'Index: {} items, built {}'.format(
+                self.index.count(), built)
+        else:
+            index = 'Index: not built, use "library index"'
+        return '\n'.join([index, 'Search cache: ' + self.search_cache.stats()])
+
     def _search_and_play(self, sonos, data_type, *args):
         """Retrieve music information objects from the
         music library.
@@ -77,19 +168,18 @@ class MusicLibrary(object):  # pylint: disable=useless-object-inheritance
 
         Will perform a fuzzy search for the term 'Metallica' among all
         the artists and add the result by number 1 to the queue. Within
-        a group of speakers, this can only be performed on the coordinator.
+        a group of speakers, it is added to the queue of the coordinator.
 
             _search_and_play(sonos, 'artists', 'Metallica', 'replace', 1)
 
         Similar to 'add', but this replaces the existing queue with
         the returned music information object.
+
+            _search_and_play(sonos, 'tracks', 'Metallica', 'add', '1..50')
+
+        Adds the results 1 to 50 at once, see `_play` for the selections.
         """
-        if not args:
-            items = sonos.music_library.get_music_library_information(
-                search_type=data_type)
-        else:
-            items = sonos.music_library.get_music_library_information(
-                search_type=data_type, search_term=args[0])
+        items = self._search(sonos, data_type, *args[:1])
 
         if len(args) < 2:
             for string in self._print_results(data_type, items):
@@ -97,6 +187,43 @@ class MusicLibrary(object):  # pylint: disable=useless-object-inheritance
         else:
             yield self._play(sonos, data_type, items, *args)
 
+    def _search(self, sonos, data_type, search_term=None):
+        """Search the music library, reusing recent results
+
+        If the music library has been indexed with "library index", the index
+        is searched instead of the speaker, as long as the speaker has not
+        re-indexed the music library since. Otherwise results are cached per
+        speaker, data type and search term, so that e.g. "tracks Metallica
+        add 3" after "tracks Metallica" does not search again. The key
+        includes the library update id, so results are searched again once
+        the music library has been re-indexed. The update id itself is kept
+        in the query cache for a minute, so a cached search needs no request
+        at all. Sonos playlists are always searched on the speaker.
+        """
+        update_id = QUERY_CACHE.get(sonos, 'library_update_id',
+                                    lambda: library_update_id(sonos))
+        if search_term and data_type in INDEXED_TYPES and \
+                self.index.exists():
+            if self.index.is_current(update_id):
+                return self.index.search(data_type, search_term)
+            print('The music library changed since it was indexed, '
+                  'searching the speaker. Run "library index" to update '
+                  'the index.', file=sys.stderr)
+
+        key = (sonos.ip_address, update_id, data_type, search_term)
+        items = None
+        if data_type not in UNCACHED_TYPES:
+            items = self.search_cache.get(key)
+        if items is None:
+            kwargs = {'search_type': data_type}
+            if search_term is not None:
+                kwargs['search_term'] = search_term
+            items = sonos.music_library.get_music_library_information(
+                **kwargs)
+            if data_type not in UNCACHED_TYPES:
+                self.search_cache.put(key, items)
+        return items
+
     @staticmethod
     def _play(sonos, data_type, results, *args):
         """
@@ -115,19 +242,23 @@ class MusicLibrary(object):  # pylint: disable=useless-object-inheritance
 
         Will replace the current queue with the item by index 4 from
         collection `items`.
+
+        Several items can be selected at once, e.g. with '1..50',
+        '3,7,9-12' or 'all'. They are added with the multi-URI add action
+        of the device, which takes up to 16 items per request.
         """
 
-        action, number = args[1:]  # pylint: disable=unbalanced-tuple-unpacking
+        # pylint: disable=unbalanced-tuple-unpacking
+        action, selection = args[1:]
 
         if action not in ['add', 'replace']:
             message = "'Action must be one of 'add' or 'replace'"
             raise ValueError(message)
 
-        try:
-            number = int(number) - 1
-        except ValueError:
-            raise ValueError('Play number must be parseable as integer')
-        if number not in range(len(results)):
+        numbers = parse_selection(selection, len(results))
+        for number in numbers:
+            if number - 1 in range(len(results)):
+                continue
             if not results:
                 message = 'No results to play from'
             elif len(results) == 1:
@@ -136,10 +267,25 @@ class MusicLibrary(object):  # pylint: disable=useless-object-inheritance
                 message = 'Play number has to be within the range 1 to {}'.\
                     format(len(results))
             raise ValueError(message)
-        item = results[number]
-        out = "Added {} to queue: '{}'"
+        if not numbers:
+            raise ValueError('No results to play from')
+        items = [results[number - 1] for number in numbers]
+
+        # The queue belongs to the group
+        sonos = get_coordinator(sonos)
         if action == 'replace':
             sonos.clear_queue()
+            QUERY_CACHE.invalidate(sonos, 'state', 'current')
+        if len(items) > 1:
+            sonos.add_multiple_to_queue(items)
+            out = "Added {} {} to queue"
+            if action == 'replace':
+                out = "Queue replaced with {} {}"
+            return out.format(len(items), data_type)
+
+        item = items[0]
+        out = "Added {} to queue: '{}'"
+        if action == 'replace':
             out = "Queue replaced with {}: '{}'"
         sonos.add_to_queue(item)
         title = item.title
@@ -161,8 +307,13 @@ class MusicLibrary(object):  # pylint: disable=useless-object-inheritance
         index_length = len(str(len(results)))
         for index, item in enumerate(results):
             item_dict = item.to_dict()
+            data = dict((key, item_dict[key]) for key in
+                        ['title', 'album', 'creator', 'item_id']
+                        if key in item_dict)
             for key, value in item_dict.items():
                 if hasattr(value, 'decode'):
                     item_dict[key] = value.encode('utf-8')
             number = '({{: >{}}}) '.format(index_length).format(index + 1)
-            yield number + print_patterns[data_type].format(**item_dict)
+            yield Record(
+                number + print_patterns[data_type].format(**item_dict),
+                number=index + 1, type=data_type, **data)
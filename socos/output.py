@@ -0,0 +1,200 @@
+"""Output of the commands as text or as JSON records
+
+Commands return or yield lines of text. Lines that show data are Records,
+strings that also carry the data they show. They are printed as text by
+default and as JSON objects with "socos --format json" or "--format ndjson",
+so scripts do not have to parse the text.
+"""
+
+from __future__ import print_function
+
+import sys
+
+from socos.utils import LazyModule
+
+json = LazyModule('json')  # pylint: disable=invalid-name
+
+try:
+    # pylint: disable=invalid-name,undefined-variable
+    text_type = unicode
+except NameError:
+    # unicode has been renamed to str in Python 3
+    text_type = str  # pylint: disable=invalid-name
+
+# The output formats, text is the default
+FORMATS = ['text', 'json', 'ndjson']
+
+
+class Record(text_type):
+    """A line of output together with the data it shows
+
+    Records are text, so titles and room names may contain any characters,
+    also on Python 2.
+
+    >>> record = Record('Kitchen: 25', name='Kitchen', volume=25)
+    >>> print(record)
+    Kitchen: 25
+    >>> record.data == {'name': 'Kitchen', 'volume': 25}
+    True
+    >>> Record(u'1: Caf\xe9') == u'1: Caf\xe9'
+    True
+    """
+
+    def __new__(cls, text, **data):
+        if isinstance(text, bytes):
+            text = text.decode('utf-8')
+        record = text_type.__new__(cls, text)
+        record.data = data
+        return record
+
+
+def record_data(line):
+    """Return the data of a line of output
+
+    Lines that are not Records are returned as text.
+
+    >>> record_data(Record('25', volume=25))
+    {'volume': 25}
+    >>> record_data('PLAYING')
+    {'text': 'PLAYING'}
+    """
+    data = getattr(line, 'data', None)
+    if data is not None:
+        return data
+    return {'text': str(line)}
+
+
+def track_data(track):
+    """Return the data of a record of the current track
+
+    track is a dict as returned by SoCo.get_current_track_info. Its
+    playlist_position becomes position, the number of the track in the
+    queue as in the records of "queue", and its position, the time played,
+    becomes elapsed.
+
+    >>> sorted(track_data({'title': 'Foo', 'playlist_position': '3',
+    ...                    'position': '0:01:02'}).items())
+    [('elapsed', '0:01:02'), ('position', 3), ('title', 'Foo')]
+    """
+    keys = [('artist', 'artist'), ('title', 'title'), ('album', 'album'),
+            ('playlist_position', 'position'), ('duration', 'duration'),
+            ('position', 'elapsed'), ('uri', 'uri')]
+    data = dict((name, track[key]) for key, name in keys if key in track)
+    if 'position' in data:
+        try:
+            data['position'] = int(data['position'])
+        except ValueError:
+            # Nothing is playing
+            data['position'] = None
+    return data
+
+
+def load_colorama():
+    """Return the colorama module if the output goes to a terminal
+
+    colorama is neither imported for output into pipes or files nor when
+    it is not installed, in both cases None is returned."""
+    if not sys.stdout.isatty():
+        return None
+    try:
+        # pylint: disable=bad-option-value,import-error,import-outside-toplevel
+        import colorama
+    except ImportError:
+        return None
+    return colorama
+
+
+# pylint: disable=useless-object-inheritance
+class Printer(object):
+    """Prints the output lines of a command in one of FORMATS
+
+    With json the output of a command is a single JSON array, streamed
+    element by element, with ndjson every line is a JSON object of its own.
+    Call finish once the command is done.
+
+    >>> printer = Printer('json')
+    >>> printer.print_line(Record('1: Foo', position=1))
+    [{"position": 1}
+    >>> printer.print_line('Done')
+    ,{"text": "Done"}
+    >>> printer.finish()
+    ]
+    """
+
+    def __init__(self, output_format='text'):
+        if output_format not in FORMATS:
+            raise ValueError('Unknown output format "{}", use one of: '
+                             '{}'.format(output_format, ', '.join(FORMATS)))
+        self.output_format = output_format
+        self._lines = 0
+
+    def print_line(self, line, speaker=None):
+        """Print a line of output
+
+        speaker is the name of the speaker the line is about, when a
+        command runs on several speakers."""
+        if self.output_format == 'text':
+            self._print(line if speaker is None else
+                        u'[{}] {}'.format(speaker, line))
+        else:
+            data = record_data(line)
+            if speaker is not None:
+                data = dict(data, speaker=speaker)
+            text = json.dumps(data, sort_keys=True)
+            if self.output_format == 'json':
+                text = (',' if self._lines else '[') + text
+            print(text)
+        self._lines += 1
+        # Lines of long running commands like watch are printed as they
+        # come, also into pipes
+        sys.stdout.flush()
+
+    @staticmethod
+    def _print(text):
+        """Print text, encoded when stdout has no encoding
+
+        On Python 2 printing text to a pipe or a file, which have no
+        encoding, would encode it as ASCII and fail on any other character.
+        """
+        if text_type is not str and isinstance(text, text_type):
+            encoding = getattr(sys.stdout, 'encoding', None)
+            if encoding is None:
+                text = text.encode('utf-8')
+        print(text)
+
+    def finish(self):
+        """Finish the output of the command"""
+        if self.output_format == 'json':
+            print(']' if self._lines else '[]')
+        self._lines = 0
+
+
+class PrefixedStream(object):
+    """File-like object writing every line to stream with a prefix
+
+    >>> stream = PrefixedStream(sys.stdout, 'Line 3: ')
+    >>> for text in ['Unknown command', ' "bogus"\\nFAILED: bogus\\n']:
+    ...     stream.write(text)
+    Line 3: Unknown command "bogus"
+    Line 3: FAILED: bogus
+    """
+
+    def __init__(self, stream, prefix):
+        self.stream = stream
+        self.prefix = prefix
+        self._line_start = True
+
+    def write(self, text):
+        """Write text, with the prefix at the start of every line"""
+        for line in text.splitlines(True):
+            if self._line_start:
+                self.stream.write(self.prefix)
+            self.stream.write(line)
+            self._line_start = line.endswith('\n')
+
+    def flush(self):
+        """Flush the underlying stream"""
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
@@ -0,0 +1,167 @@
+"""Recording of the network requests made for a command
+
+The profiler is fed by the HTTP pool with every request socos sends to a
+speaker. It summarizes them per UPnP action, which shows how many
+round-trips a command takes and where the time goes. The import times
+reported by "python -X importtime" are summarized here as well, for
+"socos --startup-profile".
+"""
+
+import threading
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit  # pylint: disable=import-error
+
+
+def percentile(values, fraction):
+    """Return the nearest-rank percentile of values
+
+    >>> percentile([5, 1, 4, 2, 3], 0.5)
+    3
+
+    >>> percentile([5, 1, 4, 2, 3], 0.95)
+    5
+    """
+    ordered = sorted(values)
+    rank = int(round(fraction * len(ordered) + 0.5)) - 1
+    return ordered[min(max(rank, 0), len(ordered) - 1)]
+
+
+def request_name(method, url, headers):
+    """Return the (service, action) a request is made for
+
+    >>> request_name('POST', 'http://10.0.0.5:1400/MediaRenderer/AVTransport'
+    ...              '/Control', {'SOAPACTION': '"urn:schemas-upnp-org:'
+    ...              'service:AVTransport:1#Play"'})
+    ('AVTransport', 'Play')
+
+    >>> request_name('GET', 'http://10.0.0.5:1400/status/info', {})
+    ('HTTP', 'GET /status/info')
+    """
+    soap_action = (headers or {}).get('SOAPACTION')
+    if soap_action:
+        service, _, action = soap_action.strip('"').partition('#')
+        return service.split(':')[-2], action
+    return 'HTTP', '{} {}'.format(method, urlsplit(url).path)
+
+
+def parse_import_times(lines):
+    """Return the imports from the output of "python -X importtime"
+
+    Returns a list of (module, self ms, cumulative ms, depth) tuples in the
+    order of the output, depth is 0 for modules imported at the top level.
+    Other lines are left out.
+
+    >>> parse_import_times([
+    ...     'import time: self [us] | cumulative | imported package',
+    ...     'import time:       120 |        120 |   json.decoder',
+    ...     'import time:       300 |        420 | json',
+    ...     'Traceback (most recent call last):'])
+    [('json.decoder', 0.12, 0.12, 1), ('json', 0.3, 0.42, 0)]
+    """
+    imports = []
+    for line in lines:
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        try:
+            own, cumulative = int(parts[0]), int(parts[1])
+        except (IndexError, ValueError):
+            # The header line
+            continue
+        depth = (len(parts[2]) - len(parts[2].lstrip()) - 1) // 2
+        imports.append((parts[2].strip(), own / 1000.0, cumulative / 1000.0,
+                        depth))
+    return imports
+
+
+def import_summary(imports, top=20):
+    """Return the lines of a table of the slowest imports
+
+    Args:
+        imports (list): The imports as returned by parse_import_times
+        top (int): The number of modules shown
+    """
+    if not imports:
+        return ['No imports']
+    row = '{:<40} {:>9} {:>14}'
+    lines = [row.format('Module', 'Self ms', 'Cumulative ms')]
+    for module, own, cumulative, depth in sorted(
+            imports, key=lambda entry: -entry[2])[:top]:
+        lines.append(row.format(
+            '  ' * depth + module, '{:.1f}'.format(own),
+            '{:.1f}'.format(cumulative)))
+    lines.append('{} modules, {:.1f} ms in imports'.format(
+        len(imports), sum(entry[2] for entry in imports if entry[3] == 0)))
+    return lines
+
+
+def _body_size(body):
+    """Return the size of a request or response body in bytes"""
+    if body is None:
+        return 0
+    if not isinstance(body, bytes):
+        body = body.encode('utf-8')
+    return len(body)
+
+
+# pylint: disable=useless-object-inheritance
+class Profiler(object):
+    """Records the network requests made while it is attached to a pool"""
+
+    def __init__(self):
+        self.calls = []
+        self._lock = threading.Lock()
+
+    # pylint: disable=too-many-arguments
+    def record(self, method, url, kwargs, response, seconds):
+        """Record a request, called by the HTTP pool after every request"""
+        service, action = request_name(method, url, kwargs.get('headers'))
+        with self._lock:
+            self.calls.append((
+                service, action, _body_size(kwargs.get('data')),
+                _body_size(response.content), seconds))
+
+    def reset(self):
+        """Forget all recorded requests"""
+        with self._lock:
+            self.calls = []
+
+    def summary(self, seconds=None):
+        """Return the lines of a table summarizing the requests per action
+
+        Args:
+            seconds (float): The wall time of the command, if known
+        """
+        with self._lock:
+            calls = list(self.calls)
+        if not calls:
+            return ['No network requests']
+
+        actions = {}
+        for service, action, sent, received, duration in calls:
+            entry = actions.setdefault((service, action), [[], 0, 0])
+            entry[0].append(duration * 1000)
+            entry[1] += sent
+            entry[2] += received
+
+        row = '{:<20} {:<28} {:>5} {:>9} {:>7} {:>7} {:>9} {:>9}'
+        lines = [row.format('Service', 'Action', 'Count', 'Total ms',
+                            'p50', 'p95', 'Sent', 'Received')]
+        for (service, action), (durations, sent, received) in sorted(
+                actions.items(), key=lambda item: -sum(item[1][0])):
+            lines.append(row.format(
+                service, action, len(durations),
+                '{:.1f}'.format(sum(durations)),
+                '{:.1f}'.format(percentile(durations, 0.5)),
+                '{:.1f}'.format(percentile(durations, 0.95)),
+                sent, received))
+
+        total = '{} requests, {:.1f} ms in requests'.format(
+            len(calls), sum(call[4] for call in calls) * 1000)
+        if seconds is not None:
+            total += ', {:.1f} ms wall time'.format(seconds * 1000)
+        lines.append(total)
+        return lines
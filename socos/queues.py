@@ -0,0 +1,276 @@
+"""Reading, saving and restoring the queue of a speaker
+
+The queue is read page by page, so that large queues are shown as soon as
+the first page arrives. "queue save" writes it to a file of JSON lines with
+the URI and DIDL metadata of every track, "queue load" and "queue copy" add
+tracks to a queue in batches with a single request each.
+"""
+
+from socos.cache import QUERY_CACHE
+from socos.exceptions import SocosException
+from socos.output import Record
+from socos.utils import (
+    LazyModule, contiguous_spans, get_coordinator, open_binary, parse_range)
+
+# pylint: disable=invalid-name
+json = LazyModule('json')
+soco = LazyModule('soco')
+
+# The number of queue items requested at a time
+QUEUE_PAGE_SIZE = 100
+
+# The number of tracks shown before and after the current one by
+# "queue --around-current"
+QUEUE_CONTEXT = 10
+
+# The maximum number of tracks a single AddMultipleURIsToQueue request adds
+ENQUEUE_BATCH_SIZE = 16
+
+# Shows the current track in bold
+ANSI_BOLD = '\033[1m'
+ANSI_RESET = '\033[0m'
+
+
+def is_index_in_queue(index, queue_length):
+    """Helper function to verify if index exists"""
+    if 0 < index <= queue_length:
+        return True
+    return False
+
+
+def remove_tracks(sonos, rem_range, queue_length, update_id):
+    """Remove the tracks at the indexes in rem_range from the queue
+
+    Consecutive indexes are removed with a single request per span. The
+    queue update id is passed along, so the speaker refuses the removal if
+    the queue was changed by someone else in the meantime.
+
+    Args:
+        sonos (SoCo): The coordinator speaker holding the queue
+        rem_range (sequence): The (one-based) indexes to remove
+        queue_length (int): The length of the queue
+        update_id (int): The update id of the queue
+    """
+    if not rem_range:
+        raise ValueError('No tracks to remove')
+    for index in rem_range:
+        if not is_index_in_queue(index, queue_length):
+            error = "Index %d is not within range 1 - %d" % \
+                    (index, queue_length)
+            raise ValueError(error)
+
+    # Remove from the end, so the indexes of the other spans stay valid
+    for first, last in reversed(contiguous_spans(rem_range)):
+        try:
+            response = sonos.avTransport.RemoveTrackRangeFromQueue([
+                ('InstanceID', 0),
+                ('UpdateID', update_id),
+                ('StartingIndex', first),
+                ('NumberOfTracks', last - first + 1),
+            ])
+        except soco.exceptions.SoCoUPnPException as ex:
+            raise SocosException(
+                'Could not remove tracks {}..{}, the queue may have been '
+                'changed meanwhile: {}'.format(first, last, ex))
+        update_id = response['NewUpdateID']
+
+
+def iter_queue(sonos, first=1, last=None, page_size=QUEUE_PAGE_SIZE):
+    """Iterate over the queue page by page
+
+    Only one page of tracks is held in memory and the first tracks are
+    yielded as soon as the first page arrives.
+
+    Args:
+        sonos (SoCo): The (coordinator) speaker to get the queue from
+        first (int): The (one-based) index of the first track
+        last (int): The index of the last track, None for the end of the
+            queue
+        page_size (int): The number of tracks requested at a time
+
+    Yields:
+        tuple: The index of the track, the track and the queue length
+    """
+    index = first
+    while last is None or index <= last:
+        count = page_size
+        if last is not None:
+            count = min(count, last - index + 1)
+        page = sonos.get_queue(index - 1, max_items=count)
+        for track in page:
+            yield index, track, page.total_matches
+            index += 1
+        if not page or index > page.total_matches:
+            break
+
+
+def queue_records(sonos, positional, options):
+    """Yield a Record per track of the queue for the queue command
+
+    Args:
+        sonos (SoCo): The (coordinator) speaker to get the queue from
+        positional (list): The arguments, an optional range of positions
+        options (dict): The --around-current and --page-size options
+    """
+    page_size = int(options.get('page_size', QUEUE_PAGE_SIZE))
+    if page_size < 1:
+        raise ValueError('The page size must be at least 1, e.g. '
+                         '"queue IP --page-size 100"')
+
+    current = int(sonos.get_current_track_info()['playlist_position'])
+
+    first, last = 1, None
+    if positional:
+        window = parse_range(positional[0])
+        if not window or window[0] < 1:
+            raise ValueError(
+                'Invalid range "{}", use a range of queue positions '
+                'like "queue IP 500..600"'.format(positional[0]))
+        first, last = window[0], window[-1]
+    elif options.get('around_current'):
+        first = max(current - QUEUE_CONTEXT, 1)
+        last = current + QUEUE_CONTEXT
+
+    padding = None
+    for idx, track, queue_length in iter_queue(sonos, first, last,
+                                               page_size):
+        if padding is None:
+            padding = len(str(queue_length))
+
+        if idx == current:
+            color = ANSI_BOLD
+        else:
+            color = ANSI_RESET
+
+        yield Record(
+            "%s%s: %s - %s. From album %s.%s" % (
+                color,
+                str(idx).rjust(padding),
+                track.creator,
+                track.title,
+                track.album,
+                ANSI_RESET,
+            ),
+            position=idx, artist=track.creator, title=track.title,
+            album=track.album, current=idx == current,
+        )
+
+
+def queue_entries(sonos):
+    """Yield the (uri, didl) of every track in the queue of sonos"""
+    to_didl_string = soco.data_structures.to_didl_string
+    for _, track, _ in iter_queue(sonos):
+        if track.resources:
+            yield track.resources[0].uri, to_didl_string(track)
+
+
+def save_queue(sonos, path):
+    """Write the queue of sonos to a file and return the number of tracks
+
+    The file holds a JSON line with the uri and DIDL metadata per track, it
+    is gzip compressed if path ends with .gz.
+    """
+    count = 0
+    with open_binary(path, 'w') as queue_file:
+        for uri, didl in queue_entries(sonos):
+            line = json.dumps({'uri': uri, 'didl': didl},
+                              separators=(',', ':')) + '\n'
+            queue_file.write(line.encode('utf-8'))
+            count += 1
+    return count
+
+
+def read_queue(path):
+    """Yield the (uri, didl) of the tracks in a file written by save_queue"""
+    with open_binary(path, 'r') as queue_file:
+        for line in queue_file:
+            if line.strip():
+                entry = json.loads(line.decode('utf-8'))
+                yield entry['uri'], entry['didl']
+
+
+def enqueue(sonos, entries, replace=False):
+    """Add tracks to the end of the queue and return the number added
+
+    Args:
+        sonos (SoCo): The coordinator to add the tracks to
+        entries (iterable): (uri, didl) tuples of the tracks, these are
+            consumed as they are sent, so they can be streamed
+        replace (bool): Whether to clear the queue first
+
+    The tracks are sent with the stored metadata as it is, in batches of
+    ENQUEUE_BATCH_SIZE tracks per request.
+    """
+    if replace:
+        sonos.clear_queue()
+        QUERY_CACHE.invalidate(sonos, 'state', 'current')
+
+    def send(batch):
+        """Add a batch of tracks with a single request"""
+        sonos.avTransport.AddMultipleURIsToQueue([
+            ('InstanceID', 0),
+            ('UpdateID', 0),
+            ('NumberOfURIs', len(batch)),
+            ('EnqueuedURIs', ' '.join(uri for uri, _ in batch)),
+            ('EnqueuedURIsMetaData', ' '.join(didl for _, didl in batch)),
+            ('ContainerURI', ''),
+            ('ContainerMetaData', ''),
+            ('DesiredFirstTrackNumberEnqueued', 0),
+            ('EnqueueAsNext', 0),
+        ])
+
+    count = 0
+    batch = []
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) == ENQUEUE_BATCH_SIZE:
+            send(batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        send(batch)
+        count += len(batch)
+    return count
+
+
+def transfer_queue(sonos, action, target=None, mode=None):
+    """Save, load or copy the queue of sonos
+
+    Args:
+        sonos (SoCo): The coordinator whose queue is transferred
+        action (str): save or load a FILE or copy to the speaker at IP
+        target (str): The FILE or IP
+        mode (str): replace to replace the queue instead of adding to it
+
+    Returns:
+        str: A line describing what was done
+    """
+    if target is None:
+        raise ValueError('Usage: queue save FILE, queue load FILE '
+                         '[replace] or queue copy IP [replace]')
+    if mode not in [None, 'replace']:
+        raise ValueError("The last argument can only be 'replace'")
+    replace = mode == 'replace'
+
+    try:
+        if action == 'save':
+            return 'Saved {} tracks to {}'.format(
+                save_queue(sonos, target), target)
+        if action == 'load':
+            # Read the whole file first, so that a broken file does not
+            # leave a cleared queue behind
+            entries = list(read_queue(target))
+    except (IOError, OSError) as ex:
+        raise SocosException(
+            'Could not {} the queue: {}'.format(action, ex))
+
+    if action == 'load':
+        count = enqueue(sonos, entries, replace)
+    else:
+        destination = get_coordinator(soco.SoCo(target))
+        if destination == sonos:
+            raise ValueError('Cannot copy the queue onto itself')
+        count = enqueue(destination, queue_entries(sonos), replace)
+    if replace:
+        return 'Queue replaced with {} tracks'.format(count)
+    return 'Added {} tracks to queue'.format(count)
@@ -0,0 +1,221 @@
+"""Recording of the requests of socos commands and replaying them offline
+
+"socos --record FILE" writes every command together with the requests it
+sent and the responses it got. "socos --replay FILE" runs the commands of
+the recording again, serving the recorded responses instead of talking to
+the speakers. Any request that was not recorded fails the replay, so a
+change that adds requests to a command shows up without any speakers.
+
+The recording is a file of JSON lines, gzip compressed if the file name ends
+with .gz. A line with a "command" key starts a command, the following lines
+are its requests and a line with a "done" key ends it.
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+import threading
+
+from socos.exceptions import SocosException
+from socos.utils import LazyModule, open_binary
+
+# pylint: disable=invalid-name
+json = LazyModule('json')
+requests = LazyModule('requests')
+
+
+class ReplayError(SocosException):
+    """A request that is not part of the recording"""
+
+
+def _text(body):
+    """Return a request or response body as text"""
+    if body is None:
+        return ''
+    if isinstance(body, bytes):
+        return body.decode('utf-8')
+    return body
+
+
+def load_recording(path):
+    """Return the commands of a recording
+
+    Returns:
+        list: (args, success, requests) tuples, where requests is a list of
+        the recorded request dicts
+    """
+    commands = []
+    with open_binary(path, 'r') as recording:
+        for line in recording:
+            entry = json.loads(line.decode('utf-8'))
+            if 'command' in entry:
+                commands.append([entry['command'], None, []])
+            elif 'done' in entry:
+                commands[-1][1] = entry['success']
+            else:
+                commands[-1][2].append(entry)
+    return [tuple(command) for command in commands]
+
+
+# pylint: disable=useless-object-inheritance
+class Recorder(object):
+    """Writes the commands and their requests to a recording
+
+    Recorder.record is added to the listeners of the HTTP pool. Requests
+    made outside of a command, e.g. for the shell prompt, are not recorded.
+
+    Args:
+        path (str): The file to write the recording to
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open_binary(path, 'w')
+        self._lock = threading.Lock()
+        self._recording = False
+
+    def _write(self, entry):
+        """Write an entry as a JSON line"""
+        line = json.dumps(entry, separators=(',', ':')) + '\n'
+        self._file.write(line.encode('utf-8'))
+
+    def start_command(self, args):
+        """Start recording the requests of a command"""
+        with self._lock:
+            self._write({'command': list(args)})
+            self._recording = True
+
+    def finish_command(self, success, seconds):
+        """Stop recording the requests of a command"""
+        with self._lock:
+            self._write({'done': True, 'success': success,
+                         'seconds': round(seconds, 4)})
+            self._file.flush()
+            self._recording = False
+
+    # pylint: disable=too-many-arguments
+    def record(self, method, url, kwargs, response, seconds):
+        """Record a request, called by the HTTP pool after every request"""
+        with self._lock:
+            if not self._recording:
+                return
+            self._write({
+                'method': method,
+                'url': url,
+                'body': _text(kwargs.get('data')),
+                'status': response.status_code,
+                'content_type': response.headers.get('Content-Type', ''),
+                'response': _text(response.content),
+                'seconds': round(seconds, 4),
+            })
+
+    def close(self):
+        """Close the recording"""
+        with self._lock:
+            self._file.close()
+
+
+class ReplayTransport(object):
+    """Serves the recorded responses in place of the speakers
+
+    Set ReplayTransport.request as the transport of the HTTP pool and call
+    expect with the recorded requests before every command. A request is
+    answered with the response of the first unused recorded request with
+    the same method, url and body, so requests sent concurrently may arrive
+    in any order.
+    """
+
+    def __init__(self):
+        self.expected = []
+        self.unexpected = []
+        self._lock = threading.Lock()
+
+    def expect(self, recorded):
+        """Expect the recorded requests of the next command"""
+        with self._lock:
+            self.expected = list(recorded)
+            self.unexpected = []
+
+    def request(self, method, url, **kwargs):
+        """Return the recorded response of a request"""
+        body = _text(kwargs.get('data'))
+        with self._lock:
+            for index, entry in enumerate(self.expected):
+                if (entry['method'], entry['url'], entry['body']) == \
+                        (method, url, body):
+                    del self.expected[index]
+                    break
+            else:
+                self.unexpected.append((method, url, body))
+                raise ReplayError(
+                    'Unexpected request {} {} not in the recording'.format(
+                        method, url))
+
+        response = requests.Response()
+        response.status_code = entry['status']
+        response.headers = requests.structures.CaseInsensitiveDict(
+            {'Content-Type': entry['content_type']})
+        response.encoding = 'utf-8'
+        # pylint: disable=protected-access
+        response._content = entry['response'].encode('utf-8')
+        response.url = url
+        return response
+
+
+# pylint: disable=too-many-locals
+def replay(socos, path, time_budget=None, out=None):
+    """Run the commands of a recording against the recorded responses
+
+    A command fails the replay if it sends a request that is not in the
+    recording, or if it fails while it succeeded when it was recorded.
+    Recorded requests a command no longer sends are only reported, they
+    usually come from caches that expired while recording.
+
+    Args:
+        socos (SoCos): The socos instance to run the commands with
+        path (str): The recording
+        time_budget (float): If given, the replay fails if running all
+            commands takes more seconds than this
+        out (file): Where the report is written to, defaults to stderr
+
+    Returns:
+        int: The exit status, 0 if the replay succeeded and 1 otherwise
+    """
+    out = out or sys.stderr
+    transport = ReplayTransport()
+    socos.http_pool.transport = transport.request
+    failures = 0
+    total = 0.0
+    try:
+        for args, success, recorded in load_recording(path):
+            transport.expect(recorded)
+            start = time.time()
+            replayed = socos.process_cmd(list(args))
+            seconds = time.time() - start
+            total += seconds
+
+            sent = len(recorded) - len(transport.expected) + \
+                len(transport.unexpected)
+            print('{}: {} requests ({} recorded), {:.1f} ms'.format(
+                ' '.join(args), sent, len(recorded), seconds * 1000), file=out)
+            for method, url, _ in transport.unexpected:
+                print('  unexpected request: {} {}'.format(method, url),
+                      file=out)
+            if transport.expected:
+                print('  {} recorded requests were not sent'.format(
+                    len(transport.expected)), file=out)
+            if transport.unexpected or (success and not replayed):
+                failures += 1
+    finally:
+        socos.http_pool.transport = None
+
+    print('Replayed in {:.1f} ms'.format(total * 1000), file=out)
+    if time_budget is not None and total > time_budget:
+        print('Over the time budget of {:.1f} ms'.format(
+            time_budget * 1000), file=out)
+        failures += 1
+    if failures:
+        print('{} failures'.format(failures), file=out)
+        return 1
+    return 0
@@ -1,27 +1,131 @@
 #!/usr/bin/env python
 """socos is a commandline tool for controlling Sonos speakers"""
 
+from __future__ import print_function
+
 import sys
 import os.path
+import argparse
+
+from socos.output import FORMATS
+from socos.profiler import import_summary, parse_import_times
+from socos.utils import LazyModule
 
-from socos import SoCos
+subprocess = LazyModule('subprocess')  # pylint: disable=invalid-name
 
 # when running from source, prefer source to installed version
 BASEDIR = os.path.abspath(os.path.dirname(__file__))
 sys.path.insert(0, os.path.join(BASEDIR, '..'))
 
 
+def parse_args(args):
+    """Parse the socos options, which have to precede the command"""
+    parser = argparse.ArgumentParser(
+        prog='socos', add_help=False,
+        description='socos is a commandline tool for controlling Sonos '
+        'speakers. Without a command, an interactive shell is started.')
+    parser.add_argument(
+        '-f', '--file', metavar='SCRIPT', type=argparse.FileType('r'),
+        help='run the commands in SCRIPT, one per line ("-" for stdin)')
+    parser.add_argument(
+        '-e', '--stop-on-error', action='store_true',
+        help='stop a script at the first command that fails')
+    parser.add_argument(
+        '--format', choices=FORMATS, default='text',
+        help='print the output as text (default), as a JSON array per '
+        'command or as a JSON object per line (ndjson)')
+    parser.add_argument(
+        '--fresh', action='store_true',
+        help='always ask the speakers instead of reusing the cached results '
+        'of queries like info, mode or bass')
+    parser.add_argument(
+        '--profile', action='store_true',
+        help='show the network requests made for every command')
+    parser.add_argument(
+        '--record', metavar='FILE',
+        help='record the commands and their requests to FILE')
+    parser.add_argument(
+        '--replay', metavar='FILE',
+        help='run the commands recorded in FILE against the recorded '
+        'responses, failing on any request that was not recorded')
+    parser.add_argument(
+        '--time-budget', metavar='MS', type=float,
+        help='make --replay fail if the commands take longer than MS')
+    parser.add_argument(
+        '--startup-profile', action='store_true',
+        help='show the time spent importing every module on startup')
+    parser.add_argument(
+        'command', nargs=argparse.REMAINDER,
+        help='the command and its arguments, see "socos help"')
+    return parser.parse_args(args)
+
+
+def startup_profile(args):
+    """Run socos with args under "python -X importtime"
+
+    The command runs as usual, afterwards the slowest imports are shown on
+    stderr. Returns the exit code of the command.
+    """
+    if sys.version_info < (3, 7):
+        print('--startup-profile requires Python 3.7 or later',
+              file=sys.stderr)
+        return 2
+    process = subprocess.Popen(
+        [sys.executable, '-X', 'importtime', '-m', 'socos.runner'] + args,
+        stderr=subprocess.PIPE, universal_newlines=True)
+    _, errors = process.communicate()
+    lines = errors.splitlines()
+    for line in lines:
+        if not line.startswith('import time:'):
+            print(line, file=sys.stderr)
+    for line in import_summary(parse_import_times(lines)):
+        print(line, file=sys.stderr)
+    return process.returncode
+
+
 def main():
     """main switches between (non-)interactive mode"""
+    options = parse_args(sys.argv[1:])
+    if options.startup_profile:
+        sys.exit(startup_profile(
+            [arg for arg in sys.argv[1:] if arg != '--startup-profile']))
+
+    # Imported here, so that the options are parsed without them
+    # pylint: disable=bad-option-value,import-outside-toplevel
+    from socos.cache import QUERY_CACHE
+    from socos.core import SoCos
+    from socos.replay import replay
+
     socos = SoCos()
-    args = sys.argv[1:]
-
-    if args:
-        # process command and exit
-        socos.process_cmd(args)
-    else:
-        # start interactive shell
-        socos.shell()
+    socos.output_format = options.format
+    # A single command has no earlier results to reuse, caching them would
+    # only cost requests for the speaker uids
+    if options.fresh or options.command:
+        QUERY_CACHE.enabled = False
+    if options.profile:
+        socos.profile('on')
+    if options.record:
+        socos.record(options.record)
+
+    try:
+        if options.replay:
+            # run the commands of a recording offline and exit
+            budget = options.time_budget
+            sys.exit(replay(socos, options.replay,
+                            None if budget is None else budget / 1000.0))
+        elif options.file:
+            # process a script of commands and exit
+            sys.exit(socos.run_batch(options.file, options.stop_on_error))
+        elif options.command:
+            # process command and exit
+            sys.exit(0 if socos.process_cmd(options.command) else 1)
+        else:
+            # start interactive shell
+            socos.shell()
+    finally:
+        socos.speaker_cache.wait()
+        if socos.recorder is not None:
+            socos.recorder.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,755 @@
+"""Simulated Sonos speakers for tests and benchmarks
+
+The simulator serves the UPnP actions socos uses over HTTP, with one server
+per speaker on a local address (127.0.0.2, 127.0.0.3, ...) and the Sonos
+port, so that socos commands run against it unchanged and without any
+hardware. Every request can be delayed to simulate the network latency.
+
+    with SimulatedSystem(speakers=2, queue_size=500, latency=0.005):
+        SoCos().process_cmd(['queue', '127.0.0.2'])
+
+Only the state socos touches is simulated: the transport, the queue, the
+volume, bass and treble, the group topology and a generated music library.
+"""
+
+import re
+import time
+import threading
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape, quoteattr
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    # pylint: disable=import-error
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+try:
+    from urllib.parse import quote, unquote
+except ImportError:
+    from urllib import quote, unquote  # pylint: disable=no-name-in-module
+
+import soco
+from soco.data_structures import (
+    DidlMusicAlbum, DidlMusicArtist, DidlMusicTrack, DidlPlaylistContainer,
+    DidlResource, to_didl_string)
+from soco.data_structures_entry import from_didl_string
+
+from socos.profiler import request_name
+
+SONOS_PORT = 1400
+
+# The last byte of the address of the first speaker, 127.0.0.1 is left alone
+FIRST_ADDRESS = 2
+
+# The words the track titles of the generated library are made of, so that
+# e.g. "tracks foo" finds every eighth track
+WORDS = ['foo', 'bar', 'baz', 'qux', 'quux', 'corge', 'grault', 'garply']
+
+TRACKS_PER_ALBUM = 10
+ALBUMS_PER_ARTIST = 5
+TRACKS_PER_PLAYLIST = 25
+TRACK_DURATION = '0:03:30'
+
+SOAP_NAMESPACE = 'http://schemas.xmlsoap.org/soap/envelope/'
+
+RESPONSE_TEMPLATE = (
+    '<?xml version="1.0"?>'
+    '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/"'
+    ' s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">'
+    '<s:Body><u:{action}Response'
+    ' xmlns:u="urn:schemas-upnp-org:service:{service}:1">{arguments}'
+    '</u:{action}Response></s:Body></s:Envelope>')
+
+FAULT_TEMPLATE = (
+    '<?xml version="1.0"?>'
+    '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/"'
+    ' s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">'
+    '<s:Body><s:Fault><faultcode>s:Client</faultcode>'
+    '<faultstring>UPnPError</faultstring><detail>'
+    '<UPnPError xmlns="urn:schemas-upnp-org:control-1-0">'
+    '<errorCode>{code}</errorCode></UPnPError>'
+    '</detail></s:Fault></s:Body></s:Envelope>')
+
+DEVICE_DESCRIPTION_TEMPLATE = (
+    '<?xml version="1.0" encoding="utf-8" ?>'
+    '<root xmlns="urn:schemas-upnp-org:device-1-0"><device>'
+    '<deviceType>urn:schemas-upnp-org:device:ZonePlayer:1</deviceType>'
+    '<friendlyName>{ip} - Simulator</friendlyName>'
+    '<manufacturer>Sonos, Inc.</manufacturer>'
+    '<modelNumber>SIM</modelNumber>'
+    '<modelName>Sonos Simulator</modelName>'
+    '<softwareVersion>1.0</softwareVersion>'
+    '<hardwareVersion>1.0</hardwareVersion>'
+    '<displayVersion>1.0</displayVersion>'
+    '<serialNum>00-00-00-00-00-{number:02X}:0</serialNum>'
+    '<UDN>uuid:{uid}</UDN>'
+    '<roomName>{name}</roomName>'
+    '<iconList><icon><url>/img/icon-SIM.png</url></icon></iconList>'
+    '</device></root>')
+
+# The service description soco reads to call actions with keyword arguments.
+# The actions are described without arguments, soco only calls actions
+# without arguments that way.
+SCPD_TEMPLATE = (
+    '<?xml version="1.0"?>'
+    '<scpd xmlns="urn:schemas-upnp-org:service-1-0"><actionList>{actions}'
+    '</actionList><serviceStateTable/></scpd>')
+
+# Matches the path of a service description, e.g. /xml/AVTransport1.xml
+SCPD_PATH = re.compile(r'^/xml/(\w+?)1\.xml$')
+
+# The actions of the simulated speaker by (service, action), filled out by
+# the upnp_action decorator
+ACTIONS = {}
+
+
+def upnp_action(service, action):
+    """Register a SimulatedSpeaker method as the handler of a UPnP action
+
+    The method is called with a dict of the arguments and returns a list of
+    (name, value) tuples of the output arguments.
+    """
+    def decorate(function):
+        """Register function in ACTIONS"""
+        ACTIONS[(service, action)] = function
+        return function
+    return decorate
+
+
+def service_description(service):
+    """Return the service description XML of a service"""
+    return SCPD_TEMPLATE.format(actions=''.join(
+        '<action><name>{}</name><argumentList/></action>'.format(action)
+        for action_service, action in sorted(ACTIONS)
+        if action_service == service))
+
+
+def matches(title, term):
+    """Return whether a word of title starts with term, like Sonos searches
+
+    >>> matches('Foo Fighters', 'fig')
+    True
+
+    >>> matches('Foo Fighters', 'ight')
+    False
+    """
+    term = term.lower()
+    return any(word.startswith(term) for word in title.lower().split())
+
+
+def split_didl(metadata):
+    """Split the space separated DIDL-Lite documents of AddMultipleURIs
+
+    >>> split_didl('<DIDL-Lite a="1"><item/></DIDL-Lite> <DIDL-Lite/>')
+    ['<DIDL-Lite a="1"><item/></DIDL-Lite>', '<DIDL-Lite/>']
+    """
+    return re.findall(r'<DIDL-Lite(?:[^>]*/>|.*?</DIDL-Lite>)', metadata,
+                      re.DOTALL)
+
+
+def _copy_track(track, parent_id, item_id):
+    """Return a copy of a track with a new parent and item id"""
+    kwargs = dict(
+        (name, getattr(track, name)) for name in ['creator', 'album']
+        if getattr(track, name, None) is not None)
+    return DidlMusicTrack(title=track.title, parent_id=parent_id,
+                          item_id=item_id, resources=track.resources,
+                          **kwargs)
+
+
+class UPnPError(Exception):
+    """A UPnP error returned as a SOAP fault"""
+
+    def __init__(self, code):
+        super(UPnPError, self).__init__('UPnP error {}'.format(code))
+        self.code = code
+
+
+# pylint: disable=useless-object-inheritance
+class SimulatedLibrary(object):
+    """A generated music library shared by all simulated speakers
+
+    Track N is called e.g. "Foo N", ten tracks make an album, five albums
+    an artist and every 25 tracks make an imported playlist.
+
+    Args:
+        size (int): The number of tracks
+    """
+
+    def __init__(self, size):
+        self.update_id = 1
+        self.tracks = []
+        self.children = {}
+        albums, artists, playlists = [], [], []
+        for number in range(1, size + 1):
+            album = 'Album {}'.format((number - 1) // TRACKS_PER_ALBUM + 1)
+            artist = 'Artist {}'.format(
+                (number - 1) // (TRACKS_PER_ALBUM * ALBUMS_PER_ARTIST) + 1)
+            uri = 'x-file-cifs://nas/music/{}.mp3'.format(number)
+            track = DidlMusicTrack(
+                title='{} {}'.format(
+                    WORDS[(number - 1) % len(WORDS)].title(), number),
+                parent_id='A:TRACKS', item_id=uri.replace('x-file-cifs', 'S'),
+                resources=[DidlResource(uri, 'x-file-cifs:*:audio/mpeg:*')],
+                creator=artist, album=album)
+            self.tracks.append(track)
+
+            album_id = 'A:ALBUM/' + quote(album)
+            if album_id not in self.children:
+                albums.append(self._container(
+                    DidlMusicAlbum, album, 'A:ALBUM', creator=artist))
+            self.children.setdefault(album_id, []).append(track)
+            artist_id = 'A:ARTIST/' + quote(artist)
+            if artist_id not in self.children:
+                artists.append(self._container(
+                    DidlMusicArtist, artist, 'A:ARTIST'))
+            self.children.setdefault(artist_id, []).append(track)
+            if (number - 1) % TRACKS_PER_PLAYLIST == 0:
+                playlists.append(self._container(
+                    DidlPlaylistContainer,
+                    'Playlist {}'.format(len(playlists) + 1), 'A:PLAYLISTS'))
+            self.children.setdefault(
+                playlists[-1].item_id, []).append(track)
+
+        self.containers = {
+            'A:TRACKS': self.tracks,
+            'A:ALBUM': albums,
+            'A:ARTIST': artists,
+            'A:PLAYLISTS': playlists,
+            'SQ:': [],
+        }
+
+    @staticmethod
+    def _container(didl_class, title, parent_id, **kwargs):
+        """Return a container object queueable as a whole"""
+        item_id = parent_id + '/' + quote(title)
+        uri = 'x-rincon-playlist:RINCON_SIMULATOR#' + item_id
+        return didl_class(
+            title=title, parent_id=parent_id, item_id=item_id,
+            resources=[DidlResource(uri, 'x-rincon-playlist:*:*:*')],
+            **kwargs)
+
+    def browse(self, object_id):
+        """Return the children of a container, or None if there is none
+
+        Like on Sonos, "A:TRACKS:term" searches the tracks for term.
+        """
+        if object_id in self.children:
+            return self.children[object_id]
+        for container_id, items in self.containers.items():
+            if object_id == container_id:
+                return items
+            if object_id.startswith(container_id + ':'):
+                term = unquote(object_id[len(container_id) + 1:])
+                return [item for item in items if matches(item.title, term)]
+        return None
+
+    def expand(self, item):
+        """Return the tracks adding item to the queue adds"""
+        return self.children.get(item.item_id, [item])
+
+
+# pylint: disable=too-many-instance-attributes
+class SimulatedSpeaker(object):
+    """The state and UPnP actions of a single simulated speaker
+
+    Args:
+        system (SimulatedSystem): The system the speaker is part of
+        number (int): The number of the speaker, starting at 1
+        queue (list): The tracks in the queue
+    """
+
+    def __init__(self, system, number, queue):
+        self.system = system
+        self.number = number
+        self.ip_address = '127.0.0.{}'.format(FIRST_ADDRESS + number - 1)
+        self.uid = 'RINCON_5151A1000{:03d}01400'.format(number)
+        self.name = 'Room {}'.format(number)
+        self.requests = 0
+        self._server = None
+        # The state of the speaker, set by reset
+        self.coordinator = self.queue = self.queue_update_id = None
+        self.volume = self.bass = self.treble = None
+        self.mute = self.loudness = None
+        self.transport_state = self.play_mode = self.track = None
+        self.reset(queue)
+
+    def reset(self, queue):
+        """Return to the initial state, with queue as the queue"""
+        self.coordinator = self
+        self.volume = 20
+        self.bass = self.treble = self.mute = 0
+        self.loudness = 1
+        self.transport_state = 'STOPPED'
+        self.play_mode = 'NORMAL'
+        self.queue = list(queue)
+        self.queue_update_id = 1
+        self.track = 1 if queue else 0
+
+    def start(self):
+        """Start serving requests in a background thread"""
+        self._server = _SpeakerServer((self.ip_address, SONOS_PORT),
+                                      _SpeakerHandler)
+        self._server.speaker = self
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        """Stop serving requests"""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def handle(self, service, action, body):
+        """Run a SOAP request and return the HTTP status and response body"""
+        handler = ACTIONS.get((service, action))
+        if handler is None:
+            return 500, FAULT_TEMPLATE.format(code=401)
+        tree = ElementTree.fromstring(body)
+        arguments = dict(
+            (element.tag, element.text or '')
+            for element in tree.find('{%s}Body' % SOAP_NAMESPACE)[0])
+        try:
+            with self.system.lock:
+                result = handler(self, arguments)
+        except (UPnPError, KeyError, ValueError) as ex:
+            return 500, FAULT_TEMPLATE.format(
+                code=getattr(ex, 'code', 402))
+        return 200, RESPONSE_TEMPLATE.format(
+            action=action, service=service, arguments=''.join(
+                '<{0}>{1}</{0}>'.format(name, escape(str(value)))
+                for name, value in result))
+
+    def device_description(self):
+        """Return the device description XML"""
+        return DEVICE_DESCRIPTION_TEMPLATE.format(
+            ip=self.ip_address, number=self.number, uid=self.uid,
+            name=escape(self.name))
+
+    def _change_queue(self, position, remove=0, tracks=()):
+        """Replace remove tracks at 1-based position with tracks"""
+        self.queue[position - 1:position - 1 + remove] = tracks
+        self.queue_update_id += 1
+        if self.track > len(self.queue):
+            self.track = len(self.queue)
+        elif not self.track and self.queue:
+            self.track = 1
+
+    def _check_update_id(self, arguments):
+        """Refuse a queue change made on an outdated queue"""
+        update_id = int(arguments.get('UpdateID') or 0)
+        if update_id and update_id != self.queue_update_id:
+            raise UPnPError(412)
+
+    def _enqueue(self, tracks, arguments):
+        """Add tracks to the queue and return the output arguments"""
+        position = int(arguments['DesiredFirstTrackNumberEnqueued'])
+        if not 0 < position <= len(self.queue):
+            position = len(self.queue) + 1
+        self._change_queue(position, tracks=tracks)
+        return [
+            ('FirstTrackNumberEnqueued', position),
+            ('NumTracksAdded', len(tracks)),
+            ('NewQueueLength', len(self.queue)),
+            ('NewUpdateID', self.queue_update_id),
+        ]
+
+    def _parse_items(self, uri, metadata):
+        """Return the tracks for an enqueued uri and its metadata"""
+        if metadata:
+            items = from_didl_string(metadata)
+        else:
+            items = [DidlMusicTrack(
+                title=uri, parent_id='', item_id='',
+                resources=[DidlResource(uri, 'x-file-cifs:*:audio/mpeg:*')])]
+        tracks = []
+        for item in items:
+            tracks.extend(self.system.library.expand(item))
+        return tracks
+
+    # ### AVTransport
+    @upnp_action('AVTransport', 'GetPositionInfo')
+    def _get_position_info(self, _arguments):
+        metadata = uri = ''
+        if self.track:
+            track = self.queue[self.track - 1]
+            metadata = to_didl_string(_copy_track(
+                track, '-1', '-1'))
+            uri = track.resources[0].uri
+        return [
+            ('Track', self.track),
+            ('TrackDuration', TRACK_DURATION if self.track else '0:00:00'),
+            ('TrackMetaData', metadata),
+            ('TrackURI', uri),
+            ('RelTime', '0:00:00'),
+            ('AbsTime', 'NOT_IMPLEMENTED'),
+            ('RelCount', 2147483647),
+            ('AbsCount', 2147483647),
+        ]
+
+    @upnp_action('AVTransport', 'GetTransportInfo')
+    def _get_transport_info(self, _arguments):
+        return [
+            ('CurrentTransportState', self.coordinator.transport_state),
+            ('CurrentTransportStatus', 'OK'),
+            ('CurrentSpeed', 1),
+        ]
+
+    @upnp_action('AVTransport', 'GetTransportSettings')
+    def _get_transport_settings(self, _arguments):
+        return [('PlayMode', self.play_mode),
+                ('RecQualityMode', 'NOT_IMPLEMENTED')]
+
+    @upnp_action('AVTransport', 'SetPlayMode')
+    def _set_play_mode(self, arguments):
+        self.play_mode = arguments['NewPlayMode']
+        return []
+
+    @upnp_action('AVTransport', 'Play')
+    def _play(self, _arguments):
+        if not self.queue:
+            raise UPnPError(701)
+        self.transport_state = 'PLAYING'
+        return []
+
+    @upnp_action('AVTransport', 'Pause')
+    def _pause(self, _arguments):
+        self.transport_state = 'PAUSED_PLAYBACK'
+        return []
+
+    @upnp_action('AVTransport', 'Stop')
+    def _stop(self, _arguments):
+        self.transport_state = 'STOPPED'
+        return []
+
+    @upnp_action('AVTransport', 'Next')
+    def _next(self, _arguments):
+        if self.track >= len(self.queue):
+            raise UPnPError(711)
+        self.track += 1
+        return []
+
+    @upnp_action('AVTransport', 'Previous')
+    def _previous(self, _arguments):
+        if self.track <= 1:
+            raise UPnPError(711)
+        self.track -= 1
+        return []
+
+    @upnp_action('AVTransport', 'Seek')
+    def _seek(self, arguments):
+        if arguments['Unit'] == 'TRACK_NR':
+            target = int(arguments['Target'])
+            if not 0 < target <= len(self.queue):
+                raise UPnPError(711)
+            self.track = target
+        return []
+
+    @upnp_action('AVTransport', 'SetAVTransportURI')
+    def _set_av_transport_uri(self, arguments):
+        uri = arguments['CurrentURI']
+        self.coordinator = self
+        if uri.startswith('x-rincon:'):
+            self.coordinator = self.system.speaker(uri[len('x-rincon:'):])
+        return []
+
+    @upnp_action('AVTransport', 'BecomeCoordinatorOfStandaloneGroup')
+    def _become_standalone(self, _arguments):
+        self.coordinator = self
+        return []
+
+    @upnp_action('AVTransport', 'AddURIToQueue')
+    def _add_uri_to_queue(self, arguments):
+        tracks = self._parse_items(arguments['EnqueuedURI'],
+                                   arguments['EnqueuedURIMetaData'])
+        return self._enqueue(tracks, arguments)
+
+    @upnp_action('AVTransport', 'AddMultipleURIsToQueue')
+    def _add_multiple_uris_to_queue(self, arguments):
+        uris = arguments['EnqueuedURIs'].split(' ')
+        metadata = split_didl(arguments['EnqueuedURIsMetaData'])
+        if len(uris) != int(arguments['NumberOfURIs']) or \
+                len(metadata) != len(uris):
+            raise UPnPError(402)
+        tracks = []
+        for uri, didl in zip(uris, metadata):
+            tracks.extend(self._parse_items(uri, didl))
+        return self._enqueue(tracks, arguments)
+
+    @upnp_action('AVTransport', 'RemoveTrackFromQueue')
+    def _remove_track_from_queue(self, arguments):
+        self._check_update_id(arguments)
+        position = int(arguments['ObjectID'].split('/')[-1])
+        if not 0 < position <= len(self.queue):
+            raise UPnPError(701)
+        self._change_queue(position, remove=1)
+        return []
+
+    @upnp_action('AVTransport', 'RemoveTrackRangeFromQueue')
+    def _remove_track_range_from_queue(self, arguments):
+        self._check_update_id(arguments)
+        first = int(arguments['StartingIndex'])
+        count = int(arguments['NumberOfTracks'])
+        if first < 1 or count < 1 or first + count - 1 > len(self.queue):
+            raise UPnPError(701)
+        self._change_queue(first, remove=count)
+        return [('NewUpdateID', self.queue_update_id)]
+
+    @upnp_action('AVTransport', 'RemoveAllTracksFromQueue')
+    def _remove_all_tracks_from_queue(self, _arguments):
+        self._change_queue(1, remove=len(self.queue))
+        return []
+
+    # ### RenderingControl
+    @upnp_action('RenderingControl', 'GetVolume')
+    def _get_volume(self, _arguments):
+        return [('CurrentVolume', self.volume)]
+
+    @upnp_action('RenderingControl', 'SetVolume')
+    def _set_volume(self, arguments):
+        self.volume = int(arguments['DesiredVolume'])
+        return []
+
+    @upnp_action('RenderingControl', 'SetRelativeVolume')
+    def _set_relative_volume(self, arguments):
+        self.volume = min(max(
+            self.volume + int(arguments['Adjustment']), 0), 100)
+        return [('NewVolume', self.volume)]
+
+    @upnp_action('RenderingControl', 'GetBass')
+    def _get_bass(self, _arguments):
+        return [('CurrentBass', self.bass)]
+
+    @upnp_action('RenderingControl', 'SetBass')
+    def _set_bass(self, arguments):
+        self.bass = int(arguments['DesiredBass'])
+        return []
+
+    @upnp_action('RenderingControl', 'GetTreble')
+    def _get_treble(self, _arguments):
+        return [('CurrentTreble', self.treble)]
+
+    @upnp_action('RenderingControl', 'SetTreble')
+    def _set_treble(self, arguments):
+        self.treble = int(arguments['DesiredTreble'])
+        return []
+
+    @upnp_action('RenderingControl', 'GetMute')
+    def _get_mute(self, _arguments):
+        return [('CurrentMute', self.mute)]
+
+    @upnp_action('RenderingControl', 'SetMute')
+    def _set_mute(self, arguments):
+        self.mute = int(arguments['DesiredMute'])
+        return []
+
+    @upnp_action('RenderingControl', 'GetLoudness')
+    def _get_loudness(self, _arguments):
+        return [('CurrentLoudness', self.loudness)]
+
+    @upnp_action('RenderingControl', 'SetLoudness')
+    def _set_loudness(self, arguments):
+        self.loudness = int(arguments['DesiredLoudness'])
+        return []
+
+    # ### ContentDirectory
+    @upnp_action('ContentDirectory', 'Browse')
+    def _browse(self, arguments):
+        object_id = arguments['ObjectID']
+        if object_id == 'Q:0':
+            items = [_copy_track(track, 'Q:0', 'Q:0/{}'.format(number))
+                     for number, track in enumerate(self.queue, 1)]
+            update_id = self.queue_update_id
+        else:
+            items = self.system.library.browse(object_id)
+            update_id = self.system.library.update_id
+        if items is None:
+            raise UPnPError(701)
+
+        if arguments['BrowseFlag'] == 'BrowseMetadata':
+            result = (
+                '<DIDL-Lite xmlns="urn:schemas-upnp-org:metadata-1-0/'
+                'DIDL-Lite/"><container id={} childCount="{}"/>'
+                '</DIDL-Lite>').format(quoteattr(object_id), len(items))
+            returned = 1
+        else:
+            start = int(arguments['StartingIndex'])
+            page = items[start:start + int(arguments['RequestedCount'])]
+            result = to_didl_string(*page)
+            returned = len(page)
+        return [
+            ('Result', result),
+            ('NumberReturned', returned),
+            ('TotalMatches', len(items)),
+            ('UpdateID', update_id),
+        ]
+
+    @upnp_action('ContentDirectory', 'GetLastIndexChange')
+    def _get_last_index_change(self, _arguments):
+        return [('LastIndexChange',
+                 'S{}:0'.format(self.system.library.update_id))]
+
+    # ### ZoneGroupTopology and DeviceProperties
+    @upnp_action('ZoneGroupTopology', 'GetZoneGroupState')
+    def _get_zone_group_state(self, _arguments):
+        return [('ZoneGroupState', self.system.zone_group_state())]
+
+    @upnp_action('DeviceProperties', 'GetZoneAttributes')
+    def _get_zone_attributes(self, _arguments):
+        return [
+            ('CurrentZoneName', self.name),
+            ('CurrentIcon', 'x-rincon-roomicon:living'),
+            ('CurrentConfiguration', 1),
+        ]
+
+    @upnp_action('DeviceProperties', 'SetZoneAttributes')
+    def _set_zone_attributes(self, arguments):
+        self.name = arguments['DesiredZoneName']
+        return []
+
+
+class _SpeakerServer(ThreadingMixIn, HTTPServer):
+    """The HTTP server of a simulated speaker"""
+    daemon_threads = True
+    allow_reuse_address = True
+    speaker = None
+
+
+class _SpeakerHandler(BaseHTTPRequestHandler):
+    """Serve a request to a simulated speaker"""
+
+    # Keep connections open like the speakers do
+    protocol_version = 'HTTP/1.1'
+    # Send the headers and the body of small responses in one packet, to
+    # not add the delay of delayed acknowledgements to the latency
+    disable_nagle_algorithm = True
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Serve the device and service descriptions"""
+        speaker = self._start_request()
+        scpd = SCPD_PATH.match(self.path)
+        if self.path == '/xml/device_description.xml':
+            self._send(200, speaker.device_description())
+        elif scpd:
+            self._send(200, service_description(scpd.group(1)))
+        else:
+            self._send(404, '')
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Serve a SOAP request"""
+        speaker = self._start_request()
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        service, action = request_name('POST', self.path, self.headers)
+        self._send(*speaker.handle(service, action, body))
+
+    def _start_request(self):
+        """Count the request and wait for the simulated latency"""
+        speaker = self.server.speaker
+        speaker.requests += 1
+        if speaker.system.latency:
+            time.sleep(speaker.system.latency)
+        return speaker
+
+    def _send(self, status, content):
+        """Send a response"""
+        data = content.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/xml; charset="utf-8"')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        """Do not log every request to stderr"""
+
+
+class SimulatedSystem(object):
+    """A simulated Sonos system, every speaker a group of its own
+
+    Args:
+        speakers (int): The number of speakers
+        queue_size (int): The number of tracks in the queue of each speaker
+        library_size (int): The number of tracks in the music library
+        latency (float): The seconds every request is delayed
+    """
+
+    def __init__(self, speakers=1, queue_size=100, library_size=1000,
+                 latency=0.0):
+        self.latency = latency
+        self.queue_size = queue_size
+        self.lock = threading.Lock()
+        self.library = SimulatedLibrary(library_size)
+        self.speakers = [SimulatedSpeaker(self, number, self._initial_queue())
+                         for number in range(1, speakers + 1)]
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _initial_queue(self):
+        """Return the queue every speaker starts with"""
+        tracks = self.library.tracks
+        if not tracks:
+            return []
+        return [tracks[number % len(tracks)]
+                for number in range(self.queue_size)]
+
+    def start(self):
+        """Start the servers of all speakers"""
+        for speaker in self.speakers:
+            speaker.start()
+        return self
+
+    def stop(self):
+        """Stop the servers of all speakers"""
+        for speaker in self.speakers:
+            speaker.stop()
+
+    def reset(self):
+        """Return all speakers to their initial state"""
+        with self.lock:
+            for speaker in self.speakers:
+                speaker.reset(self._initial_queue())
+        return self
+
+    @property
+    def requests(self):
+        """The number of requests received by all speakers"""
+        return sum(speaker.requests for speaker in self.speakers)
+
+    def speaker(self, uid):
+        """Return the speaker with uid"""
+        for speaker in self.speakers:
+            if speaker.uid == uid:
+                return speaker
+        raise UPnPError(402)
+
+    def discover(self, *_args, **_kwargs):
+        """Stand-in for soco.discover, returning the simulated speakers"""
+        return set(soco.SoCo(speaker.ip_address) for speaker in self.speakers)
+
+    def zone_group_state(self):
+        """Return the ZoneGroupState XML of the current groups"""
+        groups = []
+        for coordinator in self.speakers:
+            members = [speaker for speaker in self.speakers
+                       if speaker.coordinator is coordinator]
+            if coordinator not in members:
+                continue
+            groups.append(
+                '<ZoneGroup Coordinator="{0}" ID="{0}:1">{1}</ZoneGroup>'
+                .format(coordinator.uid, ''.join(
+                    '<ZoneGroupMember UUID="{}" Location="http://{}:{}/xml/'
+                    'device_description.xml" ZoneName={} '
+                    'SoftwareVersion="1.0"/>'.format(
+                        member.uid, member.ip_address, SONOS_PORT,
+                        quoteattr(member.name))
+                    for member in members)))
+        return '<ZoneGroups>{}</ZoneGroups>'.format(''.join(groups))
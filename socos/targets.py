@@ -0,0 +1,135 @@
+"""Running a command on several speakers selected with a target selector
+
+Instead of an IP, commands accept a selector starting with @: @all for all
+speakers, @group:NAME for the members of the group containing the speaker
+NAME and a comma separated list of ips or speaker numbers, like
+@10.0.0.5,10.0.0.7. The command runs on the selected speakers concurrently.
+"""
+
+from __future__ import print_function
+
+import sys
+from collections import OrderedDict
+
+from socos.exceptions import SocosException
+from socos.output import Printer, load_colorama, text_type
+from socos.utils import LazyModule, get_coordinator, run_concurrently
+
+soco = LazyModule('soco')  # pylint: disable=invalid-name
+
+
+def resolve_targets(socos, selector):
+    """Return the speakers matching a target selector
+
+    Args:
+        socos (SoCos): The SoCos instance knowing the speakers
+        selector (str): The selector, like @all
+    """
+    selector = selector[1:]
+    if selector == 'all':
+        # pylint: disable=protected-access
+        return [soco.SoCo(speaker['ip']) for speaker in socos._speakers()]
+
+    if selector.startswith('group:'):
+        return _group_members(socos, selector[len('group:'):].lower())
+
+    if not socos.known_speakers:
+        list(socos.list_ips())
+    targets = []
+    for spec in selector.split(','):
+        if '.' not in spec and spec in socos.known_speakers:
+            targets.append(socos.known_speakers[spec])
+        else:
+            targets.append(soco.SoCo(spec))
+    return targets
+
+
+def _group_members(socos, name):
+    """Return the members of the group containing the speaker name"""
+    # pylint: disable=protected-access
+    speakers = socos._speakers()
+    if not speakers:
+        return []
+    names = socos._speaker_names()
+    for group in soco.SoCo(speakers[0]['ip']).all_groups:
+        members = sorted(group.members, key=lambda m: m.ip_address)
+        if any(names.get(member.ip_address, '').lower() == name
+               for member in members):
+            return members
+    return []
+
+
+def _by_group(targets):
+    """Return the coordinators of the groups of targets, once per group"""
+    coordinators = OrderedDict()
+    for sonos in targets:
+        coordinator = get_coordinator(sonos)
+        coordinators[coordinator.ip_address] = coordinator
+    return list(coordinators.values())
+
+
+def fan_out(socos, func, args):
+    """Run a command concurrently on all speakers matching a selector
+
+    The output is printed once all speakers are done, each line prefixed
+    with the name of the speaker. Errors are reported per speaker. Commands
+    acting on a group, see utils.acts_on_group, run once per group.
+    Commands running until interrupted, see utils.streams, are refused.
+
+    Args:
+        socos (SoCos): The SoCos instance running the command
+        func (callable): The command
+        args (list): The arguments, starting with the selector
+
+    Returns:
+        bool: Whether the command succeeded on all speakers
+    """
+    if getattr(func, 'streams', False):
+        print('"{}" runs until interrupted, give a single speaker instead of '
+              '"{}"'.format(func.__name__, args[0]), file=sys.stderr)
+        return False
+
+    try:
+        targets = resolve_targets(socos, args[0])
+    except (ValueError, SocosException) as ex:
+        print(ex, file=sys.stderr)
+        return False
+    if not targets:
+        print('No speakers match "{}"'.format(args[0]), file=sys.stderr)
+        return False
+
+    if getattr(func, 'acts_on_group', False):
+        targets = _by_group(targets)
+
+    def run(sonos):
+        """Run the command and collect its output"""
+        result = func(sonos, *args[1:])
+        if result is None:
+            return []
+        if isinstance(result, (str, text_type)):
+            return [result]
+        return list(result)
+
+    printer = Printer(socos.output_format)
+    colorama = None
+    if socos.output_format == 'text':
+        colorama = load_colorama()
+    if colorama:
+        colorama.init()
+
+    success = True
+    names = socos._speaker_names()  # pylint: disable=protected-access
+    for sonos, lines, error in run_concurrently(run, targets):
+        name = names.get(sonos.ip_address, sonos.ip_address)
+        if error is not None:
+            print('[{}] {}'.format(name, error), file=sys.stderr)
+            success = False
+            continue
+        for line in lines:
+            printer.print_line(line, speaker=name)
+    printer.finish()
+
+    if colorama:
+        colorama.deinit()
+
+    return success
@@ -1,12 +1,88 @@
 """various utility functions"""
 
 import re
+import sys
+import time
+import threading
+import importlib
 from functools import wraps
-from soco import SoCo
+from collections import OrderedDict
+
+try:
+    import queue
+except ImportError:
+    # The queue module is called Queue in Python 2
+    import Queue as queue  # pylint: disable=import-error
+
+# The default number of worker threads used by run_concurrently
+MAX_WORKERS = 8
+
+# The largest network "list --scan" accepts, as a prefix length
+MIN_PREFIX_LENGTH = 16
+
+# Seconds for which the coordinator of a speaker is remembered
+COORDINATOR_TTL = 5
 
 # matches single numbers ("123") or ranges ("12..34")
 RANGE_PATTERN = re.compile(r'(\d+)(..(\d+))?')
 
+# matches a part of a selection, a number ("7") or range ("1..50" or "9-12")
+SELECTION_PATTERN = re.compile(r'^(\d+)(?:(?:\.\.|-)(\d+))?$')
+
+# Callbacks waiting for a module to be imported, by module name
+IMPORT_HOOKS = {}
+
+
+def when_imported(name, callback):
+    """Call callback with the module name once it is imported
+
+    The callback is called right away if the module is imported already,
+    otherwise as soon as a LazyModule imports it.
+    """
+    if name in sys.modules:
+        callback(sys.modules[name])
+    else:
+        IMPORT_HOOKS.setdefault(name, []).append(callback)
+
+
+def cancel_when_imported(name, callback):
+    """Forget a callback registered with when_imported"""
+    callbacks = IMPORT_HOOKS.get(name, [])
+    if callback in callbacks:
+        callbacks.remove(callback)
+
+
+# pylint: disable=useless-object-inheritance,too-few-public-methods
+class LazyModule(object):
+    """Stands in for a module that is imported when it is first used
+
+    Importing soco and requests takes longer than the commands that do not
+    talk to a speaker, e.g. help, take altogether. socos modules use them
+    through a LazyModule, so they are only imported when needed.
+
+    >>> json = LazyModule('json')
+    >>> json.dumps([1])
+    '[1]'
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+            for name in list(IMPORT_HOOKS):
+                if name in sys.modules:
+                    for callback in IMPORT_HOOKS.pop(name):
+                        callback(sys.modules[name])
+        return getattr(self._module, attr)
+
+
+# pylint: disable=invalid-name
+gzip = LazyModule('gzip')
+soco = LazyModule('soco')
+
 
 def parse_range(txt):
     """Matches a single number A or a range of two numbers A..B
@@ -39,6 +115,321 @@ def parse_range(txt):
     return range(val1, val2 + 1)
 
 
+def parse_selection(txt, count=None):
+    """Parse a selection of numbers like "3,7,9-12", "1..50" or "all"
+
+    The numbers are returned in the order they are given, without
+    duplicates. "all" selects the numbers 1 to count.
+
+    >>> parse_selection('3,7,9-12')
+    [3, 7, 9, 10, 11, 12]
+
+    >>> parse_selection('5..3,1..2,2')
+    [5, 4, 3, 1, 2]
+
+    >>> parse_selection('all', 3)
+    [1, 2, 3]
+    """
+    if txt == 'all' and count is not None:
+        return list(range(1, count + 1))
+
+    numbers, seen = [], set()
+    for part in txt.split(','):
+        matches = SELECTION_PATTERN.match(part.strip())
+        if not matches:
+            raise ValueError('Invalid selection "{}", use e.g. 3, 1..50, '
+                             '3,7,9-12 or all'.format(txt))
+        first = int(matches.group(1))
+        last = int(matches.group(2) or first)
+        step = 1 if last >= first else -1
+        for number in range(first, last + step, step):
+            if number not in seen:
+                seen.add(number)
+                numbers.append(number)
+    return numbers
+
+
+def contiguous_spans(numbers):
+    """Group numbers into spans of consecutive numbers
+
+    Returns a sorted list of (first, last) tuples, duplicates are ignored.
+
+    >>> contiguous_spans([7, 1, 2, 3, 9, 8, 3])
+    [(1, 3), (7, 9)]
+
+    >>> contiguous_spans([])
+    []
+    """
+    spans = []
+    for number in sorted(set(numbers)):
+        if spans and spans[-1][1] == number - 1:
+            spans[-1] = (spans[-1][0], number)
+        else:
+            spans.append((number, number))
+    return spans
+
+
+def extract_options(args, flags=(), options=()):
+    """Split command arguments into positional arguments and options
+
+    flags are options without a value, options take the following argument
+    as value. The returned dict uses the option names without leading dashes
+    and with dashes replaced by underscores.
+
+    >>> extract_options(['1..5', '--timeout', '2', '--details'],
+    ...                 flags=['--details'], options=['--timeout']) == (
+    ...     ['1..5'], {'details': True, 'timeout': '2'})
+    True
+    """
+    positional = []
+    found = {}
+    args = list(args)
+    while args:
+        arg = args.pop(0)
+        name = arg.lstrip('-').replace('-', '_')
+        if arg in flags:
+            found[name] = True
+        elif arg in options:
+            if not args:
+                raise ValueError('Option "{}" requires a value'.format(arg))
+            found[name] = args.pop(0)
+        else:
+            positional.append(arg)
+    return positional, found
+
+
+def expand_network(cidr):
+    """Return the host addresses of an IPv4 network like 10.0.20.0/24
+
+    The network and broadcast addresses are left out. A single address is
+    a network of its own.
+
+    >>> expand_network('10.0.20.0/30')
+    ['10.0.20.1', '10.0.20.2']
+
+    >>> len(expand_network('10.0.20.77/24')), expand_network('10.0.20.5')
+    (254, ['10.0.20.5'])
+    """
+    address, _, prefix = cidr.partition('/')
+    octets = address.split('.')
+    try:
+        prefix = int(prefix or 32)
+        if len(octets) != 4 or not all(
+                0 <= int(octet) <= 255 for octet in octets):
+            raise ValueError(address)
+    except ValueError:
+        raise ValueError('Invalid network "{}", use e.g. 10.0.20.0/24'.format(
+            cidr))
+    first = 0
+    for octet in octets:
+        first = first << 8 | int(octet)
+    if not MIN_PREFIX_LENGTH <= prefix <= 32:
+        raise ValueError('The prefix length of "{}" must be between {} and '
+                         '32'.format(cidr, MIN_PREFIX_LENGTH))
+
+    mask = (0xffffffff << (32 - prefix)) & 0xffffffff
+    first &= mask
+    last = first | (~mask & 0xffffffff)
+    if prefix < 31:
+        first, last = first + 1, last - 1
+    return ['.'.join(str(number >> shift & 0xff) for shift in (24, 16, 8, 0))
+            for number in range(first, last + 1)]
+
+
+def _run_workers(func, items, max_workers, timeout):
+    """Yield (index, result, exception) for the items as func finishes"""
+    tasks = queue.Queue()
+    results = queue.Queue()
+    for task in enumerate(items):
+        tasks.put(task)
+
+    def worker():
+        """Process tasks until there are none left"""
+        while True:
+            try:
+                index, item = tasks.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                results.put((index, func(item), None))
+            except Exception as ex:  # pylint: disable=broad-except
+                results.put((index, None, ex))
+
+    for _ in range(min(max_workers, len(items))):
+        thread = threading.Thread(target=worker)
+        # Do not let threads stuck on a slow device block the exit
+        thread.daemon = True
+        thread.start()
+
+    deadline = None if timeout is None else time.time() + timeout
+    for _ in range(len(items)):
+        remaining = None
+        if deadline is not None:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return
+        try:
+            yield results.get(timeout=remaining)
+        except queue.Empty:
+            return
+
+
+def run_concurrently(func, items, max_workers=MAX_WORKERS, timeout=None):
+    """Call func for every item in a bounded pool of worker threads
+
+    Returns a list of (item, result, exception) tuples in the order of items.
+    exception is None if func returned normally. If timeout (in seconds) is
+    given, items for which func did not finish in time are left out.
+
+    >>> run_concurrently(lambda x: 10 // x, [1, 5])
+    [(1, 10, None), (5, 2, None)]
+    """
+    items = list(items)
+    finished = sorted(_run_workers(func, items, max_workers, timeout),
+                      key=lambda finish: finish[0])
+    return [(items[index], result, error)
+            for index, result, error in finished]
+
+
+def iter_concurrently(func, items, max_workers=MAX_WORKERS, timeout=None):
+    """Like run_concurrently, but yields the tuples as soon as func finishes
+
+    >>> sorted(iter_concurrently(lambda x: 10 // x, [1, 5]))
+    [(1, 10, None), (5, 2, None)]
+    """
+    items = list(items)
+    for index, result, error in _run_workers(func, items, max_workers,
+                                             timeout):
+        yield items[index], result, error
+
+
+def map_concurrently(func, items, max_workers=MAX_WORKERS):
+    """Like map, but calls func for the items concurrently
+
+    The first exception raised by func is re-raised.
+
+    >>> map_concurrently(lambda x: x * 2, [1, 2, 3])
+    [2, 4, 6]
+    """
+    results = run_concurrently(func, items, max_workers)
+    for _, _, error in results:
+        if error is not None:
+            raise error
+    return [result for _, result, _ in results]
+
+
+def open_binary(path, mode):
+    """Open a file for reading ('r') or writing ('w') bytes
+
+    Files whose name ends with .gz are gzip compressed."""
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 'b')
+    return open(path, mode + 'b')
+
+
+def library_update_id(sonos):
+    """Return the id of the last music library index change of sonos
+
+    The id changes whenever the speaker re-indexes the music library, which
+    makes it a cheap way to tell whether locally stored library information
+    is still valid. Returns None if the speaker does not support it.
+    """
+    try:
+        response = sonos.contentDirectory.GetLastIndexChange()
+    except soco.exceptions.SoCoUPnPException:
+        return None
+    return response['LastIndexChange']
+
+
+# pylint: disable=useless-object-inheritance
+class TTLCache(object):
+    """A simple in-memory cache whose entries expire after ttl seconds
+
+    If max_entries is given, the least recently used entries are dropped when
+    the cache grows beyond that size.
+
+    >>> cache = TTLCache(ttl=60, max_entries=2)
+    >>> cache.put('key', 'value')
+    >>> cache.get('key'), cache.get('other')
+    ('value', None)
+    >>> cache.hits, cache.misses
+    (1, 1)
+    >>> cache.put('second', 2)
+    >>> cache.put('third', 3)
+    >>> len(cache), cache.get('key')
+    (2, None)
+    """
+
+    def __init__(self, ttl, max_entries=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """Return the value stored for key or default if missing or expired"""
+        with self._lock:
+            expires, value = self._entries.pop(key, (0, default))
+            if expires > time.time():
+                # Re-insert to mark the entry as most recently used
+                self._entries[key] = (expires, value)
+                self.hits += 1
+                return value
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        """Store value for key"""
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + self.ttl, value)
+            while self.max_entries and len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        """Remove the entry for key, if any"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Remove all entries"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return a one line summary of the cache usage"""
+        lookups = self.hits + self.misses
+        rate = 100.0 * self.hits / lookups if lookups else 0
+        return '{} entries, {} hits, {} misses ({:.0f}% hit rate)'.format(
+            len(self), self.hits, self.misses, rate)
+
+
+# The coordinators of the speakers, keyed by speaker uid. Shared by all
+# SoCos instances in the process, so it lasts for a shell session.
+COORDINATOR_CACHE = TTLCache(COORDINATOR_TTL)
+
+
+def get_coordinator(sonos):
+    """Return the group coordinator of sonos
+
+    Resolving the coordinator needs the zone group topology from the
+    network, so it is cached by speaker uid for COORDINATOR_TTL seconds.
+    Commands changing the topology should call COORDINATOR_CACHE.clear().
+    """
+    coordinator = COORDINATOR_CACHE.get(sonos.uid)
+    if coordinator is None:
+        coordinator = sonos.group.coordinator
+        COORDINATOR_CACHE.put(sonos.uid, coordinator)
+        # Nested calls will be made with the coordinator itself
+        COORDINATOR_CACHE.put(coordinator.uid, coordinator)
+    return coordinator
+
+
 def requires_coordinator(func):
     """
     A decorator to mark functions requiring a
@@ -48,13 +439,32 @@ def requires_coordinator(func):
     def decorated(*args, **kwargs):
         """
         Grab sonos from first argument to the original function and turn this
-        into sonos.group.coordinator
-        before returning the decorated function.
+        into the group coordinator before returning the decorated function.
         """
         args = list(args)
-        if isinstance(args[0], SoCo):  # Static method
-            args[0] = args[0].group.coordinator
+        if isinstance(args[0], soco.SoCo):  # Static method
+            args[0] = get_coordinator(args[0])
         else:  # Ordinary method
-            args[1] = args[1].group.coordinator
+            args[1] = get_coordinator(args[1])
         return func(*args, **kwargs)
+    decorated.acts_on_group = True
     return decorated
+
+
+def acts_on_group(func):
+    """
+    A decorator to mark commands that act on the group of a device, like
+    changing its queue, without requiring the coordinator for everything.
+    Commands run on several speakers at once run once per group.
+    """
+    func.acts_on_group = True
+    return func
+
+
+def streams(func):
+    """
+    A decorator to mark commands that run until interrupted, like watch.
+    They cannot run on several speakers at once.
+    """
+    func.streams = True
+    return func
@@ -8,6 +8,7 @@ import sys
 import importlib
 import pkgutil
 import doctest
+import unittest
 
 # prefer modules in current working directory
 sys.path.insert(0, '.')
@@ -35,5 +36,17 @@ def doctest_package(package):
     return failed
 
 
+# the modules of tests against the simulated speakers
+TEST_MODULES = ['test_commands', 'test_targets', 'test_cache', 'test_library',
+                'test_events', 'test_daemon', 'test_profiler', 'test_replay']
+
+
+def test_commands():
+    """run the command tests against the simulated speakers"""
+    suite = unittest.defaultTestLoader.loadTestsFromNames(TEST_MODULES)
+    res = unittest.TextTestRunner(verbosity=1).run(suite)
+    return len(res.failures) + len(res.errors)
+
+
 # return number of failed tests, ie error if at least one test failed
-sys.exit(doctest_package(PACKAGE))
+sys.exit(doctest_package(PACKAGE) + test_commands())
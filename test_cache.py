@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+
+"""Tests of the caches of socos"""
+
+import os
+import json
+import time
+import threading
+import unittest
+
+import soco
+
+from socos.cache import QUERY_CACHE, write_atomic
+from socos.utils import COORDINATOR_CACHE, get_coordinator
+
+from simulator_case import SYSTEM, SimulatorTestCase
+
+
+class CoordinatorCacheTest(SimulatorTestCase):
+    """Remembering the group coordinators of the speakers"""
+
+    def coordinator(self, ip_address):
+        """Return the coordinator of a speaker and the requests it took"""
+        before = SYSTEM.requests
+        coordinator = get_coordinator(soco.SoCo(ip_address))
+        return coordinator.ip_address, SYSTEM.requests - before
+
+    def test_cached(self):
+        """The coordinator is resolved once for all members of a group"""
+        self.group()
+        self.assertNotEqual(self.coordinator(self.ips[1])[1], 0)
+        self.assertEqual(self.coordinator(self.ips[1]), (self.ips[0], 0))
+        self.assertEqual(self.coordinator(self.ips[0]), (self.ips[0], 0))
+
+    def test_expiry(self):
+        """A changed group is noticed once the cached coordinator expired"""
+        ttl = COORDINATOR_CACHE.ttl
+        COORDINATOR_CACHE.ttl = 0.2
+        try:
+            self.assertEqual(self.coordinator(self.ips[1])[0], self.ips[1])
+            self.group()
+            # pylint: disable=no-member
+            soco.services.zone_group_state_shared_cache.clear()
+            self.assertEqual(self.coordinator(self.ips[1]), (self.ips[1], 0))
+            time.sleep(0.3)
+            self.assertEqual(self.coordinator(self.ips[1])[0], self.ips[0])
+        finally:
+            COORDINATOR_CACHE.ttl = ttl
+
+    def test_partymode_clears(self):
+        """Grouping the speakers forgets the cached coordinators"""
+        self.coordinator(self.ips[1])
+        self.socos.current_speaker = soco.SoCo(self.ips[0])
+        success, _, err = self.run_cmd('partymode')
+        self.assertTrue(success, err)
+        self.assertEqual(len(COORDINATOR_CACHE), 0)
+
+
+class QueryCacheTest(SimulatorTestCase):
+    """The read-through cache of speaker queries"""
+
+    def requests(self, *args):
+        """Run a command and return its output and the requests it sent"""
+        before = SYSTEM.requests
+        success, out, err = self.run_cmd(*args)
+        self.assertTrue(success, err)
+        return out, SYSTEM.requests - before
+
+    def test_repeated_reads(self):
+        """Repeated reads are answered from the cache"""
+        self.requests('bass', self.ips[0])
+        for command in ['bass', 'info', 'mode']:
+            self.requests(command, self.ips[0])
+            self.assertEqual(self.requests(command, self.ips[0])[1], 0)
+        out, _ = self.run_cmd('cache', 'stats')[1:]
+        self.assertIn('bass: 1 entries, 2 hits, 1 misses (67% hit rate)',
+                      out)
+
+    def test_writes_invalidate(self):
+        """Changing a value drops its cached result"""
+        self.requests('bass', self.ips[0])
+        self.requests('bass', self.ips[0], '+2')
+        self.assertEqual(self.requests('bass', self.ips[0])[0], ['2'])
+        self.requests('eq', self.ips[0], 'bass=+3', 'treble=1')
+        self.assertEqual(self.requests('bass', self.ips[0])[0], ['5'])
+        self.requests('mode', self.ips[0], 'SHUFFLE')
+        self.assertEqual(self.requests('mode', self.ips[0])[0], ['SHUFFLE'])
+
+    def test_transport_invalidates(self):
+        """The state after play, pause and stop is asked for again"""
+        self.assertEqual(self.requests('state', self.ips[0])[0], ['STOPPED'])
+        self.requests('play', self.ips[0])
+        self.assertEqual(self.requests('state', self.ips[0])[0], ['PLAYING'])
+        self.requests('pause', self.ips[0])
+        self.assertEqual(self.requests('state', self.ips[0])[0],
+                         ['PAUSED_PLAYBACK'])
+
+    def test_fresh(self):
+        """Without the cache every read goes to the speaker"""
+        self.requests('bass', self.ips[0])
+        SYSTEM.speakers[0].bass = 7
+        self.assertEqual(self.requests('bass', self.ips[0])[0], ['0'])
+        QUERY_CACHE.enabled = False
+        self.assertEqual(self.requests('bass', self.ips[0]), (['7'], 1))
+
+
+class WriteAtomicTest(SimulatorTestCase):
+    """Writing cache files from several threads"""
+
+    def test_concurrent_writers(self):
+        """Every thread writes a temporary file of its own"""
+        path = os.path.join(self.cache_dir, 'speakers.json')
+        errors = []
+
+        def write(number):
+            """Write the cache file a few times"""
+            content = json.dumps({'writer': number, 'data': 'x' * 100000})
+            try:
+                for _ in range(20):
+                    write_atomic(path, content)
+            except (IOError, OSError) as ex:
+                errors.append(ex)
+
+        threads = [threading.Thread(target=write, args=(number,))
+                   for number in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        with open(path) as cache_file:
+            self.assertIn(json.load(cache_file)['writer'], range(8))
+        self.assertEqual(os.listdir(self.cache_dir), ['speakers.json'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,442 @@
+#!/usr/bin/env python
+
+"""Tests of the speaker commands against simulated speakers"""
+
+import io
+import os
+import sys
+import json
+import time
+import unittest
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+import soco
+
+from socos.benchmark import (
+    STARTUP_SCENARIOS, imported_of, run_startup_scenario)
+from socos.cache import SpeakerCache
+from socos.exceptions import SocosException
+from socos.output import Printer, Record
+from socos.utils import get_coordinator
+
+from simulator_case import SYSTEM, SimulatorTestCase, stub_subscribe
+
+
+class ListTest(SimulatorTestCase):
+    """Listing the speakers and keeping them in the speaker cache"""
+
+    def test_refresh_keeps_slow_speakers(self):
+        """A refresh with timeout keeps speakers that answer too late"""
+        cache = SpeakerCache()
+        self.assertEqual(len(cache.refresh()), 3)
+
+        # pylint: disable=protected-access,no-member
+        soco.SoCo._instances.clear()
+        player_name = soco.SoCo.player_name
+
+        def slow_name(sonos):
+            """Answer late for the second speaker"""
+            if sonos.ip_address == self.ips[1]:
+                time.sleep(1)
+            return player_name.fget(sonos)
+        soco.SoCo.player_name = property(slow_name)
+        try:
+            speakers = cache.refresh(timeout=0.3)
+        finally:
+            soco.SoCo.player_name = player_name
+        self.assertEqual([speaker['name'] for speaker in speakers],
+                         ['Room 1', 'Room 2', 'Room 3'])
+        self.assertEqual(cache.load()[1], speakers)
+
+
+class ScanTest(SimulatorTestCase):
+    """Finding speakers by probing the addresses of a network"""
+
+    def scan(self, *args):
+        """Run list with multicast discovery finding no speakers"""
+        soco.discover = lambda *args, **kwargs: set()
+        try:
+            success, out, err = self.run_cmd('list', '--scan', *args)
+        finally:
+            soco.discover = SYSTEM.discover
+        self.assertTrue(success, err)
+        return out
+
+    def test_scan(self):
+        """list --scan finds the speakers multicast discovery misses"""
+        out = self.scan('127.0.0.0/28')
+        self.assertEqual(sorted(line.split()[-1] for line in out),
+                         ['1', '2', '3'])
+        self.assertEqual(SpeakerCache().networks(), ['127.0.0.0/28'])
+
+    def test_set_by_number(self):
+        """The scanned speakers can be set by their number"""
+        ips = dict(line.split()[:2] for line in self.scan('127.0.0.0/28'))
+        success, _, err = self.run_cmd('set', '2')
+        self.assertTrue(success, err)
+        self.assertEqual(self.socos.current_speaker.ip_address, ips['(2)'])
+
+    def test_invalid_network(self):
+        """Networks that are not in CIDR notation are refused"""
+        success, out, err = self.run_cmd('list', '--scan', '127.0.0')
+        self.assertFalse(success)
+        self.assertEqual(out, [])
+        self.assertEqual(len(err), 1)
+
+
+class ScriptTest(SimulatorTestCase):
+    """Running scripts of commands"""
+
+    def run_batch(self, lines):
+        """Run a script and return its exit code and error output"""
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = StringIO(), StringIO()
+        try:
+            code = self.socos.run_batch(lines)
+            err = sys.stderr.getvalue()
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+        return code, err.splitlines()
+
+    def test_continues_after_errors(self):
+        """Failing lines, also network errors, are counted"""
+        lines = ['volume {}'.format(self.ips[0]), 'volume 127.0.0.9',
+                 'mode {} BOGUS'.format(self.ips[0]),
+                 'volume {} +1'.format(self.ips[0])]
+        code, err = self.run_batch(lines)
+        self.assertEqual(code, 1)
+        self.assertEqual(err[-1], '2 of 4 commands failed (lines 2, 3)')
+        self.assertEqual(SYSTEM.speakers[0].volume, 21)
+
+    def test_errors_have_line_numbers(self):
+        """Every error line starts with the number of the failed line"""
+        code, err = self.run_batch(
+            ['# volume', '', 'cache foo', 'volume {}'.format(self.ips[0])])
+        self.assertEqual(code, 1)
+        self.assertEqual(err, [
+            "Line 3: Argument must be one of 'stats' or 'clear'",
+            'Line 3: FAILED: cache foo',
+            '1 of 2 commands failed (line 3)'])
+
+    def test_exit(self):
+        """exit ends the script with the failures so far"""
+        code, _ = self.run_batch(['volume 127.0.0.9', 'exit',
+                                  'volume {} +1'.format(self.ips[0])])
+        self.assertEqual(code, 1)
+        self.assertEqual(self.run_batch(['exit', 'volume 127.0.0.9']),
+                         (0, []))
+        self.assertEqual(SYSTEM.speakers[0].volume, 20)
+
+
+class RemoveTest(SimulatorTestCase):
+    """Removing tracks from the queue"""
+
+    def test_spans(self):
+        """Every span of consecutive tracks is removed with one request"""
+        sonos = get_coordinator(soco.SoCo(self.ips[0]))
+        tracks = list(SYSTEM.speakers[0].queue)
+        before = SYSTEM.requests
+        self.socos.remove_range_from_queue(sonos, [7, 1, 2, 3, 8])
+        # The queue status and a request per span
+        self.assertEqual(SYSTEM.requests - before, 3)
+        self.assertEqual(SYSTEM.speakers[0].queue,
+                         tracks[3:6] + tracks[8:])
+
+    def test_range(self):
+        """remove IP 2..4 removes these tracks and shows the queue"""
+        tracks = list(SYSTEM.speakers[0].queue)
+        success, out, err = self.run_cmd('remove', self.ips[0], '2..4')
+        self.assertTrue(success, err)
+        self.assertEqual(len(out), 27)
+        self.assertEqual(SYSTEM.speakers[0].queue, tracks[:1] + tracks[4:])
+
+    def test_invalid_range(self):
+        """Reversed ranges and positions outside the queue are refused"""
+        for selection in ['5..3', '0', '29..31']:
+            success, out, err = self.run_cmd('remove', self.ips[0],
+                                             selection)
+            self.assertFalse(success)
+            self.assertEqual(out, [])
+            self.assertEqual(len(err), 1)
+        self.assertEqual(len(SYSTEM.speakers[0].queue), 30)
+
+    def test_changed_queue(self):
+        """A queue changed by someone else is not removed from"""
+        sonos = get_coordinator(soco.SoCo(self.ips[0]))
+        status = self.socos.get_queue_status
+
+        def outdated_status(sonos):
+            """Change the queue after its status was read"""
+            result = status(sonos)
+            SYSTEM.speakers[0].queue_update_id += 1
+            return result
+        self.socos.get_queue_status = outdated_status
+        self.assertRaises(SocosException, self.socos.remove_range_from_queue,
+                          sonos, [1, 2])
+        self.assertEqual(len(SYSTEM.speakers[0].queue), 30)
+
+
+class QueueTest(SimulatorTestCase):
+    """Showing the queue page by page"""
+
+    def test_range(self):
+        """A range shows the tracks at these positions"""
+        success, out, _ = self.run_cmd('queue', self.ips[0], '2..3')
+        self.assertTrue(success)
+        self.assertEqual(len(out), 2)
+        self.assertIn('Bar 2', out[0])
+
+    def test_pages(self):
+        """The queue is fetched a page at a time"""
+        counts = []
+        # The first run resolves the coordinator as well
+        for page_size in ['30', '30', '7']:
+            before = SYSTEM.requests
+            success, out, _ = self.run_cmd('queue', self.ips[0],
+                                           '--page-size', page_size)
+            self.assertTrue(success)
+            self.assertEqual(len(out), 30)
+            counts.append(SYSTEM.requests - before)
+        # Five pages instead of one
+        self.assertEqual(counts[2] - counts[1], 4)
+
+    def test_invalid_window(self):
+        """Reversed ranges and page sizes below 1 are refused"""
+        for args in [['600..500'], ['0..3'], ['--page-size', '0']]:
+            success, out, err = self.run_cmd('queue', self.ips[0], *args)
+            self.assertFalse(success)
+            self.assertEqual(out, [])
+            self.assertEqual(len(err), 1)
+
+
+class QueueTransferTest(SimulatorTestCase):
+    """Saving, loading and copying the queue"""
+
+    @staticmethod
+    def queue_uris(speaker):
+        """Return the URIs of the tracks in the queue of a simulated speaker"""
+        return [track.resources[0].uri for track in speaker.queue]
+
+    def test_save_load(self):
+        """A saved queue is loaded back in batches of 16 tracks"""
+        path = os.path.join(self.cache_dir, 'queue.jsonl.gz')
+        uris = self.queue_uris(SYSTEM.speakers[0])
+        success, out, err = self.run_cmd('queue', self.ips[0], 'save', path)
+        self.assertTrue(success, err)
+        self.assertEqual(out, ['Saved 30 tracks to {}'.format(path)])
+
+        before = SYSTEM.requests
+        success, out, err = self.run_cmd('queue', self.ips[1], 'load', path,
+                                         'replace')
+        self.assertTrue(success, err)
+        self.assertEqual(out, ['Queue replaced with 30 tracks'])
+        self.assertEqual(self.queue_uris(SYSTEM.speakers[1]), uris)
+        # Resolving the coordinator, clearing the queue and two batches
+        self.assertLessEqual(SYSTEM.requests - before, 5)
+
+        success, out, _ = self.run_cmd('queue', self.ips[1], 'load', path)
+        self.assertEqual(out, ['Added 30 tracks to queue'])
+        self.assertEqual(self.queue_uris(SYSTEM.speakers[1]), uris + uris)
+
+    def test_copy(self):
+        """copy adds the queue to the queue of another speaker"""
+        uris = self.queue_uris(SYSTEM.speakers[0])
+        success, out, err = self.run_cmd('queue', self.ips[0], 'copy',
+                                         self.ips[2], 'replace')
+        self.assertTrue(success, err)
+        self.assertEqual(out, ['Queue replaced with 30 tracks'])
+        self.assertEqual(self.queue_uris(SYSTEM.speakers[2]), uris)
+
+    def test_errors(self):
+        """Missing files and copies onto the same queue are refused"""
+        missing = os.path.join(self.cache_dir, 'missing.jsonl')
+        for args in [['load', missing], ['load'], ['copy', self.ips[0]],
+                     ['save', missing, 'append']]:
+            success, out, err = self.run_cmd('queue', self.ips[0], *args)
+            self.assertFalse(success)
+            self.assertEqual(out, [])
+            self.assertEqual(len(err), 1)
+        self.assertEqual(len(SYSTEM.speakers[0].queue), 30)
+
+
+class MixerTest(SimulatorTestCase):
+    """Changing volume, bass and treble"""
+
+    def test_relative(self):
+        """+N and -N change the setting by N, within its limits"""
+        for args, value in [(['volume', '+5'], 25), (['bass', '-2'], -2),
+                            (['treble', '+20'], 10), (['volume', '-'], 24)]:
+            success, out, err = self.run_cmd(args[0], self.ips[0], args[1])
+            self.assertTrue(success, err)
+            self.assertEqual(out, [str(value)])
+            self.assertEqual(getattr(SYSTEM.speakers[0], args[0]), value)
+
+    def test_absolute(self):
+        """A number without + or - is the new value of the setting"""
+        for args, value in [(['volume', '30'], 30), (['bass', '3'], 3),
+                            (['treble', '0'], 0), (['volume', '130'], 100)]:
+            success, out, err = self.run_cmd(args[0], self.ips[0], args[1])
+            self.assertTrue(success, err)
+            self.assertEqual(out, [str(value)])
+            self.assertEqual(getattr(SYSTEM.speakers[0], args[0]), value)
+
+    def test_confirm(self):
+        """--confirm reads the new value back from the speaker"""
+        success, out, _ = self.run_cmd('volume', self.ips[0], '30',
+                                       '--confirm')
+        self.assertTrue(success)
+        self.assertEqual(out, ['30'])
+
+    def test_invalid_value(self):
+        """Values that are no numbers are refused"""
+        success, _, err = self.run_cmd('bass', self.ips[0], 'loud')
+        self.assertFalse(success)
+        self.assertEqual(err, ['"loud" is not a number or +/-'])
+
+    def test_operator_required(self):
+        """Changing a setting needs exactly one operator"""
+        for command in ['volume', 'bass', 'treble']:
+            success, _, err = self.run_cmd(command, self.ips[0], '--confirm')
+            self.assertFalse(success)
+            self.assertIn('Usage: {} IP'.format(command), err[0])
+
+    def test_eq(self):
+        """eq changes several settings at once"""
+        success, out, err = self.run_cmd('eq', self.ips[0], 'volume=+5',
+                                         'bass=3', 'treble=-1')
+        self.assertTrue(success, err)
+        self.assertEqual(out, ['volume: 25, bass: 3, treble: -1'])
+
+
+class GroupVolumeTest(SimulatorTestCase):
+    """Changing the volume of a group"""
+
+    def volumes(self):
+        """Return the volumes of the simulated speakers"""
+        return [speaker.volume for speaker in SYSTEM.speakers]
+
+    def test_scaled(self):
+        """The members keep their volumes relative to each other"""
+        self.group()
+        for speaker, volume in zip(SYSTEM.speakers, [10, 20, 30]):
+            speaker.volume = volume
+        success, out, err = self.run_cmd('groupvolume', self.ips[1], '+10')
+        self.assertTrue(success, err)
+        self.assertEqual(self.volumes(), [15, 30, 45])
+        self.assertEqual(out[-1], 'Group volume: 30')
+
+        success, out, err = self.run_cmd('groupvolume', self.ips[0], '10')
+        self.assertTrue(success, err)
+        self.assertEqual(self.volumes(), [5, 10, 15])
+
+    def test_once_per_group(self):
+        """With a target selector every group is changed once"""
+        SYSTEM.speakers[1].coordinator = SYSTEM.speakers[0]
+        self.run_cmd('list')
+        success, out, err = self.run_cmd('groupvolume', '@all', '+10')
+        self.assertTrue(success, err)
+        self.assertEqual(self.volumes(), [30, 30, 30])
+        self.assertEqual(
+            [line for line in out if 'Group volume' in line],
+            ['[Room 1] Group volume: 30', '[Room 3] Group volume: 30'])
+
+
+class OutputFormatTest(SimulatorTestCase):
+    """The records of --format json and ndjson"""
+
+    def records(self, output_format, *args):
+        """Run a command and return the JSON records it printed"""
+        self.socos.output_format = output_format
+        success, out, err = self.run_cmd(*args)
+        self.assertTrue(success, err)
+        if output_format == 'json':
+            return json.loads('\n'.join(out))
+        return [json.loads(line) for line in out]
+
+    def test_queue(self):
+        """Every track of the queue is a record with its position"""
+        records = self.records('ndjson', 'queue', self.ips[0], '2..3')
+        self.assertEqual(records, [
+            {'position': 2, 'artist': 'Artist 1', 'title': 'Bar 2',
+             'album': 'Album 1', 'current': False},
+            {'position': 3, 'artist': 'Artist 1', 'title': 'Baz 3',
+             'album': 'Album 1', 'current': False},
+        ])
+
+    def test_current(self):
+        """The current track has a numeric position and the elapsed time"""
+        records = self.records('json', 'current', self.ips[0])
+        self.assertEqual(len(records), 1)
+        self.assertEqual(
+            sorted(records[0]), ['album', 'artist', 'duration', 'elapsed',
+                                 'position', 'title', 'uri'])
+        self.assertEqual(records[0]['position'], 1)
+        queue = self.records('json', 'queue', self.ips[0], '1')
+        self.assertEqual(queue[0]['title'], records[0]['title'])
+
+    def test_text_to_byte_stream(self):
+        """Text with any characters can be printed into pipes and files"""
+        stream = io.BytesIO()
+        if sys.version_info >= (3,):
+            stdout = io.TextIOWrapper(stream, encoding='utf-8')
+        else:
+            # Like a pipe on Python 2, which has no encoding
+            stdout = stream
+        original, sys.stdout = sys.stdout, stdout
+        try:
+            Printer('text').print_line(Record(u'1: Caf\xe9', position=1))
+        finally:
+            sys.stdout = original
+        self.assertEqual(stream.getvalue(), u'1: Caf\xe9\n'.encode('utf-8'))
+
+    def test_list_and_volume(self):
+        """Speakers and settings are records of their fields"""
+        records = self.records('ndjson', 'list')
+        self.assertEqual(sorted(record['ip'] for record in records),
+                         self.ips)
+        self.assertEqual(sorted(records[0]), ['ip', 'name', 'zone'])
+        self.assertEqual(self.records('json', 'volume', self.ips[0]),
+                         [{'volume': 20}])
+        self.assertEqual(self.records('json', 'state', self.ips[0]),
+                         [{'state': 'STOPPED'}])
+
+    def test_watch(self):
+        """The changes of watch are records of the field and value"""
+        subscribe = stub_subscribe({'AVTransport': [{
+            'transport_state': 'PLAYING',
+            'current_track': '4',
+            'current_track_duration': '0:03:00',
+            'current_track_meta_data': SYSTEM.speakers[0].queue[3],
+        }]})
+        try:
+            changes = self.socos.watch(soco.SoCo(self.ips[0]), 'current')
+            change = next(changes)
+            changes.close()
+        finally:
+            soco.services.Service.subscribe = subscribe
+        self.assertEqual(sorted(change.data), ['field', 'time', 'value'])
+        self.assertEqual(change.data['value']['position'], 4)
+        self.assertEqual(change.data['value']['title'], 'Qux 4')
+
+
+class StartupTest(SimulatorTestCase):
+    """The modules a new socos process imports"""
+
+    @unittest.skipIf(sys.version_info < (3, 7),
+                     'python -X importtime requires Python 3.7')
+    def test_lazy_imports(self):
+        """Commands only import the modules they need"""
+        for name, command, budget, forbidden in STARTUP_SCENARIOS:
+            count, modules, _ = run_startup_scenario(
+                command.format(ip=self.ips[0]), 1)
+            self.assertLessEqual(count, budget, name)
+            self.assertEqual(imported_of(forbidden, modules), [], name)
+        self.assertEqual(imported_of(['soco'], modules), ['soco'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+"""Tests of the socos daemon and its client"""
+
+import os
+import time
+import socket
+import threading
+import unittest
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+import soco
+
+from socos.client import connect, send_command
+from socos.core import SoCos
+from socos.daemon import SocosDaemon
+
+from simulator_case import SimulatorTestCase
+
+
+class DaemonTest(SimulatorTestCase):
+    """The socos daemon serving several clients"""
+
+    def setUp(self):
+        super(DaemonTest, self).setUp()
+        self.path = os.path.join(self.cache_dir, 'socos.sock')
+        self.daemon = SocosDaemon(self.path)
+        thread = threading.Thread(target=self.daemon.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        self.daemon.shutdown()
+        self.daemon.server_close()
+        super(DaemonTest, self).tearDown()
+
+    def send(self, args):
+        """Send a command to the daemon
+
+        Returns:
+            tuple: The exit code, the output and the error output
+        """
+        out, err = StringIO(), StringIO()
+        sock = connect(self.path)
+        try:
+            code = send_command(sock, args, out, err)
+        finally:
+            sock.close()
+        return code, out.getvalue(), err.getvalue()
+
+    def test_concurrent_clients(self):
+        """A command blocking in one client does not hold up another"""
+        release = threading.Event()
+        stats = SoCos.stats
+
+        def blocking_stats(_self):
+            """Wait until the test releases the command"""
+            release.wait(10)
+            return 'released'
+        SoCos.stats = blocking_stats
+        results = {}
+
+        def run_client(name, args):
+            """Send a command to the daemon and keep its output"""
+            results[name] = self.send(args)[:2]
+
+        try:
+            blocked = threading.Thread(target=run_client,
+                                       args=('stats', ['stats']))
+            blocked.start()
+            time.sleep(0.2)
+            run_client('volume', ['volume', self.ips[0]])
+            self.assertNotIn('stats', results)
+            release.set()
+            blocked.join(10)
+        finally:
+            release.set()
+            SoCos.stats = stats
+        self.assertEqual(results, {'volume': (0, '20\n'),
+                                   'stats': (0, 'released\n')})
+
+    def test_socket_removed(self):
+        """The socket is removed when the daemon is closed"""
+        self.daemon.shutdown()
+        self.daemon.server_close()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.assertRaises(socket.error, sock.connect, self.path)
+        finally:
+            sock.close()
+
+    def test_sessions(self):
+        """Commands do not share the speakers listed or set by others"""
+        self.assertEqual(self.send(['list'])[0], 0)
+        self.daemon.socos.known_speakers['9'] = soco.SoCo(self.ips[0])
+        session = self.daemon.socos.session()
+        list(session.list_ips())
+        self.assertIn('9', self.daemon.socos.known_speakers)
+        self.assertNotIn('9', session.known_speakers)
+
+        code, _, err = self.send(['set', '1'])
+        self.assertEqual(code, 1)
+        self.assertIn('only applies to the socos shell', err)
+
+    def test_profile_refused(self):
+        """profile would leave a profiler recording all later commands"""
+        for args in [['profile', 'on'], ['profile', 'off']]:
+            code, out, err = self.send(args)
+            self.assertEqual((code, out), (1, ''))
+            self.assertIn('socosc --profile COMMAND', err)
+        self.assertEqual(self.daemon.socos.http_pool.listeners, [])
+
+    def test_network_error(self):
+        """A speaker that cannot be reached is reported without traceback"""
+        code, out, err = self.send(['volume', '127.0.0.9'])
+        self.assertEqual((code, out), (1, ''))
+        self.assertEqual(len(err.splitlines()), 1)
+        self.assertNotIn('Traceback', err)
+
+
+if __name__ == '__main__':
+    unittest.main()
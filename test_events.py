@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+"""Tests of the state cache and watch, kept up to date by events"""
+
+import time
+import unittest
+
+import soco
+
+from socos import core
+from socos.events import Watcher
+
+from simulator_case import (
+    SYSTEM, SimulatorTestCase, StubSubscription, stub_subscribe)
+
+
+class StateCacheTest(SimulatorTestCase):
+    """The state of the current speaker kept up to date by events"""
+
+    def tearDown(self):
+        self.socos._follow_speaker(None)  # pylint: disable=protected-access
+        super(StateCacheTest, self).tearDown()
+
+    def follow(self, events):
+        """Follow the first speaker with a state cache getting events"""
+        subscribe = stub_subscribe(events)
+        try:
+            self.socos.current_speaker = soco.SoCo(self.ips[0])
+            # pylint: disable=protected-access
+            self.socos._follow_speaker(self.socos.current_speaker)
+        finally:
+            soco.services.Service.subscribe = subscribe
+        for _ in range(100):
+            if len(self.socos.state_cache.values) == len(events):
+                break
+            time.sleep(0.01)
+
+    def test_state_from_events(self):
+        """The state and the speaker name are taken from the events"""
+        self.follow({'AVTransport': [{'transport_state': 'PLAYING'}],
+                     'DeviceProperties': [{'zone_name': 'Kitchen'}]})
+        before = SYSTEM.requests
+        success, out, _ = self.run_cmd('state')
+        self.assertTrue(success)
+        self.assertEqual(out, ['PLAYING'])
+        # pylint: disable=protected-access
+        self.assertEqual(self.socos._prompt_name(), 'Kitchen')
+        self.assertEqual(SYSTEM.requests, before)
+
+    def test_fallback_when_not_live(self):
+        """Once the subscriptions ended, the speaker is asked again"""
+        self.follow({'AVTransport': [{'transport_state': 'PLAYING'}],
+                     'DeviceProperties': [{'zone_name': 'Kitchen'}]})
+        StubSubscription.subscriptions[0].time_left = 0
+        self.assertIsNone(self.socos.state_cache.get('transport_state'))
+        success, out, _ = self.run_cmd('state')
+        self.assertTrue(success)
+        self.assertEqual(out, ['STOPPED'])
+        # pylint: disable=protected-access
+        self.assertEqual(self.socos._prompt_name(), 'Room 1')
+
+    def test_failed_subscription(self):
+        """A failed subscription is not tried again in the same session"""
+        attempts = []
+
+        class FailingStateCache(object):
+            # pylint: disable=too-few-public-methods,useless-object-inheritance
+            """A state cache whose subscription always fails"""
+
+            def __init__(self, sonos, _coordinator):
+                self.sonos = sonos
+
+            @staticmethod
+            def start():
+                """Fail to subscribe"""
+                attempts.append(1)
+                return False
+
+        state_cache = core.StateCache
+        core.StateCache = FailingStateCache
+        try:
+            for ip_address in self.ips + self.ips:
+                self.socos._follow_speaker(  # pylint: disable=protected-access
+                    soco.SoCo(ip_address))
+        finally:
+            core.StateCache = state_cache
+        self.assertEqual(len(attempts), 1)
+        self.assertIsNone(self.socos.state_cache)
+
+
+class WatchTest(SimulatorTestCase):
+    """Watching a speaker with events"""
+
+    def watch(self, events, *fields):
+        """Return the first change lines of watching fields on a speaker"""
+        subscribe = stub_subscribe(events)
+        try:
+            changes = self.socos.watch(soco.SoCo(self.ips[0]), *fields)
+            lines = [next(changes) for _ in range(len(fields) + 1)]
+            changes.close()
+        finally:
+            soco.services.Service.subscribe = subscribe
+        return lines
+
+    def test_changes(self):
+        """Every service is subscribed to once and only changes are shown"""
+        lines = self.watch({
+            'AVTransport': [{'transport_state': 'STOPPED'},
+                            {'transport_state': 'STOPPED'},
+                            {'transport_state': 'PLAYING'}],
+            'RenderingControl': [{'volume': {'Master': '30'}}],
+        }, 'state', 'volume')
+        self.assertEqual(lines, ['state: STOPPED', 'state: PLAYING',
+                                 'volume: 30'])
+        self.assertEqual(lines[1].data['value'], 'PLAYING')
+        subscriptions = StubSubscription.subscriptions
+        self.assertEqual(
+            sorted(sub.service.service_type for sub in subscriptions),
+            ['AVTransport', 'RenderingControl'])
+        self.assertFalse(any(sub.is_subscribed for sub in subscriptions))
+
+    def test_queue(self):
+        """Changes of the queue show the length of the queue"""
+        lines = self.watch({
+            'ContentDirectory': [{'container_update_i_ds': 'Q:0,1'},
+                                 {'container_update_i_ds': 'S:,3,Q:0,2'}],
+        }, 'queue')
+        self.assertEqual([line.data['value'] for line in lines], [30, 30])
+
+    def test_resubscribe(self):
+        """A lost subscription that fails to subscribe again is retried"""
+        watcher = Watcher(soco.SoCo(self.ips[0]),
+                          soco.SoCo(self.ips[0]), ['volume'])
+        subscribe = stub_subscribe({})
+        try:
+            watcher.start()
+            service, lost = list(watcher.subscriptions.items())[0]
+            lost.is_subscribed = False
+            stub = soco.services.Service.subscribe
+
+            def fail(service, **kwargs):
+                """Fail like a speaker that is not back yet"""
+                raise soco.exceptions.SoCoException('unreachable')
+            soco.services.Service.subscribe = fail
+            watcher.check()
+            self.assertIs(watcher.subscriptions[service], lost)
+
+            soco.services.Service.subscribe = stub
+            watcher.check()
+            renewed = watcher.subscriptions[service]
+            self.assertIsNot(renewed, lost)
+            self.assertTrue(renewed.is_subscribed)
+            watcher.stop()
+        finally:
+            soco.services.Service.subscribe = subscribe
+
+    def test_unknown_field(self):
+        """Only the fields of WATCH_FIELDS can be watched"""
+        success, _, err = self.run_cmd('watch', self.ips[0], 'bass')
+        self.assertFalse(success)
+        self.assertIn('Can only watch', err[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
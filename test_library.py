@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+"""Tests of the music library searches, index and sync"""
+
+import unittest
+
+import soco
+
+from socos.cache import QUERY_CACHE
+from socos.profiler import Profiler
+
+from simulator_case import SYSTEM, SimulatorTestCase
+
+
+class SearchCacheTest(SimulatorTestCase):
+    """Reusing music library search results"""
+
+    def requests(self, *args):
+        """Run a command and return its output and the requests it sent"""
+        before = SYSTEM.requests
+        success, out, err = self.run_cmd(*args)
+        self.assertTrue(success, err)
+        return out, SYSTEM.requests - before
+
+    def test_reuse(self):
+        """A repeated search and adding its results need no search"""
+        out, _ = self.requests('tracks', self.ips[0], 'foo')
+        self.assertEqual(self.requests('tracks', self.ips[0], 'foo'),
+                         (out, 0))
+        self.requests('tracks', self.ips[0], 'foo', 'add', '2')
+        self.assertEqual(SYSTEM.speakers[0].queue[-1].title, 'Foo 9')
+        self.assertEqual(self.socos.music_lib.search_cache.misses, 1)
+
+    def test_keys(self):
+        """Results are kept per speaker, data type and search term"""
+        searches = [('tracks', self.ips[0], 'foo'),
+                    ('tracks', self.ips[0], 'bar'),
+                    ('albums', self.ips[0], 'foo'),
+                    ('tracks', self.ips[1], 'foo')]
+        for args in searches + searches:
+            self.requests(*args)
+        search_cache = self.socos.music_lib.search_cache
+        self.assertEqual((search_cache.hits, search_cache.misses), (4, 4))
+
+    def test_library_changed(self):
+        """Results are searched again once the library update id changed"""
+        self.requests('tracks', self.ips[0], 'foo')
+        QUERY_CACHE.invalidate(soco.SoCo(self.ips[0]), 'library_update_id')
+        # Only the update id is asked for again
+        self.assertEqual(self.requests('tracks', self.ips[0], 'foo')[1], 1)
+
+        SYSTEM.library.update_id += 1
+        try:
+            # Until the cached update id expires, the results are reused
+            self.assertEqual(self.requests('tracks', self.ips[0], 'foo')[1],
+                             0)
+            QUERY_CACHE.invalidate(soco.SoCo(self.ips[0]),
+                                   'library_update_id')
+            self.assertEqual(self.requests('tracks', self.ips[0], 'foo')[1],
+                             2)
+        finally:
+            SYSTEM.library.update_id -= 1
+
+    def test_sonos_playlists(self):
+        """Sonos playlists are always searched on the speaker"""
+        self.requests('sonos_playlists', self.ips[0])
+        self.assertEqual(self.requests('sonos_playlists', self.ips[0])[1], 1)
+
+    def test_clear(self):
+        """library clear empties the cache"""
+        self.requests('tracks', self.ips[0], 'foo')
+        out, _ = self.requests('library', self.ips[0], 'clear')
+        self.assertIn('Search cache: 0 entries', out[-1])
+        self.assertEqual(self.requests('tracks', self.ips[0], 'foo')[1], 1)
+
+
+class IndexTest(SimulatorTestCase):
+    """Searching the local index of the music library"""
+
+    def test_search(self):
+        """Searches go to the index once the library is indexed"""
+        success, out, err = self.run_cmd('library', self.ips[0], 'index')
+        self.assertTrue(success, err)
+        self.assertIn('Indexed', out[0])
+        before = SYSTEM.requests
+        success, out, _ = self.run_cmd('tracks', self.ips[0], 'bar')
+        self.assertTrue(success)
+        self.assertEqual(len(out), 13)
+        self.assertEqual(SYSTEM.requests - before, 1)
+
+    def test_stale_index(self):
+        """After the library changed, the speaker is searched again"""
+        self.run_cmd('library', self.ips[0], 'index')
+        SYSTEM.library.update_id += 1
+        try:
+            success, out, err = self.run_cmd('tracks', self.ips[0], 'bar')
+        finally:
+            SYSTEM.library.update_id -= 1
+        self.assertTrue(success)
+        self.assertEqual(len(out), 13)
+        self.assertIn('music library changed', err[0])
+
+
+class SyncTest(SimulatorTestCase):
+    """Keeping a local snapshot of the library tree"""
+
+    def sync(self, *args):
+        """Run library sync and return the summary line"""
+        success, out, err = self.run_cmd('library', self.ips[0], 'sync',
+                                         *args)
+        self.assertTrue(success, err)
+        return out[-1].split(': ', 1)[1]
+
+    def test_unchanged(self):
+        """A second sync reuses all containers of the snapshot"""
+        self.assertEqual(self.sync('A:ALBUM'),
+                         '100 items added, 0 removed, 11 containers browsed, '
+                         '0 unchanged, 100 items in total')
+        self.assertEqual(self.sync('A:ALBUM'),
+                         '0 items added, 0 removed, 0 containers browsed, '
+                         '11 unchanged, 100 items in total')
+
+    def test_sync_unknown_root(self):
+        """Browsing a root the speaker refuses fails the command"""
+        success, _, err = self.run_cmd('library', self.ips[0], 'sync',
+                                       'BOGUS:')
+        self.assertFalse(success)
+        self.assertIn('Could not browse "BOGUS:"', err[0])
+
+
+class BulkAddTest(SimulatorTestCase):
+    """Adding several search results to the queue at once"""
+
+    def actions(self, *args):
+        """Run a command and return the UPnP actions it sent"""
+        profiler = Profiler()
+        self.socos.http_pool.listeners.append(profiler.record)
+        try:
+            success, out, err = self.run_cmd(*args)
+        finally:
+            self.socos.http_pool.listeners.remove(profiler.record)
+        self.assertTrue(success, err)
+        return out, [call[1] for call in profiler.calls]
+
+    def test_selection(self):
+        """The selected results are added in the order given"""
+        self.run_cmd('tracks', self.ips[0], 'bar')
+        out, actions = self.actions('tracks', self.ips[0], 'bar', 'add',
+                                    '3,1')
+        self.assertEqual(out, ['Added 2 tracks to queue'])
+        self.assertEqual(actions.count('AddMultipleURIsToQueue'), 1)
+        self.assertEqual(
+            [track.title for track in SYSTEM.speakers[0].queue[30:]],
+            ['Bar 18', 'Bar 2'])
+
+    def test_all(self):
+        """Up to 16 results are added with a single request"""
+        out, actions = self.actions('tracks', self.ips[0], 'bar', 'replace',
+                                    'all')
+        self.assertEqual(out, ['Queue replaced with 13 tracks'])
+        self.assertEqual(actions.count('AddMultipleURIsToQueue'), 1)
+        self.assertEqual(len(SYSTEM.speakers[0].queue), 13)
+
+        out, actions = self.actions('albums', self.ips[0], 'album',
+                                    'add', '1..10')
+        self.assertEqual(out, ['Added 10 albums to queue'])
+        self.assertEqual(len(SYSTEM.speakers[0].queue), 113)
+
+    def test_out_of_range(self):
+        """A selection beyond the results adds nothing"""
+        success, _, err = self.run_cmd('tracks', self.ips[0], 'bar', 'add',
+                                       '1..20')
+        self.assertFalse(success)
+        self.assertEqual(err, ['Play number has to be within the range 1 '
+                               'to 13'])
+        self.assertEqual(len(SYSTEM.speakers[0].queue), 30)
+
+
+if __name__ == '__main__':
+    unittest.main()
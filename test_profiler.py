@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+"""Tests of the connection pool and the request profiler"""
+
+import unittest
+
+import requests
+import soco
+
+from simulator_case import SimulatorTestCase
+
+
+class HTTPPoolTest(SimulatorTestCase):
+    """Reusing the connections to the speakers"""
+
+    def test_reuse(self):
+        """The requests of several commands share one connection"""
+        for command in ['volume', 'bass', 'state', 'volume']:
+            success, _, err = self.run_cmd(command, self.ips[0])
+            self.assertTrue(success, err)
+        requests_sent, connections = self.socos.http_pool.stats()[
+            '{}:1400'.format(self.ips[0])]
+        self.assertGreaterEqual(requests_sent, 4)
+        self.assertEqual(connections, 1)
+
+        self.run_cmd('list')
+        _, out, _ = self.run_cmd('stats')
+        self.assertEqual(out[0], 'Room 1: {} requests, 1 connections '
+                         'opened, {} reused'.format(requests_sent,
+                                                    requests_sent - 1))
+
+    def test_uninstall(self):
+        """soco uses plain requests again once the pool is uninstalled"""
+        # pylint: disable=no-member
+        self.run_cmd('volume', self.ips[0])
+        self.assertIsNot(soco.services.requests, requests)
+        self.socos.http_pool.uninstall()
+        self.assertIs(soco.services.requests, requests)
+        self.socos.http_pool.install()
+        self.assertIsNot(soco.services.requests, requests)
+
+
+class ProfileTest(SimulatorTestCase):
+    """Showing the requests made for every command"""
+
+    def test_summary(self):
+        """With profiling on, every command is followed by its requests"""
+        self.run_cmd('volume', self.ips[0])
+        self.assertEqual(self.run_cmd('profile', 'on')[1],
+                         ['Profiling is on'])
+        success, out, err = self.run_cmd('volume', self.ips[0], '+5')
+        self.assertTrue(success)
+        self.assertEqual(out, ['25'])
+        self.assertEqual(err[0].split(), [
+            'Service', 'Action', 'Count', 'Total', 'ms', 'p50', 'p95',
+            'Sent', 'Received'])
+        self.assertEqual(err[1].split()[:3],
+                         ['RenderingControl', 'SetRelativeVolume', '1'])
+        self.assertEqual(len(err), 3)
+        self.assertTrue(err[2].startswith('1 requests, '), err[2])
+        self.assertTrue(err[2].endswith(' ms wall time'), err[2])
+
+    def test_no_requests(self):
+        """Commands without requests say so"""
+        self.run_cmd('profile', 'on')
+        self.assertEqual(self.run_cmd('help')[2], ['No network requests'])
+
+    def test_off(self):
+        """profile off stops the summaries"""
+        self.run_cmd('profile', 'on')
+        self.assertEqual(self.run_cmd('profile', 'off')[1],
+                         ['Profiling is off'])
+        self.assertEqual(self.run_cmd('volume', self.ips[0])[2], [])
+        self.assertEqual(self.socos.http_pool.listeners, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
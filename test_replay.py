@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+"""Tests of recording commands and replaying them"""
+
+import os
+import sys
+import unittest
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+import soco
+
+from socos.cache import QUERY_CACHE
+from socos.core import SoCos
+from socos.replay import replay
+from socos.utils import COORDINATOR_CACHE, open_binary
+
+from simulator_case import SYSTEM, SimulatorTestCase
+
+
+class ReplayTest(SimulatorTestCase):
+    """Recording commands and replaying them without the speakers"""
+
+    def record(self):
+        """Record a few commands and return the path of the recording"""
+        path = os.path.join(self.cache_dir, 'recording.jsonl.gz')
+        self.socos.record(path)
+        for args in [['volume', self.ips[0], '+5'],
+                     ['queue', self.ips[0], '1..3'],
+                     ['mode', self.ips[0], 'BOGUS']]:
+            self.run_cmd(*args)
+        self.socos.recorder.close()
+        return path
+
+    def restart(self):
+        """Start over with a new SoCos, like a new socos process would"""
+        # pylint: disable=protected-access,no-member
+        self.socos.http_pool.uninstall()
+        self.socos.http_pool.close()
+        soco.SoCo._instances.clear()
+        soco.services.zone_group_state_shared_cache.clear()
+        COORDINATOR_CACHE.clear()
+        QUERY_CACHE.clear()
+        self.socos = SoCos()
+
+    def replay(self, path, time_budget=None):
+        """Replay a recording like a new socos process would
+
+        Returns:
+            tuple: The exit code, the report, the requests that reached
+            the speakers and the lines the commands printed to stdout
+        """
+        self.restart()
+        out = StringIO()
+        before = SYSTEM.requests
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = StringIO(), StringIO()
+        try:
+            code = replay(self.socos, path, time_budget, out)
+            printed = sys.stdout.getvalue()
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+        return (code, out.getvalue().splitlines(), SYSTEM.requests - before,
+                printed.splitlines())
+
+    def test_replay(self):
+        """The recorded responses are served instead of the speakers"""
+        code, report, sent, printed = self.replay(self.record())
+        self.assertEqual((code, sent), (0, 0))
+        self.assertEqual(len(report), 4)
+        expected = 'volume {} +5: 1 requests (1 recorded)'.format(
+            self.ips[0])
+        self.assertTrue(report[0].startswith(expected), report[0])
+        # The output of the recorded responses
+        self.assertEqual(printed[0], '25')
+        self.assertEqual(len(printed), 4)
+        self.assertIn('Foo 1', printed[1])
+
+    def test_unexpected_request(self):
+        """A request that was not recorded fails the replay"""
+        path = self.record()
+        with open_binary(path, 'r') as recording:
+            lines = recording.readlines()
+        # Leave out the request of "volume +5"
+        with open_binary(path, 'w') as recording:
+            recording.writelines(lines[:1] + lines[2:])
+        code, report, sent, _ = self.replay(path)
+        self.assertEqual((code, sent), (1, 0))
+        self.assertIn('  unexpected request: POST http://{}:1400/'
+                      'MediaRenderer/RenderingControl/Control'.format(
+                          self.ips[0]), report)
+        self.assertEqual(report[-1], '1 failures')
+
+    def test_time_budget(self):
+        """A replay taking longer than the time budget fails"""
+        code, report, _, _ = self.replay(self.record(), 0)
+        self.assertEqual(code, 1)
+        self.assertIn('Over the time budget of 0.0 ms', report)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+"""Tests of running commands on several speakers with target selectors"""
+
+import unittest
+
+from simulator_case import SYSTEM, SimulatorTestCase
+
+
+class FanOutTest(SimulatorTestCase):
+    """Commands run on several speakers at once"""
+
+    def test_remove_runs_once_per_group(self):
+        """remove @all removes the track from the group queue only once"""
+        self.group()
+        success, _, err = self.run_cmd('remove', '@all', '1')
+        self.assertTrue(success, err)
+        self.assertEqual(len(SYSTEM.speakers[0].queue), 29)
+
+    def test_add_from_library_on_members(self):
+        """Library results are added to the queue of the coordinator"""
+        self.group()
+        success, out, err = self.run_cmd('tracks', '@1,2,3', 'foo', 'add',
+                                         '1')
+        self.assertTrue(success, err)
+        self.assertEqual(len(out), 1)
+        self.assertEqual(len(SYSTEM.speakers[0].queue), 31)
+
+    def test_settings_per_speaker(self):
+        """volume @all changes the volume of every speaker"""
+        self.group()
+        success, out, err = self.run_cmd('volume', '@all', '+5')
+        self.assertTrue(success, err)
+        self.assertEqual(len(out), 3)
+        self.assertEqual([speaker.volume for speaker in SYSTEM.speakers],
+                         [25, 25, 25])
+
+    def test_group_selector(self):
+        """@group:NAME selects the members of the group of NAME"""
+        SYSTEM.speakers[1].coordinator = SYSTEM.speakers[0]
+        self.run_cmd('list')
+        success, out, err = self.run_cmd('volume', '@group:room 2', '+1')
+        self.assertTrue(success, err)
+        self.assertEqual(out, ['[Room 1] 21', '[Room 2] 21'])
+        self.assertEqual(SYSTEM.speakers[2].volume, 20)
+
+    def test_no_match(self):
+        """A selector matching no speaker fails the command"""
+        self.run_cmd('list')
+        success, out, err = self.run_cmd('volume', '@group:kitchen')
+        self.assertFalse(success)
+        self.assertEqual(out, [])
+        self.assertEqual(err, ['No speakers match "@group:kitchen"'])
+
+    def test_streaming_command(self):
+        """Commands running until interrupted are refused with selectors"""
+        for selector in ['@all', '@1,2']:
+            success, out, err = self.run_cmd('watch', selector, 'state')
+            self.assertFalse(success)
+            self.assertEqual(out, [])
+            self.assertEqual(err, [
+                '"watch" runs until interrupted, give a single speaker '
+                'instead of "{}"'.format(selector)])
+
+    def test_index_search_from_threads(self):
+        """The library index answers searches from the fan-out threads"""
+        success, _, err = self.run_cmd('library', self.ips[0], 'index')
+        self.assertTrue(success, err)
+        success, out, err = self.run_cmd('tracks', '@all', 'bar')
+        self.assertTrue(success, err)
+        self.assertEqual(len(out), 3 * 13)
+        self.assertTrue(out[0].endswith('Bar 2 on Album 1 by Artist 1'))
+
+
+if __name__ == '__main__':
+    unittest.main()